@@ -0,0 +1,206 @@
+"""HTTP request class for Bot API calls that records per-method metrics.
+
+It can also retry idempotent calls that failed for want of an answer (network
+errors, timeouts, 5xx), with jittered exponential backoff, and consult a
+:class:`~circuitbreaker.CircuitBreaker` so that calls fail fast while the Bot
+API is down.
+"""
+import asyncio
+import logging
+import random
+import ssl
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest
+
+from circuitbreaker import CircuitBreaker, CircuitOpenError
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.telegram.org/bot'
+DEFAULT_BASE_FILE_URL = 'https://api.telegram.org/file/bot'
+
+API_REQUEST_SECONDS = Histogram(
+    'bot_api_request_seconds', "Time spent waiting for each Bot API call.", ('method',))
+API_REQUESTS = Counter(
+    'bot_api_requests', "Bot API calls by method and HTTP status; status 0 means no response.", ('method', 'status'))
+API_RETRIES = Counter('bot_api_retries', "Bot API calls retried after a network error or 5xx.", ('method',))
+API_CALLS_REJECTED = Counter('bot_api_calls_rejected', "Bot API calls failed fast by the circuit breaker.",
+                             ('method',))
+
+# Methods that have the same effect when repeated, so a call whose answer was
+# lost can safely be made again. Sending is not: a retry could send twice
+IDEMPOTENT_METHODS = frozenset({
+    'getMe', 'getWebhookInfo', 'getChat', 'getChatMember', 'getFile', 'getMyCommands', 'setMyCommands',
+    'deleteMyCommands', 'setWebhook', 'deleteWebhook', 'editMessageText', 'editMessageReplyMarkup',
+    'editMessageCaption',
+})
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+
+def backoff(attempt: int, base: float = 0.2, cap: float = 2.0) -> float:
+    """Seconds to wait before retry number ``attempt`` (1-based), with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """``HTTPXRequest`` that times every call by Bot API method.
+
+    Args:
+        breaker: Fail calls fast with ``CircuitOpenError`` while this breaker is
+            open, and report each call's outcome to it.
+        max_retries: Retries for idempotent methods after a network error,
+            timeout or 5xx.
+        warm_up_url: Bot API URL (e.g. of getMe) to call when initialized, so
+            that the first real call finds a connection, TLS handshake done,
+            in the pool. Calls made meanwhile wait for it.
+        *args, **kwargs: Passed on to ``HTTPXRequest``.
+    """
+
+    __slots__ = ('_breaker', '_max_retries', '_warm_up_url', '_warm_up')
+
+    def __init__(self, *args: Any, breaker: Optional[CircuitBreaker] = None, max_retries: int = 0,
+                 warm_up_url: Optional[str] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._breaker = breaker
+        self._max_retries = max_retries
+        self._warm_up_url = warm_up_url
+        self._warm_up: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        await super().initialize()
+        if self._warm_up_url and self._warm_up is None:
+            self._warm_up = asyncio.create_task(self._open_connection(self._warm_up_url))
+
+    async def shutdown(self) -> None:
+        if self._warm_up is not None:
+            self._warm_up.cancel()
+            self._warm_up = None
+        await super().shutdown()
+
+    async def _open_connection(self, url: str, timeout: float = 10.0) -> None:
+        try:
+            await self._timed_request(url.rsplit('/', 1)[-1], url, 'POST', read_timeout=timeout,
+                                      write_timeout=timeout, connect_timeout=timeout, pool_timeout=timeout)
+        except NetworkError as exc:
+            # The first real call will open a connection and report the problem
+            logger.debug("Could not open a Bot API connection ahead of time: %s", exc)
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> Tuple[int, bytes]:
+        if self._warm_up is not None and not self._warm_up.done():
+            await asyncio.wait((self._warm_up,))
+        api_method = url.rsplit('/', 1)[-1]
+        breaker = self._breaker
+        retries = self._max_retries if api_method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            if breaker is not None:
+                retry_in = breaker.retry_in()
+                if retry_in is not None:
+                    API_CALLS_REJECTED.labels(api_method).inc()
+                    raise CircuitOpenError(api_method, retry_in)
+            try:
+                status, payload = await self._timed_request(api_method, url, method, request_data, *args, **kwargs)
+            except NetworkError as exc:
+                # Includes TimedOut. Waiting for a free connection is our own
+                # congestion, not the API failing
+                if isinstance(exc.__cause__, httpx.PoolTimeout):
+                    raise
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt == retries:
+                    raise
+            else:
+                if status not in RETRY_STATUSES:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return status, payload
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt == retries:
+                    return status, payload
+            attempt += 1
+            API_RETRIES.labels(api_method).inc()
+            await asyncio.sleep(backoff(attempt))
+
+    async def _timed_request(self, api_method: str, url: str, method: str, request_data=None, *args,
+                             **kwargs) -> Tuple[int, bytes]:
+        started = time.perf_counter()
+        status = 0
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            return status, payload
+        finally:
+            API_REQUEST_SECONDS.labels(api_method).observe(time.perf_counter() - started)
+            API_REQUESTS.labels(api_method, str(status)).inc()
+
+
+def build_request(pool_size: int, http_version: str = '1.1', keepalive_connections: Optional[int] = None,
+                  keepalive_expiry: float = 5.0, pool_timeout: Optional[float] = 1.0,
+                  ssl_context: Optional[ssl.SSLContext] = None, **kwargs) -> InstrumentedRequest:
+    """An :class:`InstrumentedRequest` with its own connection pool.
+
+    Args:
+        pool_size: Connections open at most. With HTTP/1.1 this is how many
+            calls can be in flight at once; further calls wait up to
+            ``pool_timeout`` for a connection. HTTP/2 multiplexes calls over
+            a connection, as many as the server allows.
+        http_version: ``'1.1'`` or ``'2'``. HTTP/2 needs ``h2``
+            (``python-telegram-bot[http2]``).
+        keepalive_connections: Idle connections kept open for reuse, by default
+            all of them; 0 opens a new connection for every call.
+        keepalive_expiry: Seconds an idle connection is kept open.
+        pool_timeout: Seconds a call may wait for a free connection.
+        ssl_context: TLS settings to use. Loading the CA certificates takes
+            a few tens of milliseconds, so share one context between requests.
+        **kwargs: Passed on to :class:`InstrumentedRequest`.
+    """
+    limits = httpx.Limits(max_connections=pool_size,
+                          max_keepalive_connections=pool_size if keepalive_connections is None else keepalive_connections,
+                          keepalive_expiry=keepalive_expiry)
+    httpx_kwargs: Dict[str, Any] = {'limits': limits}
+    if ssl_context is not None:
+        httpx_kwargs['verify'] = ssl_context
+    return InstrumentedRequest(connection_pool_size=pool_size, http_version=http_version,
+                               pool_timeout=pool_timeout, httpx_kwargs=httpx_kwargs, **kwargs)
+
+
+def check_bot_api(token: str, base_url: str = DEFAULT_BASE_URL, timeout: float = 5.0, attempts: int = 3,
+                  delay: float = 2.0, ssl_context: Optional[ssl.SSLContext] = None) -> Dict[str, Any]:
+    """Call getMe until the Bot API server at ``base_url`` answers.
+
+    Meant for startup, before the application is built, so that an
+    unreachable self-hosted server is reported as such instead of as a failed
+    ``initialize``. It blocks, so it can run in a thread while the
+    application is built. Returns the bot's user as a dict.
+
+    Raises:
+        RuntimeError: The server did not answer after ``attempts`` tries, or
+            rejected the token.
+    """
+    url = f"{base_url}{token}/getMe"
+    error: object = None
+    for attempt in range(1, attempts + 1):
+        started = time.perf_counter()
+        try:
+            response = httpx.get(url, timeout=timeout, verify=ssl_context or True)
+            payload = response.json()
+        except (httpx.HTTPError, ValueError) as exc:
+            error = exc
+        else:
+            if payload.get('ok'):
+                logger.info("Bot API at %s answered getMe in %.0f ms", base_url,
+                            (time.perf_counter() - started) * 1000)
+                return payload['result']
+            error = f"{response.status_code} {payload.get('description')}"
+            if response.status_code in (401, 404):
+                # Answered, but the token is wrong or this is not a Bot API server
+                break
+        logger.warning("Bot API at %s not reachable (attempt %d of %d): %s", base_url, attempt, attempts, error)
+        if attempt < attempts:
+            time.sleep(delay)
+    raise RuntimeError(f"Bot API at {base_url} did not accept getMe: {error}")
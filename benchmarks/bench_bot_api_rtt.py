@@ -0,0 +1,109 @@
+"""Round-trip time per Bot API method for each configured endpoint.
+
+Compares, for example, api.telegram.org with a self-hosted Bot API server. The
+endpoints are the ``--endpoint`` base URLs, plus ``BOT_API_BASE_URL`` if set,
+plus the cloud API when ``--cloud`` is given; ``--fake`` adds the local fake
+server with ``--latency-ms`` as a baseline. Calls are made one at a time over
+a kept-alive connection, so each sample is one round trip. Read-only methods
+are always measured; with ``--chat-id`` (a chat that has started the bot)
+sendMessage and editMessageText are too. Real endpoints use ``BOT_TOKEN``.
+
+    python -m benchmarks.bench_bot_api_rtt [--endpoint http://localhost:8081/bot] [--cloud] [--fake] [--samples 50]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram import Bot
+
+from apirequest import DEFAULT_BASE_URL, build_request
+from benchmarks.fake_bot_api import FakeBotAPI, FakeBotAPIProcess
+
+FAKE_TOKEN = '123456:fake-token'
+
+
+async def serve(api: FakeBotAPI) -> None:
+    return None
+
+
+def method_calls(bot: Bot, chat_id: Optional[int]) -> Dict[str, Callable[[], Awaitable]]:
+    calls = {'getMe': bot.get_me, 'getWebhookInfo': bot.get_webhook_info}
+    if chat_id is not None:
+        message = None
+
+        async def send_message():
+            nonlocal message
+            message = await bot.send_message(chat_id, "Round trip test")
+
+        async def edit_message_text():
+            await bot.edit_message_text(f"Round trip test {time.perf_counter()}", chat_id, message.message_id)
+
+        calls['sendMessage'] = send_message
+        calls['editMessageText'] = edit_message_text
+    return calls
+
+
+async def measure(base_url: str, token: str, chat_id: Optional[int], samples: int) -> Dict[str, List[float]]:
+    timings = {}
+    async with Bot(token, base_url=base_url, request=build_request(1)) as bot:
+        for method, call in method_calls(bot, chat_id).items():
+            timings[method] = []
+            for _ in range(samples):
+                started = time.perf_counter()
+                await call()
+                timings[method].append(time.perf_counter() - started)
+    return timings
+
+
+async def run(endpoints: List[str], fake: bool, latency: float, token: str, chat_id: Optional[int],
+              samples: int) -> Dict[str, Dict[str, List[float]]]:
+    results = {}
+    for base_url in endpoints:
+        results[base_url] = await measure(base_url, token, chat_id, samples)
+    if fake:
+        async with FakeBotAPIProcess(serve, latency=latency) as api:
+            async with Bot(FAKE_TOKEN, base_url=api.base_url) as bot:
+                # The fake server starts serving the scenario once the bot polls
+                await bot.get_updates(timeout=0)
+            results[f"fake ({latency * 1000:.0f} ms)"] = await measure(
+                api.base_url, FAKE_TOKEN, 1 if chat_id is not None or not endpoints else None, samples)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', action='append', default=[], help="Bot API base URL, e.g. http://host:8081/bot")
+    parser.add_argument('--cloud', action='store_true', help=f"also measure {DEFAULT_BASE_URL}")
+    parser.add_argument('--fake', action='store_true', help="also measure the local fake server")
+    parser.add_argument('--latency-ms', type=float, default=0, help="simulated latency of the fake server")
+    parser.add_argument('--chat-id', type=int, help="chat to send test messages to")
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+
+    endpoints = list(args.endpoint)
+    if os.getenv('BOT_API_BASE_URL') and os.environ['BOT_API_BASE_URL'] not in endpoints:
+        endpoints.append(os.environ['BOT_API_BASE_URL'])
+    if args.cloud:
+        endpoints.append(DEFAULT_BASE_URL)
+    token = os.getenv('BOT_TOKEN')
+    if endpoints and not token:
+        parser.error("BOT_TOKEN must be set to measure a real Bot API server")
+    if not endpoints and not args.fake:
+        parser.error("nothing to measure: give --endpoint, --cloud or --fake")
+
+    results = asyncio.run(run(endpoints, args.fake, args.latency_ms / 1000, token, args.chat_id, args.samples))
+    print(f"{args.samples} sequential calls per method")
+    print(f"{'endpoint':<40} {'method':<16} {'p50':>8} {'p95':>8} {'max':>8}")
+    for endpoint, timings in results.items():
+        for method, samples in timings.items():
+            samples.sort()
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            print(f"{endpoint:<40} {method:<16} {statistics.median(samples) * 1000:6.1f}ms "
+                  f"{p95 * 1000:6.1f}ms {samples[-1] * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
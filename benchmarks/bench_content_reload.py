@@ -0,0 +1,115 @@
+"""Time to reload content packs, and how long the event loop stalls meanwhile.
+
+Copies the packs from ``content/`` to a temporary directory, adds ``--extra``
+copies of the largest topic to model a bigger course, and times a full load, a
+poll that finds nothing changed, and a reload after one topic's pack changed.
+The last column is the longest the event loop went without running while that
+reload ran, in the watcher's thread or directly on the loop.
+
+    python -m benchmarks.bench_content_reload [--extra 100] [--rounds 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from content import ContentLibrary, read_topic
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'content')
+TOPIC = 'advanced'
+
+
+def make_course(directory: str, extra: int) -> None:
+    shutil.copytree(SOURCE, directory, dirs_exist_ok=True)
+    with open(os.path.join(directory, 'index.json'), encoding='utf-8') as file:
+        index = json.load(file)
+    lesson, quiz = read_topic(os.path.join(SOURCE, f'{TOPIC}.json'))
+    for number in range(extra):
+        name = f'{TOPIC}_{number}'
+        index['topics'].append({'name': name, 'title': f"Advanced Topics {number}"})
+        with open(os.path.join(directory, f'{name}.json'), 'w', encoding='utf-8') as file:
+            json.dump({'version': 1, 'lesson': lesson, 'quiz': quiz}, file)
+    with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as file:
+        json.dump(index, file)
+
+
+def edit_topic(directory: str, round_number: int) -> None:
+    path = os.path.join(directory, f'{TOPIC}.json')
+    with open(path, encoding='utf-8') as file:
+        pack = json.load(file)
+    pack['lesson'][0] = f"Revision {round_number}: {pack['lesson'][0].split(': ', 1)[-1]}"
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(pack, file)
+
+
+async def longest_stall(reload, in_thread: bool) -> float:
+    """Longest gap between ticks of a 1 ms timer while ``reload`` runs."""
+    longest = 0.0
+    done = False
+
+    async def ticker() -> None:
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    if in_thread:
+        await asyncio.to_thread(reload)
+    else:
+        reload()
+    await asyncio.sleep(0.01)
+    done = True
+    await task
+    return longest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--extra', type=int, default=100, help="extra topics added to the course")
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_course(directory, args.extra)
+        started = time.perf_counter()
+        library = ContentLibrary(directory)
+        full_load = time.perf_counter() - started
+        topics = len(library.pages.by_id)
+
+        polls = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            library.reload()
+            polls.append(time.perf_counter() - started)
+
+        reloads, stalls = [], {True: [], False: []}
+        for round_number in range(args.rounds):
+            in_thread = round_number % 2 == 0
+            edit_topic(directory, round_number)
+
+            def reload() -> None:
+                started = time.perf_counter()
+                assert library.reload() == 1
+                reloads.append(time.perf_counter() - started)
+
+            stalls[in_thread].append(asyncio.run(longest_stall(reload, in_thread)))
+
+    print(f"{topics} topics, {args.rounds} rounds")
+    print(f"full load                       {full_load * 1000:8.1f} ms")
+    print(f"poll, nothing changed           {statistics.median(polls) * 1000:8.2f} ms")
+    print(f"reload, one topic changed       {statistics.median(reloads) * 1000:8.2f} ms")
+    for in_thread, name in ((True, "in a thread"), (False, "on the event loop")):
+        print(f"longest loop stall, {name:<18}{statistics.median(stalls[in_thread]) * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
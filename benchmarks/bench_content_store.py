@@ -0,0 +1,141 @@
+"""Memory per worker process and page lookup cost for each way of holding content.
+
+Builds a course of the packs in ``content/`` plus ``--extra`` copies of the
+largest topic and starts ``--workers`` processes at once for each setup:
+
+- ``dict of lists``: the raw lesson and quiz lists, as bot.py used to hold them
+  (texts only, keyboards would still be built per call)
+- ``compiled``: every page compiled in the process (ContentLibrary)
+- ``mapped store``: the compiled store file mapped by every process (StoreLibrary)
+
+Each worker loads the content, looks up ``--lookups`` random lesson pages and
+reports its memory from /proc: RSS counts pages shared with other processes in
+full, PSS divides them among the processes sharing them, and private memory is
+what the process alone holds. Linux only. Lookup times are measured in this
+process, over 1000 pages looked up again and again, and for the mapped store
+also with every lookup decoding its page.
+
+    python -m benchmarks.bench_content_store [--extra 500] [--workers 4] [--lookups 10000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import timeit
+
+from benchmarks.bench_content_reload import make_course
+from content import ContentLibrary, read_index, read_topic
+from contentstore import StoreLibrary, write_store
+
+SETUPS = ('dict of lists', 'compiled', 'mapped store')
+
+
+def memory() -> dict:
+    """RSS, PSS and private memory of this process in bytes."""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as file:
+        for line in file:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0]) * 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'],
+            'private': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def load(setup: str, directory: str, store: str):
+    if setup == 'dict of lists':
+        _, menu_topics = read_index(os.path.join(directory, 'index.json'))
+        lessons, quizzes = {}, {}
+        for name, _ in menu_topics:
+            lessons[name], quizzes[name] = read_topic(os.path.join(directory, f'{name}.json'))
+        return lessons, quizzes
+    if setup == 'compiled':
+        return ContentLibrary(directory)
+    return StoreLibrary(store)
+
+
+def lookups(setup: str, content, count: int, seed: int) -> None:
+    rng = random.Random(seed)
+    if setup == 'dict of lists':
+        lessons = list(content[0].values())
+        for _ in range(count):
+            lesson = rng.choice(lessons)
+            lesson[rng.randrange(len(lesson))]
+        return
+    topics = content.pages.by_id
+    for _ in range(count):
+        topic = rng.choice(topics)
+        topic.lesson[rng.randrange(len(topic.lesson))]
+
+
+def worker(setup: str, directory: str, store: str, count: int, seed: int, barrier, results) -> None:
+    before = memory()
+    content = load(setup, directory, store)
+    lookups(setup, content, count, seed)
+    barrier.wait()
+    after = memory()
+    results.put({key: after[key] - before[key] for key in after})
+    # Hold on until every worker has measured, so shared pages are counted as shared
+    barrier.wait()
+
+
+def measure_workers(setup: str, directory: str, store: str, workers: int, count: int) -> dict:
+    context = multiprocessing.get_context('spawn')
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [context.Process(target=worker, args=(setup, directory, store, count, seed, barrier, results))
+                 for seed in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {key: statistics.mean(sample[key] for sample in samples) for key in samples[0]}
+
+
+def lookup_seconds(setup: str, content) -> float:
+    rng = random.Random(0)
+    if setup == 'dict of lists':
+        lessons = list(content[0].values())
+        hot = [(lesson, rng.randrange(len(lesson))) for lesson in rng.choices(lessons, k=1000)]
+        positions = rng.choices(hot, k=10000)
+        call = lambda: [lesson[index] for lesson, index in positions]
+    else:
+        topics = content.pages.by_id
+        hot = [(topic, rng.randrange(len(topic.lesson))) for topic in rng.choices(topics, k=1000)]
+        positions = rng.choices(hot, k=10000)
+        call = lambda: [topic.lesson[index] for topic, index in positions]
+    call()
+    return min(timeit.repeat(call, number=1, repeat=5)) / len(positions)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--extra', type=int, default=500, help="extra topics added to the course")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=10000, help="random page lookups per worker")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_course(directory, args.extra)
+        store = os.path.join(directory, 'content.store')
+        library = ContentLibrary(directory)
+        write_store(library.pages, library.menu_topics, store, library.current.search)
+        pages = sum(len(topic.lesson) for topic in library.pages.by_id)
+        print(f"{len(library.pages.by_id)} topics, {pages} lesson pages, store {os.path.getsize(store) / 2 ** 20:.1f} MB, "
+              f"{args.workers} workers, {args.lookups} lookups each")
+        print(f"{'':<14} {'RSS/worker':>11} {'PSS/worker':>11} {'private':>9} {'lookup':>9} {'decode':>9}")
+        for setup in SETUPS:
+            used = measure_workers(setup, directory, store, args.workers, args.lookups)
+            content = load(setup, directory, store)
+            cached = lookup_seconds(setup, content)
+            uncached = ''
+            if setup == 'mapped store':
+                uncached = f"{lookup_seconds(setup, StoreLibrary(store, cache_size=0)) * 1e6:7.2f}us"
+            print(f"{setup:<14} {used['rss'] / 2 ** 20:9.1f}MB {used['pss'] / 2 ** 20:9.1f}MB "
+                  f"{used['private'] / 2 ** 20:7.1f}MB {cached * 1e6:7.2f}us {uncached:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Memory held by content versions across many reloads while learners read them.
+
+``--learners`` sessions are spread over the topics. Before every reload one
+topic's pack changes; after it a ``--turnover`` share of the learners moves
+on, half of them to a topic in the new version, half back to the menu, which
+releases the version they were reading. The others keep the version they
+started in. Reported every tenth of the run: versions still in memory and the
+memory traced by tracemalloc. The second run changes every topic before each
+reload, so no pages can be shared between versions.
+
+    python -m benchmarks.bench_content_versions [--learners 1000] [--reloads 200] [--turnover 0.2]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import tracemalloc
+
+from benchmarks.bench_content_reload import make_course
+from content import ContentLibrary
+from session import Session
+
+
+def touch(path: str, revision: int) -> None:
+    with open(path, encoding='utf-8') as file:
+        pack = json.load(file)
+    pack['lesson'][0] = f"Revision {revision}: {pack['lesson'][0].split(': ', 1)[-1]}"
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(pack, file)
+    # Writes in quick succession can get the same modification time
+    os.utime(path, ns=(revision * 10 ** 9, revision * 10 ** 9))
+
+
+def run(learners: int, reloads: int, turnover: float, extra: int, every_topic: bool) -> list:
+    rows = []
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        make_course(directory, extra)
+        tracemalloc.start()
+        library = ContentLibrary(directory)
+        names = [name for name, _ in library.menu_topics]
+        sessions = []
+        for _ in range(learners):
+            session = Session()
+            session.start(rng.randrange(len(names)), library.current)
+            sessions.append(session)
+
+        for revision in range(1, reloads + 1):
+            changed = names if every_topic else [names[revision % len(names)]]
+            for name in changed:
+                touch(library.pack_path(name), revision)
+            library.reload()
+            for session in rng.sample(sessions, int(learners * turnover)):
+                if rng.random() < 0.5:
+                    session.start(rng.randrange(len(names)), library.current)
+                else:
+                    session.snapshot = None
+            if revision % max(1, reloads // 10) == 0:
+                rows.append((revision, library.live_versions, tracemalloc.get_traced_memory()[0]))
+        tracemalloc.stop()
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--learners', type=int, default=1000)
+    parser.add_argument('--reloads', type=int, default=200)
+    parser.add_argument('--turnover', type=float, default=0.2, help="share of learners moving on per reload")
+    parser.add_argument('--extra', type=int, default=15, help="extra topics added to the course")
+    args = parser.parse_args()
+
+    for every_topic, name in ((False, "one topic changed per reload"), (True, "every topic changed per reload")):
+        print(f"{name}, {args.learners} learners, {args.turnover:.0%} moving on per reload")
+        print(f"{'reloads':>8} {'versions':>9} {'memory':>10}")
+        for revision, versions, memory in run(args.learners, args.reloads, args.turnover, args.extra, every_topic):
+            print(f"{revision:8d} {versions:9d} {memory / 2 ** 20:8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
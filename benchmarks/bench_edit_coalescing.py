@@ -0,0 +1,92 @@
+"""Message edits per burst of rapid "Next" taps.
+
+Each simulated learner opens the advanced lesson and taps "Next" ``--taps``
+times, ``--interval-ms`` apart, without waiting for the pages, like someone
+scrolling through a lesson. Reported per learner: taps sent, editMessageText
+calls the bot made, whether the message ended on the last page tapped, and
+the time from the last tap until that page was shown.
+
+    python -m benchmarks.bench_edit_coalescing [--users 20] [--taps 8] [--interval-ms 100] [--latency-ms 150]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.fake_bot_api import FakeBotAPI, FakeBotAPIProcess
+from bot import CONTENT, build_application
+from pages import LESSON, TOPIC, callback_data
+from replies import Replies
+
+TOKEN = '123456:fake-token'
+TOPIC_NAME = 'advanced'
+
+
+async def learner(api: FakeBotAPI, user_id: int, taps: int, interval: float) -> dict:
+    topic_id = CONTENT.pages.topic_ids[TOPIC_NAME]
+    topic = CONTENT.pages.by_id[topic_id]
+    replies = api.replies(user_id)
+    api.command(user_id, '/start')
+    message_id = (await replies.get()).result['message_id']
+
+    api.tap(user_id, message_id, callback_data(TOPIC, topic_id))
+    for page in range(1, taps + 1):
+        await asyncio.sleep(interval)
+        last_tap = time.perf_counter()
+        api.tap(user_id, message_id, callback_data(LESSON, topic_id, page, topic.version))
+
+    expected = topic.lesson[taps].text if taps < len(topic.lesson) else topic.lesson_complete.text
+    edits = []
+    while True:
+        try:
+            call = await asyncio.wait_for(replies.get(), timeout=5.0)
+        except asyncio.TimeoutError:
+            break
+        if call.method == 'editMessageText':
+            edits.append(call)
+    return {
+        'taps': taps + 1,
+        'edits': len(edits),
+        'correct': bool(edits) and edits[-1].params['text'] == expected,
+        'settle': edits[-1].at - last_tap if edits else float('nan'),
+    }
+
+
+async def scenario(api: FakeBotAPI, users: int, taps: int, interval: float) -> list:
+    return await asyncio.gather(*(learner(api, user_id, taps, interval) for user_id in range(1, users + 1)))
+
+
+async def run(users: int, taps: int, interval: float, latency: float) -> list:
+    async with FakeBotAPIProcess(scenario, users, taps, interval, latency=latency) as api:
+        application = build_application(TOKEN, api.base_url)
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            results = await api.result()
+            # Answers still on their way would fail once the application shuts down
+            await Replies.of(application).drain()
+            await application.updater.stop()
+            await application.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--taps', type=int, default=8, help="Next taps per learner, at most the lesson length")
+    parser.add_argument('--interval-ms', type=float, default=100)
+    parser.add_argument('--latency-ms', type=float, default=150, help="simulated Bot API latency per call")
+    args = parser.parse_args()
+    taps = min(args.taps, len(CONTENT.pages.topics[TOPIC_NAME].lesson))
+
+    results = asyncio.run(run(args.users, taps, args.interval_ms / 1000, args.latency_ms / 1000))
+    print(f"{args.users} learners, {taps} Next taps {args.interval_ms:.0f} ms apart, "
+          f"{args.latency_ms:.0f} ms per Bot API call")
+    print(f"taps per learner   {statistics.mean(r['taps'] for r in results):6.1f}")
+    print(f"edits per learner  {statistics.mean(r['edits'] for r in results):6.1f}")
+    print(f"ended on last page {sum(r['correct'] for r in results)}/{len(results)}")
+    print(f"last tap to last page shown: median {statistics.median(r['settle'] for r in results) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Throughput and tail latency of Bot API calls for different connection pool settings.
+
+``--concurrency`` handlers each send messages back to back through one bot, as
+during a busy quiz, against the local fake Bot API with ``--latency-ms`` per
+call. Each row is one request setup: HTTP version, pool size and keepalive;
+calls that fail are counted as errors.
+
+httpcore looks at every connection in the pool each time it hands one out, so
+with HTTP/1.1 a large pool of kept-alive connections costs CPU on every call.
+Keeping no idle connections avoids that here only because the fake server is
+plain TCP; against api.telegram.org every call would then pay a TLS handshake.
+HTTP/2 needs one connection for many concurrent calls. The fake server speaks
+it over plain TCP, like a local Bot API; api.telegram.org negotiates it over TLS.
+
+    python -m benchmarks.bench_http_pool [--calls 3000] [--concurrency 256] [--latency-ms 20]
+"""
+import argparse
+import asyncio
+import time
+import warnings
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from apirequest import build_request
+from benchmarks.fake_bot_api import FakeBotAPI, FakeBotAPIProcess
+
+TOKEN = '123456:fake-token'
+
+# (HTTP version, pool size, idle connections kept), the first being PTB's default
+SETUPS = (
+    ('1.1', 1, None),
+    ('1.1', 8, None),
+    ('1.1', 64, None),
+    ('1.1', 256, None),
+    ('1.1', 256, 0),
+    ('2', 1, None),
+    ('2', 8, None),
+)
+
+
+async def serve(api: FakeBotAPI) -> None:
+    return None
+
+
+async def sweep_one(base_url: str, http_version: str, pool_size: int, keepalive, calls: int,
+                    concurrency: int) -> tuple:
+    request = build_request(pool_size, http_version, keepalive_connections=keepalive)
+    latencies, errors = [], 0
+
+    async def sender(worker: int) -> None:
+        nonlocal errors
+        for _ in range(worker, calls, concurrency):
+            started = time.perf_counter()
+            try:
+                await bot.send_message(worker + 1, "Correct! Next question:")
+            except TelegramError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    async with Bot(TOKEN, base_url=base_url, request=request) as bot:
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(worker) for worker in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(latencies) / elapsed, latencies, errors
+
+
+async def run(calls: int, concurrency: int, latency: float) -> list:
+    rows = []
+    async with FakeBotAPIProcess(serve, latency=latency) as api:
+        async with Bot(TOKEN, base_url=api.base_url) as bot:
+            # The fake server starts serving the scenario once the bot polls
+            await bot.get_updates(timeout=0)
+        for http_version, pool_size, keepalive in SETUPS:
+            rows.append(((http_version, pool_size, keepalive),
+                         await sweep_one(api.base_url, http_version, pool_size, keepalive, calls, concurrency)))
+    return rows
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--latency-ms', type=float, default=20, help="simulated Bot API latency per call")
+    args = parser.parse_args()
+    # PTB warns that a self-hosted Bot API only speaks HTTP/1.1; the fake speaks both
+    warnings.filterwarnings('ignore', message='You set the HTTP version')
+
+    rows = asyncio.run(run(args.calls, args.concurrency, args.latency_ms / 1000))
+    print(f"{args.calls} sendMessage calls from {args.concurrency} concurrent handlers, "
+          f"{args.latency_ms:.0f} ms per call")
+    print(f"{'HTTP':<5} {'pool':>5} {'keepalive':>10} {'calls/s':>9} {'p50':>8} {'p99':>8} {'errors':>7}")
+    for (http_version, pool_size, keepalive), (throughput, latencies, errors) in rows:
+        kept = 'all' if keepalive is None else str(keepalive)
+        print(f"{http_version:<5} {pool_size:5d} {kept:>10} {throughput:9.0f} "
+              f"{percentile(latencies, 0.5) * 1000:6.0f}ms {percentile(latencies, 0.99) * 1000:6.0f}ms {errors:7d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Update latency with long polling versus webhook ingestion.
+
+Runs the real application from bot.py against the fake Bot API server. A burst of
+simulated users all send /start at once (the spike after a broadcast) and then tap
+into a lesson; latency is measured from the moment Telegram would have the update
+until the bot's reply reaches the fake server.
+
+    python -m benchmarks.bench_ingest [--users 200] [--latency-ms 30]
+
+Webhook mode needs the webhooks extra: pip install "python-telegram-bot[webhooks]".
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+
+from benchmarks.fake_bot_api import FakeBotAPI, FakeBotAPIProcess
+from bot import CONTENT, build_application
+from pages import TOPIC, callback_data
+from replies import Replies
+
+TOKEN = '123456:fake-token'
+SECRET = 'benchmark-secret'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def user_session(api: FakeBotAPI, user_id: int, latencies: list) -> None:
+    replies = api.replies(user_id)
+    sent = time.perf_counter()
+    api.command(user_id, '/start')
+    menu = await replies.get()
+    latencies.append(menu.at - sent)
+
+    sent = time.perf_counter()
+    api.tap(user_id, 1, callback_data(TOPIC, CONTENT.pages.topic_ids['intro']))
+    while (reply := await replies.get()).method != 'editMessageText':
+        pass
+    latencies.append(reply.at - sent)
+
+
+async def spike(api: FakeBotAPI, users: int) -> list:
+    latencies = []
+    await asyncio.gather(*(user_session(api, user_id, latencies) for user_id in range(1, users + 1)))
+    return latencies
+
+
+async def run(mode: str, users: int, latency: float) -> list:
+    async with FakeBotAPIProcess(spike, users, latency=latency) as api:
+        application = build_application(TOKEN, api.base_url)
+        async with application:
+            await application.start()
+            if mode == 'polling':
+                await application.updater.start_polling(poll_interval=0, timeout=10)
+            else:
+                port = free_port()
+                await application.updater.start_webhook(
+                    listen='127.0.0.1', port=port, url_path='webhook',
+                    webhook_url=f'http://127.0.0.1:{port}/webhook',
+                    secret_token=SECRET, max_connections=40)
+            latencies = await api.result()
+            # Answers still on their way would fail once the application shuts down
+            await Replies.of(application).drain()
+            await application.updater.stop()
+            await application.stop()
+    return latencies
+
+
+def report(mode: str, latencies: list) -> None:
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"{mode:>8}: p50 {cuts[49] * 1000:7.1f} ms  p95 {cuts[94] * 1000:7.1f} ms  "
+          f"p99 {cuts[98] * 1000:7.1f} ms  max {max(latencies) * 1000:7.1f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=30, help="simulated one-way network latency")
+    args = parser.parse_args()
+
+    print(f"{args.users} users, {args.latency_ms:.0f} ms simulated latency per Bot API hop")
+    for mode in ('polling', 'webhook'):
+        try:
+            report(mode, await run(mode, args.users, args.latency_ms / 1000))
+        except RuntimeError as exc:
+            print(f"{mode:>8}: skipped ({exc})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+"""Cost of logging on the event loop: direct stream handler versus the queue pipeline.
+
+The first table is the time per button-press log call as the event loop sees
+it. The second logs a burst of button presses from concurrent handlers to a
+slow output (every write takes ``--write-ms``, like a blocked terminal or a
+busy disk) and reports how long the burst kept the loop busy and the longest
+single stall.
+
+    python -m benchmarks.bench_logging [--burst 2000] [--write-ms 0.2]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import timeit
+
+from benchmarks.bench_persistence import StallMonitor
+from logsetup import TEXT_FORMAT, EventSampler, JsonFormatter, LazyQueueHandler, skip_unused_record_fields
+
+logger = logging.getLogger('bench')
+logger.propagate = False
+
+# The last two are what configure_logging sets up
+PIPELINE_CASES = (('all records', 1.0), ('lean records', 1.0), ('lean records, 1 in 10', 0.1))
+
+
+class SlowStream(io.TextIOBase):
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return len(text)
+
+
+def direct(stream) -> logging.Handler:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def pipeline(stream, sample_rate: float = 1.0):
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    handler = LazyQueueHandler(queue.Queue(100_000))
+    if sample_rate < 1:
+        handler.addFilter(EventSampler({'button_press': sample_rate}))
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    return handler, listener
+
+
+def use(handler: logging.Handler, level: int = logging.INFO) -> None:
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+
+
+def press(user_id: int, data: str) -> None:
+    logger.info("User %s pressed button: %s", user_id, data,
+                extra={'event': 'button_press', 'user_id': user_id, 'data': data})
+
+
+def press_fstring(user_id: int, data: str) -> None:
+    logger.info(f"User {user_id} pressed button: {data}")
+
+
+def per_call(number: int) -> None:
+    devnull = open(os.devnull, 'w')
+    cases = []
+    use(direct(devnull), logging.WARNING)
+    cases.append(("f-string, level above INFO", press_fstring))
+    cases.append(("%-style, level above INFO", press))
+    rows = []
+    for name, func in cases:
+        rows.append((name, min(timeit.repeat(lambda: func(7, 'next'), number=number, repeat=5))))
+
+    use(direct(devnull))
+    rows.append(("direct stream handler", min(timeit.repeat(lambda: press(7, 'next'), number=number, repeat=5))))
+    for name, rate in PIPELINE_CASES:
+        if name.startswith('lean'):
+            skip_unused_record_fields()
+        handler, listener = pipeline(devnull, rate)
+        use(handler)
+        listener.start()
+        best = min(timeit.repeat(lambda: press(7, 'next'), number=number, repeat=5))
+        listener.stop()
+        rows.append((f"queue pipeline, {name}", best))
+
+    for name, best in rows:
+        print(f"  {name:<40} {best / number * 1e6:7.2f} us per call")
+    devnull.close()
+
+
+async def burst(presses: int) -> tuple:
+    async def handler(user_id: int) -> None:
+        await asyncio.sleep(0)
+        press(user_id, 'next')
+
+    async with StallMonitor() as monitor:
+        started = time.perf_counter()
+        await asyncio.gather(*(handler(user_id) for user_id in range(presses)))
+        elapsed = time.perf_counter() - started
+    return elapsed, monitor.longest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20_000)
+    parser.add_argument('--burst', type=int, default=2000)
+    parser.add_argument('--write-ms', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print("Per call on the event loop:")
+    per_call(args.number)
+
+    print(f"Burst of {args.burst} presses, {args.write_ms} ms per write:")
+    slow = SlowStream(args.write_ms / 1000)
+    use(direct(slow))
+    elapsed, stall = asyncio.run(burst(args.burst))
+    print(f"  {'direct stream handler':<40} loop busy {elapsed * 1000:8.1f} ms  longest stall {stall * 1000:8.1f} ms")
+    for name, rate in PIPELINE_CASES[1:]:
+        handler, listener = pipeline(slow, rate)
+        use(handler)
+        listener.start()
+        elapsed, stall = asyncio.run(burst(args.burst))
+        listener.stop()
+        print(f"  {f'queue pipeline, {name}':<40} loop busy {elapsed * 1000:8.1f} ms  "
+              f"longest stall {stall * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
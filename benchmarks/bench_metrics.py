@@ -0,0 +1,42 @@
+"""Cost of recording metrics on the hot path.
+
+Each row is the time for one recording call as the handlers and the Bot API
+request class make it, next to an empty loop for reference.
+
+    python -m benchmarks.bench_metrics [--number 1000000]
+"""
+import argparse
+import timeit
+
+from metrics import Counter, Gauge, Histogram, Registry, StateGauge
+
+REGISTRY = Registry()
+HISTOGRAM = Histogram('bench_seconds', "Benchmark histogram.", ('handler',), registry=REGISTRY)
+COUNTER = Counter('bench_total', "Benchmark counter.", ('type',), registry=REGISTRY)
+STATES = StateGauge(Gauge('bench_states', "Benchmark states.", ('state',), registry=REGISTRY),
+                    {0: 'CHOOSING', 1: 'READING', 2: 'QUIZZING'})
+CHILD = HISTOGRAM.labels('button')
+
+CASES = {
+    'empty loop': 'pass',
+    'histogram child observe': "CHILD.observe(0.0042)",
+    'histogram labels().observe': "HISTOGRAM.labels('button').observe(0.0042)",
+    'counter labels().inc': "COUNTER.labels('next').inc()",
+    'state gauge track x2': "STATES.track(7, 1); STATES.track(7, 2)",
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for name, statement in CASES.items():
+        best = min(timeit.repeat(statement, globals=globals(), number=args.number, repeat=5))
+        print(f"{name:<28} {best / args.number * 1e9:7.0f} ns")
+    scrape = min(timeit.repeat(REGISTRY.render, number=1000, repeat=5)) / 1000
+    print(f"{'render registry':<28} {scrape * 1e6:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
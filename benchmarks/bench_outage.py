@@ -0,0 +1,117 @@
+"""Tasks, calls and recovery during a Bot API outage, with and without the circuit breaker.
+
+Learners keep paging through a lesson, one tap every ``--interval`` seconds.
+After ``--warmup`` seconds the fake Bot API fails every call but getUpdates for
+``--outage`` seconds, either answering 502 (``5xx``) or not answering at all
+until the outage is over (``hang``, so calls run into their read timeout).
+Reported per setup: the most asyncio tasks the bot had at once, calls the API
+received during the outage, and how long after it learners saw a page again.
+
+    python -m benchmarks.bench_outage [--users 50] [--outage 10] [--interval 0.5]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import bot
+from benchmarks.fake_bot_api import FakeBotAPI, FakeBotAPIProcess
+from pages import LESSON, TOPIC, callback_data
+
+TOKEN = '123456:fake-token'
+TOPIC_NAME = 'advanced'
+
+
+async def learner(api: FakeBotAPI, user_id: int, interval: float, until: float, outage_end: float) -> float:
+    topic_id = bot.CONTENT.pages.topic_ids[TOPIC_NAME]
+    topic = bot.CONTENT.pages.by_id[topic_id]
+    replies = api.replies(user_id)
+    api.command(user_id, '/start')
+    message_id = (await replies.get()).result['message_id']
+    api.tap(user_id, message_id, callback_data(TOPIC, topic_id))
+    page = 0
+    while time.perf_counter() < until:
+        await asyncio.sleep(interval)
+        # Back and forth between the first pages, so every tap changes the message
+        page = page % 2 + 1
+        api.tap(user_id, message_id, callback_data(LESSON, topic_id, page, topic.version))
+
+    recovered = float('nan')
+    while True:
+        try:
+            call = await asyncio.wait_for(replies.get(), timeout=5)
+        except asyncio.TimeoutError:
+            return recovered
+        if call.method == 'editMessageText' and call.at >= outage_end and recovered != recovered:
+            recovered = call.at - outage_end
+
+
+async def scenario(api: FakeBotAPI, users: int, interval: float, warmup: float, outage: float,
+                   kind: str) -> dict:
+    started = time.perf_counter()
+    outage_start, outage_end = started + warmup, started + warmup + outage
+
+    async def timeline() -> None:
+        await asyncio.sleep(warmup)
+        api.outage = kind
+        await asyncio.sleep(outage)
+        api.outage = None
+
+    switch = asyncio.create_task(timeline())
+    recovery = await asyncio.gather(*(learner(api, user_id, interval, outage_end + 3, outage_end)
+                                      for user_id in range(1, users + 1)))
+    await switch
+    return {'recovery': [seconds for seconds in recovery if seconds == seconds],
+            'outage_calls': api.outage_calls, 'outage_start': outage_start}
+
+
+async def run(users: int, interval: float, warmup: float, outage: float, kind: str) -> dict:
+    peak = 0
+
+    async def sample() -> None:
+        nonlocal peak
+        while True:
+            peak = max(peak, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.05)
+
+    async with FakeBotAPIProcess(scenario, users, interval, warmup, outage, kind) as api:
+        application = bot.build_application(TOKEN, api.base_url)
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            sampler = asyncio.create_task(sample())
+            results = await api.result()
+            sampler.cancel()
+            await application.updater.stop()
+            await application.stop()
+    results['peak_tasks'] = peak
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--outage', type=float, default=10)
+    args = parser.parse_args()
+    # Failed answers and edits are expected during the outage; keep them out of the report
+    logging.disable(logging.WARNING)
+
+    print(f"{args.users} learners tapping every {args.interval} s, {args.outage:.0f} s outage")
+    print(f"{'':<34} {'peak tasks':>10} {'calls in outage':>16} {'page again after':>17}")
+    breaker_failures = bot.BOT_API_BREAKER_FAILURES
+    for kind in ('5xx', 'hang'):
+        for name, failures in (("no circuit breaker", 10 ** 9), ("circuit breaker", breaker_failures)):
+            # build_application reads the threshold when it creates the breaker
+            bot.BOT_API_BREAKER_FAILURES = failures
+            results = asyncio.run(run(args.users, args.interval, args.warmup, args.outage, kind))
+            recovery = results['recovery']
+            after = f"{statistics.median(recovery):.1f} s" if recovery else "never"
+            print(f"{f'{kind}, {name}':<34} {results['peak_tasks']:10d} {results['outage_calls']:16d} "
+                  f"{after:>17}")
+
+
+if __name__ == "__main__":
+    main()
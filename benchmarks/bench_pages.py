@@ -0,0 +1,85 @@
+"""Compare per-call keyboard/text construction against the precompiled page table.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pages
+"""
+import timeit
+import tracemalloc
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot import CONTENT
+from content import read_topic
+
+TOPIC = 'advanced'
+PAGES = CONTENT.pages
+# The raw lesson and quiz lists that the handlers used to index into
+lesson, quiz = read_topic(CONTENT.pack_path(TOPIC))
+lessons, quizzes = {TOPIC: lesson}, {TOPIC: quiz}
+
+
+# The handlers as they were before pages.py: build everything on every call
+def build_main_menu():
+    keyboard = [
+        [InlineKeyboardButton("Introduction to Aptos", callback_data='intro')],
+        [InlineKeyboardButton("Key Features", callback_data='features')],
+        [InlineKeyboardButton("Getting Started", callback_data='start_guide')],
+        [InlineKeyboardButton("Basic Operations", callback_data='basic_ops')],
+        [InlineKeyboardButton("Advanced Topics", callback_data='advanced')]
+    ]
+    message_text = "Welcome to the Aptos Educational Bot! I'm here to help you learn about the Aptos blockchain. What would you like to learn about?"
+    return message_text, InlineKeyboardMarkup(keyboard)
+
+
+def build_lesson(lesson, index):
+    keyboard = [[InlineKeyboardButton("Next", callback_data='next')]]
+    if index > 0:
+        keyboard[0].insert(0, InlineKeyboardButton("Previous", callback_data='prev'))
+    return lessons[lesson][index], InlineKeyboardMarkup(keyboard)
+
+
+def build_quiz_question(lesson, index):
+    question = quizzes[lesson][index]
+    keyboard = [[InlineKeyboardButton(opt, callback_data=f'quiz_{i}') for i, opt in enumerate(question['options'])]]
+    return f"Question {index + 1}: {question['question']}", InlineKeyboardMarkup(keyboard)
+
+
+def legacy_session():
+    build_main_menu()
+    for index in range(len(lessons[TOPIC])):
+        build_lesson(TOPIC, index)
+    for index in range(len(quizzes[TOPIC])):
+        build_quiz_question(TOPIC, index)
+
+
+def compiled_session():
+    PAGES.main_menu
+    topic = PAGES.topics[TOPIC]
+    for index in range(len(topic.lesson)):
+        topic.lesson[index]
+    for index in range(len(topic.quiz)):
+        topic.quiz[index][index // 2]
+
+
+def allocated_bytes(func, rounds=100):
+    tracemalloc.start()
+    for _ in range(rounds):
+        func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    screens = 1 + len(lessons[TOPIC]) + len(quizzes[TOPIC])
+    print(f"One '{TOPIC}' walkthrough = {screens} screens")
+    for name, func in (("per-call construction", legacy_session), ("precompiled pages", compiled_session)):
+        rounds = 2000
+        seconds = min(timeit.repeat(func, number=rounds, repeat=5))
+        per_screen_us = seconds / rounds / screens * 1e6
+        print(f"{name:>22}: {per_screen_us:8.3f} us/screen, peak traced memory {allocated_bytes(func):>8} B")
+
+
+if __name__ == "__main__":
+    main()
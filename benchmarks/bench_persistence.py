@@ -0,0 +1,147 @@
+"""SQLitePersistence versus PicklePersistence with a large learner base.
+
+Both stores are filled with ``--users`` learners, then each is measured on what
+the running bot asks of it: loading at startup, saving one ``update_interval``
+worth of changed learners, and (SQLite only) loading one learner on first use.
+The event loop stall column is the longest time the loop could not run other
+tasks while the store was working.
+
+    python -m benchmarks.bench_persistence [--users 100000] [--changed 20]
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import tempfile
+import time
+
+from telegram.ext import PicklePersistence, PersistenceInput
+
+from persistence import SQLitePersistence
+
+CONVERSATION = 'lessons'
+STORE_DATA = PersistenceInput(bot_data=False, chat_data=False, callback_data=False)
+
+
+def learner(user_id: int) -> dict:
+    return {'lesson': 'advanced', 'lesson_index': user_id % 9, 'quiz_index': user_id % 7, 'score': user_id % 5}
+
+
+class StallMonitor:
+    """Track the longest gap between event loop iterations."""
+
+    def __init__(self, tick: float = 0.001):
+        self.tick = tick
+        self.longest = 0.0
+        self._task = None
+
+    async def _watch(self) -> None:
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            self.longest = max(self.longest, time.perf_counter() - before - self.tick)
+
+    async def __aenter__(self) -> "StallMonitor":
+        self._task = asyncio.create_task(self._watch())
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        # Let the watcher wake up once more to see a stall that just ended
+        await asyncio.sleep(self.tick * 2)
+        self._task.cancel()
+
+
+async def timed(coroutine):
+    async with StallMonitor() as monitor:
+        started = time.perf_counter()
+        result = await coroutine
+        elapsed = time.perf_counter() - started
+    return result, elapsed, monitor.longest
+
+
+def fill_pickle(path: str, users: int) -> None:
+    data = {
+        'user_data': {user_id: learner(user_id) for user_id in range(users)},
+        'chat_data': {}, 'bot_data': {}, 'callback_data': None,
+        'conversations': {CONVERSATION: {(user_id, user_id): 1 for user_id in range(users)}},
+    }
+    with open(path, 'wb') as file:
+        pickle.dump(data, file, pickle.HIGHEST_PROTOCOL)
+
+
+def fill_sqlite(path: str, users: int) -> None:
+    persistence = SQLitePersistence(path)
+    persistence._write(
+        {('user_data', user_id): pickle.dumps(learner(user_id), pickle.HIGHEST_PROTOCOL) for user_id in range(users)},
+        {(CONVERSATION, f'[{user_id}, {user_id}]'): '1' for user_id in range(users)},
+    )
+    persistence._close()
+
+
+async def startup(persistence) -> None:
+    await persistence.get_user_data()
+    await persistence.get_conversations(CONVERSATION)
+
+
+async def save_interval(persistence, changed: int) -> None:
+    # What Application.update_persistence hands over after one interval
+    await asyncio.gather(*(
+        coroutine
+        for user_id in range(changed)
+        for coroutine in (persistence.update_user_data(user_id, learner(user_id + 1)),
+                          persistence.update_conversation(CONVERSATION, (user_id, user_id), 2))
+    ))
+    await asyncio.sleep(0)
+    if isinstance(persistence, SQLitePersistence):
+        await persistence._writer
+
+
+async def touch_users(persistence, users) -> None:
+    for user_id in users:
+        await persistence.refresh_user_data(user_id, {})
+
+
+def report(name: str, step: str, elapsed: float, stall: float) -> None:
+    print(f"{name:>7} {step:<28} {elapsed * 1000:10.1f} ms   loop stall {stall * 1000:8.1f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--changed', type=int, default=20, help="learners changed per update interval")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'bot_data.pickle')
+        sqlite_path = os.path.join(directory, 'bot_data.sqlite3')
+        fill_pickle(pickle_path, args.users)
+        fill_sqlite(sqlite_path, args.users)
+        print(f"{args.users} learners: pickle file {os.path.getsize(pickle_path) / 1e6:.1f} MB, "
+              f"sqlite file {os.path.getsize(sqlite_path) / 1e6:.1f} MB")
+
+        pickled = PicklePersistence(pickle_path, store_data=STORE_DATA)
+        _, elapsed, stall = await timed(startup(pickled))
+        report('pickle', 'startup load', elapsed, stall)
+        _, elapsed, stall = await timed(save_interval(pickled, args.changed))
+        report('pickle', f'save {args.changed} changed learners', elapsed, stall)
+        # With on_flush=True nothing is written until shutdown, so a crash loses
+        # everything since the last start, and shutdown rewrites the whole file
+        pickled = PicklePersistence(pickle_path, store_data=STORE_DATA, on_flush=True)
+        await startup(pickled)
+        await save_interval(pickled, args.changed)
+        _, elapsed, stall = await timed(pickled.flush())
+        report('pickle', 'on_flush=True shutdown write', elapsed, stall)
+
+        sqlite = SQLitePersistence(sqlite_path)
+        _, elapsed, stall = await timed(startup(sqlite))
+        report('sqlite', 'startup load', elapsed, stall)
+        _, elapsed, stall = await timed(touch_users(sqlite, range(args.changed)))
+        report('sqlite', f'first use of {args.changed} learners', elapsed, stall)
+        _, elapsed, stall = await timed(save_interval(sqlite, args.changed))
+        report('sqlite', f'save {args.changed} changed learners', elapsed, stall)
+        await sqlite.flush()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+"""Interactive latency and flood errors while the bot broadcasts, with and without the rate limiter.
+
+The fake Bot API enforces Telegram's flood limits (30 messages a second
+overall, one a second per chat with bursts of three) and answers messages over
+them with 429. Simulated learners page through a lesson, one tap every
+``--tap-interval`` seconds, while the bot sends a broadcast to ``--recipients``
+chats. Reported per setup: 429s returned, time from ``/start`` or a tap until
+the menu or page is shown, replies never shown, and how much of the broadcast
+got through and when.
+
+    python -m benchmarks.bench_rate_limiter [--users 20] [--recipients 300] [--taps 6]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from telegram.error import TelegramError
+
+from benchmarks.fake_bot_api import FakeBotAPI, FakeBotAPIProcess, FloodLimits
+from bot import CONTENT, build_application
+from pages import LESSON, TOPIC, callback_data
+from ratelimiter import BULK, PriorityRateLimiter
+
+TOKEN = '123456:fake-token'
+TOPIC_NAME = 'advanced'
+BROADCAST_CHATS = 1_000_000
+BROADCAST_TEXT = "New lessons are out: tap /start to see what's new."
+
+
+async def learner(api: FakeBotAPI, user_id: int, taps: int, interval: float) -> list:
+    topic_id = CONTENT.pages.topic_ids[TOPIC_NAME]
+    topic = CONTENT.pages.by_id[topic_id]
+    replies = api.replies(user_id)
+    started = time.perf_counter()
+    api.command(user_id, '/start')
+    try:
+        menu = await asyncio.wait_for(replies.get(), timeout=15)
+    except asyncio.TimeoutError:
+        # The menu never came, e.g. it was refused for flooding
+        return [None] * (taps + 1)
+    message_id = menu.result['message_id']
+    api.tap(user_id, message_id, callback_data(TOPIC, topic_id))
+
+    pages = {topic.lesson[page].text: page for page in range(1, taps + 1)}
+    tapped, shown = {}, {}
+
+    async def watch() -> None:
+        while len(shown) < taps:
+            call = await replies.get()
+            page = pages.get(call.params.get('text')) if call.method == 'editMessageText' else None
+            if page is not None and page in tapped:
+                shown.setdefault(page, call.at - tapped[page])
+
+    watcher = asyncio.create_task(watch())
+    for page in range(1, taps + 1):
+        await asyncio.sleep(interval)
+        tapped[page] = time.perf_counter()
+        api.tap(user_id, message_id, callback_data(LESSON, topic_id, page, topic.version))
+    try:
+        await asyncio.wait_for(watcher, timeout=15)
+    except asyncio.TimeoutError:
+        pass
+    return [menu.at - started] + [shown.get(page) for page in range(1, taps + 1)]
+
+
+async def scenario(api: FakeBotAPI, users: int, taps: int, interval: float, recipients: int) -> dict:
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(learner(api, user_id, taps, interval) for user_id in range(1, users + 1)))
+    # Give the broadcast time to finish; stop once it makes no progress
+    delivered, last = -1, 0.0
+    while delivered < recipients:
+        sent = [call.at for call in api.calls if call.method == 'sendMessage' and call.params['chat_id'] >= BROADCAST_CHATS]
+        if len(sent) == delivered:
+            break
+        delivered, last = len(sent), max(sent, default=started)
+        await asyncio.sleep(5)
+    return {'latencies': [latency for learner in latencies for latency in learner],
+            'rejected': api.rejected, 'delivered': delivered, 'broadcast_seconds': last - started}
+
+
+async def broadcast(bot, recipients: int, bulk: bool) -> int:
+    options = {'rate_limit_args': BULK} if bulk else {}
+
+    async def send(chat_id: int) -> bool:
+        try:
+            await bot.send_message(chat_id, BROADCAST_TEXT, **options)
+        except TelegramError:
+            return False
+        return True
+
+    results = await asyncio.gather(*(send(BROADCAST_CHATS + n) for n in range(recipients)))
+    return results.count(False)
+
+
+async def run(rate_limiter, bulk: bool, users: int, taps: int, interval: float, recipients: int,
+              latency: float) -> dict:
+    async with FakeBotAPIProcess(scenario, users, taps, interval, recipients, latency=latency,
+                                 flood_limits=FloodLimits()) as api:
+        application = build_application(TOKEN, api.base_url, rate_limiter=rate_limiter)
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            sending = asyncio.create_task(broadcast(application.bot, recipients, bulk))
+            results = await api.result()
+            results['failed'] = await sending
+            await application.updater.stop()
+            await application.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--taps', type=int, default=6, help="Next taps per learner, at most the lesson length")
+    parser.add_argument('--tap-interval', type=float, default=1.5)
+    parser.add_argument('--recipients', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=20, help="simulated Bot API latency per call")
+    args = parser.parse_args()
+    taps = min(args.taps, len(CONTENT.pages.topics[TOPIC_NAME].lesson) - 1)
+    # Failed edits are expected without the limiter; keep them out of the report
+    logging.disable(logging.ERROR)
+
+    setups = (("no rate limiter", None, False),
+              ("rate limiter, one class", PriorityRateLimiter, False),
+              ("rate limiter, bulk broadcast", PriorityRateLimiter, True))
+    print(f"{args.users} learners tapping every {args.tap_interval} s, broadcast to {args.recipients} chats")
+    print(f"{'':<30} {'429s':>6} {'reply p50':>9} {'reply p95':>9} {'not shown':>10} {'broadcast':>20}")
+    for name, limiter, bulk in setups:
+        results = asyncio.run(run(limiter() if limiter else None, bulk, args.users, taps, args.tap_interval,
+                                  args.recipients, args.latency_ms / 1000))
+        shown = sorted(latency for latency in results['latencies'] if latency is not None)
+        missing = len(results['latencies']) - len(shown)
+        p50 = statistics.median(shown) * 1000 if shown else float('nan')
+        p95 = shown[int(len(shown) * 0.95)] * 1000 if shown else float('nan')
+        delivered = f"{results['delivered']}/{args.recipients} in {results['broadcast_seconds']:.1f} s"
+        print(f"{name:<30} {results['rejected']:6d} {p50:7.0f}ms {p95:7.0f}ms {missing:10d} {delivered:>20}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Search latency at about 10k lesson pages, and the cost of keeping the index up to date.
+
+Builds a course of the packs in ``content/`` plus ``--extra`` topics whose
+pages mix random lines of the real lessons, so every page is different but
+the vocabulary stays small and most words occur on thousands of pages: the
+hard case for ranked retrieval. Queries come in two kinds:
+
+- ``phrases``: one to three consecutive words of a lesson line, as learners type them
+- ``random terms``: one to four words picked from the whole vocabulary
+
+Reported: the time to index every page from scratch and to update the index
+after one topic changed, query latency for each kind with the index in memory
+and mapped from a content store, and how often the results agree with BM25
+scored over every page: the best page, and all the pages returned.
+
+    python -m benchmarks.bench_search [--extra 1100] [--queries 1000]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_content_reload import SOURCE
+from benchmarks.bench_content_versions import touch
+from content import ContentLibrary, read_topic
+from contentstore import StoreLibrary, write_store
+from search import SearchIndex, TopicIndex, query_terms
+
+
+def make_mixed_course(directory: str, extra: int, pages: int = 9, seed: int = 0) -> list:
+    """Write the course and return the lines of the real lessons."""
+    rng = random.Random(seed)
+    with open(os.path.join(SOURCE, 'index.json'), encoding='utf-8') as file:
+        index = json.load(file)
+    lines = []
+    for topic in index['topics']:
+        lesson, quiz = read_topic(os.path.join(SOURCE, f"{topic['name']}.json"))
+        lines.extend(line for page in lesson for line in page.split('\n') if line.strip())
+        with open(os.path.join(directory, f"{topic['name']}.json"), 'w', encoding='utf-8') as file:
+            json.dump({'version': 1, 'lesson': lesson, 'quiz': quiz}, file)
+    for number in range(extra):
+        name = f'mixed_{number}'
+        index['topics'].append({'name': name, 'title': f"Mixed Topics {number}"})
+        lesson = ['\n'.join(rng.sample(lines, rng.randint(4, 10))) for _ in range(pages)]
+        with open(os.path.join(directory, f'{name}.json'), 'w', encoding='utf-8') as file:
+            json.dump({'version': 1, 'lesson': lesson, 'quiz': quiz}, file)
+    with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as file:
+        json.dump(index, file)
+    return lines
+
+
+def phrase_queries(lines: list, count: int, rng: random.Random) -> list:
+    words = [found for found in (re.findall(r'\w+', line) for line in lines) if len(found) >= 3]
+    queries = []
+    for _ in range(count):
+        line = rng.choice(words)
+        length = rng.randint(1, 3)
+        start = rng.randrange(len(line) - length + 1)
+        queries.append(' '.join(line[start:start + length]))
+    return queries
+
+
+def latencies(index: SearchIndex, queries: list) -> list:
+    for query in queries:
+        index.search(query)
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def exhaustive(index: SearchIndex, query: str, limit: int = 5) -> list:
+    """The scores of the best pages by BM25 over every page a query term occurs on."""
+    scores = {}
+    for term in query_terms(query):
+        term_list = index.lists.get(term)
+        if term_list is None:
+            continue
+        matches = len(term_list.keys)
+        idf = math.log(1 + (index.pages - matches + 0.5) / (matches + 0.5))
+        for key, weight in zip(term_list.keys, term_list.weights):
+            scores[key] = scores.get(key, 0.0) + idf * weight
+    return sorted(scores.values(), reverse=True)[:limit]
+
+
+def agreement(index: SearchIndex, queries: list) -> str:
+    best = every = 0
+    for query in queries:
+        found = [result.score for result in index.search(query)]
+        wanted = exhaustive(index, query)
+        same = [math.isclose(score, expected) for score, expected in zip(found, wanted)]
+        best += same[:1] == [True] or not wanted
+        every += len(found) == len(wanted) and all(same)
+    return f"best page {best / len(queries):6.1%}  all pages {every / len(queries):6.1%}"
+
+
+def percentiles(samples: list) -> str:
+    cuts = statistics.quantiles(samples, n=100)
+    return f"p50 {cuts[49] * 1000:6.3f} ms  p99 {cuts[98] * 1000:6.3f} ms  max {max(samples) * 1000:6.3f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--extra', type=int, default=1100, help="extra topics added to the course")
+    parser.add_argument('--queries', type=int, default=1000, help="queries of each kind")
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        lines = make_mixed_course(directory, args.extra)
+        library = ContentLibrary(directory)
+        pages = library.pages
+        titles = [title for _, title in library.menu_topics]
+
+        started = time.perf_counter()
+        topics = [TopicIndex(page.text for page in topic.lesson) for topic in pages.by_id]
+        SearchIndex(topics, titles)
+        full_index = time.perf_counter() - started
+
+        index = library.current.search
+        vocabulary = sorted({term for topic in index.topics for term in topic.postings})
+        kinds = {
+            'phrases': phrase_queries(lines, args.queries, rng),
+            'random terms': [' '.join(rng.sample(vocabulary, rng.randint(1, 4))) for _ in range(args.queries)],
+        }
+        results = {kind: latencies(index, queries) for kind, queries in kinds.items()}
+        agreed = {kind: agreement(index, queries) for kind, queries in kinds.items()}
+
+        store = os.path.join(directory, 'content.store')
+        write_store(library.pages, library.menu_topics, store, index)
+        mapped = StoreLibrary(store).current.search
+        mapped_results = {kind: latencies(mapped, queries) for kind, queries in kinds.items()}
+
+        # One topic changes; its pages are replaced in the lists of the terms it uses
+        changed = library.menu_topics[len(library.menu_topics) // 2][0]
+        touch(library.pack_path(changed), 1)
+        started = time.perf_counter()
+        library.reload()
+        reload_seconds = time.perf_counter() - started
+        topic_id = library.pages.topic_ids[changed]
+        topic = library.pages.by_id[topic_id]
+        started = time.perf_counter()
+        SearchIndex(
+            [*index.topics[:topic_id], TopicIndex(page.text for page in topic.lesson), *index.topics[topic_id + 1:]],
+            titles, previous=index)
+        incremental = time.perf_counter() - started
+
+    print(f"{index.pages} lesson pages in {len(pages.by_id)} topics, {len(vocabulary)} terms")
+    print(f"index every page             {full_index * 1000:8.1f} ms")
+    print(f"update after one topic       {incremental * 1000:8.1f} ms  (whole reload {reload_seconds * 1000:.1f} ms)")
+    for kind, samples in results.items():
+        print(f"{kind:<20} {percentiles(samples)}  {agreed[kind]}")
+    for kind, samples in mapped_results.items():
+        print(f"{'mapped ' + kind:<20} {percentiles(samples)}")
+
+
+if __name__ == "__main__":
+    main()
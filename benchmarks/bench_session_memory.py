@@ -0,0 +1,57 @@
+"""Memory per learner with dict user_data versus Session.
+
+Builds the user_data table the application keeps (a defaultdict keyed by user id)
+for a number of learners halfway through a lesson and reports what tracemalloc
+attributes to it, per learner and in total.
+
+    python -m benchmarks.bench_session_memory
+"""
+import gc
+import tracemalloc
+from collections import defaultdict
+
+from session import Session
+
+COUNTS = (10_000, 100_000)
+TOPIC = 'advanced'
+TOPIC_ID = 4
+
+
+def dict_sessions(count: int):
+    table = defaultdict(dict)
+    for user_id in range(10**9, 10**9 + count):
+        table[user_id].update(lesson=TOPIC, lesson_index=user_id % 9, quiz_index=user_id % 7, score=user_id % 5)
+    return table
+
+
+def slot_sessions(count: int):
+    table = defaultdict(Session)
+    for user_id in range(10**9, 10**9 + count):
+        table[user_id].start(TOPIC_ID)
+        table[user_id].lesson_index = user_id % 9
+    return table
+
+
+def measure(build, count: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    table = build(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del table
+    return size
+
+
+def main() -> None:
+    packed = len(Session(TOPIC_ID, 3, 2, 1).to_bytes())
+    print(f"Session persists as {packed} bytes")
+    print(f"{'learners':>9} {'dict B/user':>12} {'Session B/user':>15} {'dict total':>11} {'Session total':>14}")
+    for count in COUNTS:
+        as_dicts = measure(dict_sessions, count)
+        as_slots = measure(slot_sessions, count)
+        print(f"{count:>9} {as_dicts / count:>12.0f} {as_slots / count:>15.0f} "
+              f"{as_dicts / 1e6:>9.1f}MB {as_slots / 1e6:>12.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
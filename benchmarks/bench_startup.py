@@ -0,0 +1,84 @@
+"""Time from starting the bot to its first getUpdates call.
+
+Starts ``python bot.py`` ``--runs`` times against the local fake Bot API and
+measures, from the moment the process is spawned, how long it takes until the
+fake server receives the first getUpdates. The fake server answers each call
+after ``--latency-ms`` and holds the first answer on every connection for
+``--handshake-ms`` more, as the TCP and TLS handshakes with api.telegram.org
+would. Persistence and the metrics endpoint are off.
+
+With ``--max-ms`` the benchmark exits with status 1 when the median is slower,
+so it can guard against startup regressions. ``--profile`` also prints the
+bot's own breakdown (``STARTUP_PROFILE=1``) of one more start.
+
+    python -m benchmarks.bench_startup [--runs 10] [--latency-ms 50] [--handshake-ms 100] [--max-ms 1500] [--profile]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:fake-token'
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def bot_environment(base_url: str, profile: bool = False) -> dict:
+    environment = dict(os.environ, BOT_TOKEN=TOKEN, BOT_API_BASE_URL=base_url, PERSISTENCE_FILE='',
+                       METRICS_PORT='', LOG_LEVEL='WARNING', STARTUP_PROFILE='1' if profile else '')
+    environment.pop('WEBHOOK_URL', None)
+    return environment
+
+
+async def start_once(latency: float, handshake: float) -> float:
+    async with FakeBotAPI(latency, handshake=handshake) as api:
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, 'bot.py', cwd=ROOT, env=bot_environment(api.base_url),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            await asyncio.wait_for(api.ready.wait(), timeout=30)
+            return time.perf_counter() - started
+        finally:
+            process.send_signal(signal.SIGTERM)
+            await process.wait()
+
+
+async def profile_once(latency: float, handshake: float) -> str:
+    async with FakeBotAPI(latency, handshake=handshake) as api:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, 'bot.py', cwd=ROOT, env=bot_environment(api.base_url, profile=True),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        output, _ = await process.communicate()
+        return output.decode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=50, help="simulated Bot API latency per call")
+    parser.add_argument('--handshake-ms', type=float, default=100, help="simulated handshake per connection")
+    parser.add_argument('--max-ms', type=float, help="fail if the median is slower than this")
+    parser.add_argument('--profile', action='store_true', help="print the bot's startup profile")
+    args = parser.parse_args()
+    latency, handshake = args.latency_ms / 1000, args.handshake_ms / 1000
+
+    timings = sorted(asyncio.run(start_once(latency, handshake)) for _ in range(args.runs))
+    median = statistics.median(timings) * 1000
+    print(f"Process start to first getUpdates, {args.latency_ms:.0f} ms per call, "
+          f"{args.handshake_ms:.0f} ms per new connection, {args.runs} runs")
+    print(f"median {median:.0f} ms, min {timings[0] * 1000:.0f} ms, max {timings[-1] * 1000:.0f} ms")
+    if args.profile:
+        print(asyncio.run(profile_once(latency, handshake)), end='')
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: median {median:.0f} ms is over {args.max_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Per-tap latency with sequential versus overlapped answer/edit calls.
+
+Each Bot API call is simulated with a fixed round-trip time, so the numbers show
+what a user on a link with that latency waits for between tap and new page: a
+tap is timed until its answer and edit have both been sent.
+
+    python -m benchmarks.bench_tap_latency
+"""
+import asyncio
+import itertools
+import statistics
+import time
+from types import SimpleNamespace
+
+from pages import Page
+from replies import Replies
+
+RTTS_MS = (50, 150, 400)
+TAPS = 20
+
+
+class SimulatedMessage:
+    chat = SimpleNamespace(id=1)
+    # A message per tap, so no edit is skipped as showing the page already
+    message_ids = itertools.count(1)
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.message_id = next(self.message_ids)
+
+    async def edit_text(self, text, reply_markup=None):
+        await asyncio.sleep(self.rtt)
+
+
+class SimulatedQuery:
+    id = 'bench'
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.message = SimulatedMessage(rtt)
+
+    async def answer(self, text=None):
+        await asyncio.sleep(self.rtt)
+
+
+class SimulatedUpdate:
+    message = None
+
+    def __init__(self, rtt: float):
+        self.callback_query = SimulatedQuery(rtt)
+
+
+async def sequential_tap(update, page):
+    # What the handlers did before replies.send_page existed
+    await update.callback_query.answer()
+    await update.callback_query.message.edit_text(page.text, reply_markup=page.reply_markup)
+
+
+async def overlapped_tap(update, page):
+    replies = Replies()
+    await replies.send_page(update, page)
+    # send_page returns once both calls are started
+    await replies.drain()
+
+
+async def measure(tap, rtt: float) -> float:
+    page = Page("Benchmark page", None)
+    samples = []
+    for _ in range(TAPS):
+        started = time.perf_counter()
+        await tap(SimulatedUpdate(rtt), page)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+async def main() -> None:
+    print(f"{'RTT':>6} {'before (ms)':>12} {'after (ms)':>11}")
+    for rtt_ms in RTTS_MS:
+        before = await measure(sequential_tap, rtt_ms / 1000)
+        after = await measure(overlapped_tap, rtt_ms / 1000)
+        print(f"{rtt_ms:>4}ms {before:>12.1f} {after:>11.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""Throughput of sequential versus per-user concurrent update processing.
+
+Every simulated user sends a burst of callback queries; each handler waits for a
+simulated Bot API round trip. Updates are fed to the processor the way
+``Application`` does it: one task per update, created in arrival order.
+
+    python -m benchmarks.bench_update_processor
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+from telegram import CallbackQuery, Update, User
+from telegram.ext import SimpleUpdateProcessor
+
+from updateprocessor import PerUserUpdateProcessor
+
+USER_COUNTS = (1, 4, 16, 64, 256)
+UPDATES_PER_USER = 8
+HANDLER_LATENCY = 0.02
+
+
+def make_updates(users: int):
+    updates = []
+    update_id = 0
+    for step in range(UPDATES_PER_USER):
+        for user_id in range(1, users + 1):
+            update_id += 1
+            user = User(user_id, f"user{user_id}", False)
+            query = CallbackQuery(str(update_id), user, 'bench', data=str(step))
+            updates.append(Update(update_id, callback_query=query))
+    return updates
+
+
+async def run(processor, updates) -> float:
+    seen = defaultdict(list)
+
+    async def handle(update):
+        await asyncio.sleep(HANDLER_LATENCY)
+        seen[update.effective_user.id].append(int(update.callback_query.data))
+
+    async with processor:
+        started = time.perf_counter()
+        if processor.max_concurrent_updates > 1:
+            await asyncio.gather(*(asyncio.create_task(processor.process_update(u, handle(u))) for u in updates))
+        else:
+            for update in updates:
+                await processor.process_update(update, handle(update))
+        elapsed = time.perf_counter() - started
+
+    expected = list(range(UPDATES_PER_USER))
+    assert all(order == expected for order in seen.values()), "per-user order was not preserved"
+    return len(updates) / elapsed
+
+
+async def main() -> None:
+    print(f"{UPDATES_PER_USER} taps per user, {HANDLER_LATENCY * 1000:.0f} ms per handler")
+    print(f"{'users':>6} {'sequential upd/s':>17} {'per-user upd/s':>15}")
+    for users in USER_COUNTS:
+        updates = make_updates(users)
+        sequential = await run(SimpleUpdateProcessor(1), updates)
+        per_user = await run(PerUserUpdateProcessor(256, UPDATES_PER_USER), updates)
+        print(f"{users:>6} {sequential:>17.0f} {per_user:>15.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,414 @@
+"""A local stand-in for the Telegram Bot API, for benchmarks and load tests.
+
+The server speaks just enough HTTP/1.1 for python-telegram-bot's HTTPX client, and
+HTTP/2 over plain TCP (h2c, needs ``h2``) for a client set to HTTP/2, and
+implements the methods this bot uses. Updates are injected with :meth:`inject`;
+they are handed out through getUpdates, or pushed to the registered webhook the
+way Telegram does it. Every outbound call the bot makes is recorded and, where it
+concerns a chat, published to that chat's queue so simulated users can react.
+With ``flood_limits`` the server also enforces Telegram's flood limits and
+answers messages over them with 429 and a ``retry_after``, like Telegram.
+Setting :attr:`FakeBotAPI.outage` simulates the API failing for everything but
+getUpdates.
+
+:class:`FakeBotAPIProcess` runs the server and a scenario of simulated users in a
+child process, so they do not compete with the bot under test for the GIL.
+"""
+import asyncio
+import itertools
+import json
+import math
+import multiprocessing
+import time
+from collections import defaultdict
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+
+BOT_ID = 123456
+BOT_USER = {'id': BOT_ID, 'is_bot': True, 'first_name': "Aptos Advisor", 'username': "fake_aptos_bot",
+            'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+
+class Call(NamedTuple):
+    method: str
+    params: Dict[str, Any]
+    result: Any
+    at: float
+
+
+class FloodLimits(NamedTuple):
+    """Messages per second (and burst) allowed overall and per chat."""
+    overall_rate: float = 30
+    overall_burst: int = 30
+    chat_rate: float = 1
+    chat_burst: int = 3
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.next_free = 0.0
+
+    def wait(self, now: float) -> float:
+        return max(0.0, self.next_free - self.tolerance - now)
+
+    def take(self, now: float) -> None:
+        self.next_free = max(self.next_free, now) + self.interval
+
+
+def _decode_params(body: bytes) -> Dict[str, Any]:
+    params = {}
+    for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+class FakeBotAPI:
+    """Fake Bot API server. Use as ``async with FakeBotAPI() as api: ...``.
+
+    Args:
+        latency: Seconds added before every response, to model the network.
+        host: Interface to listen on.
+        flood_limits: Reject messages over these limits with 429.
+        handshake: Seconds added to the first response on each connection, to
+            model the TCP and TLS handshakes with api.telegram.org.
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', flood_limits: Optional[FloodLimits] = None,
+                 handshake: float = 0.0):
+        self.latency = latency
+        self.handshake = handshake
+        self.host = host
+        self.port = 0
+        self.calls: List[Call] = []
+        self.flood_limits = flood_limits
+        # Requests answered with 429
+        self.rejected = 0
+        # '5xx' answers every call but getUpdates with 502, 'hang' holds it
+        # until the outage is over; None serves normally
+        self.outage: Optional[str] = None
+        self.outage_calls = 0
+        self._overall_bucket = _Bucket(flood_limits.overall_rate, flood_limits.overall_burst) if flood_limits else None
+        self._chat_buckets: Dict[int, _Bucket] = {}
+        self.webhook: Optional[Dict[str, Any]] = None
+        # Set once the bot polls for updates or registers its webhook
+        self.ready = asyncio.Event()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._pending: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._query_ids = itertools.count(1)
+        self._query_chats: Dict[str, int] = {}
+        self._chat_queues: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._webhook_client: Optional[httpx.AsyncClient] = None
+        self._webhook_tasks: set = set()
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            'getMe': lambda params: BOT_USER,
+            'deleteWebhook': self._delete_webhook,
+            'setWebhook': self._set_webhook,
+            'getWebhookInfo': self._get_webhook_info,
+            'answerCallbackQuery': lambda params: True,
+            'sendMessage': self._send_message,
+            'editMessageText': self._edit_message_text,
+            'close': lambda params: True,
+            'logOut': lambda params: True,
+        }
+
+    @property
+    def base_url(self) -> str:
+        """Value for ``ApplicationBuilder.base_url``."""
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def __aenter__(self) -> "FakeBotAPI":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def start(self, port: int = 0) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for task in list(self._webhook_tasks):
+            task.cancel()
+        if self._webhook_client:
+            await self._webhook_client.aclose()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # Simulated users ------------------------------------------------------------
+
+    def user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+
+    def command(self, user_id: int, text: str) -> dict:
+        """Inject a text message (e.g. ``/start``) sent by ``user_id``."""
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': user_id, 'type': 'private'}, 'from': self.user(user_id),
+                   'text': text, 'entities': entities}
+        return self.inject({'message': message})
+
+    def tap(self, user_id: int, message_id: int, data: str, text: str = "") -> dict:
+        """Inject a callback query for a button with ``data`` on ``message_id``."""
+        query_id = str(next(self._query_ids))
+        self._query_chats[query_id] = user_id
+        message = {'message_id': message_id, 'date': int(time.time()),
+                   'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER, 'text': text}
+        return self.inject({'callback_query': {'id': query_id, 'from': self.user(user_id),
+                                               'chat_instance': str(user_id), 'message': message,
+                                               'data': data}})
+
+    def inject(self, update: dict) -> dict:
+        """Deliver ``update`` via the webhook if one is set, else queue it for getUpdates."""
+        update = {'update_id': next(self._update_ids), **update}
+        if self.webhook:
+            task = asyncio.ensure_future(self._push(update))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+        else:
+            self._pending.append(update)
+            self._new_updates.set()
+        return update
+
+    def replies(self, chat_id: int) -> asyncio.Queue:
+        """Queue of :class:`Call` s the bot made for ``chat_id``."""
+        return self._chat_queues[chat_id]
+
+    def count(self, *methods: str) -> int:
+        return sum(1 for call in self.calls if not methods or call.method in methods)
+
+    # Bot API methods ---------------------------------------------------------
+
+    def _message(self, params: Dict[str, Any], message_id: Optional[int] = None) -> dict:
+        message = {'message_id': message_id or next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': params['chat_id'], 'type': 'private'}, 'from': BOT_USER,
+                   'text': params.get('text', '')}
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        return message
+
+    def _send_message(self, params):
+        return self._message(params)
+
+    def _edit_message_text(self, params):
+        return self._message(params, params['message_id'])
+
+    def _set_webhook(self, params):
+        self.webhook = params
+        self.ready.set()
+        limits = httpx.Limits(max_connections=int(params.get('max_connections', 40)))
+        self._webhook_client = httpx.AsyncClient(limits=limits)
+        return True
+
+    def _delete_webhook(self, params):
+        self.webhook = None
+        return True
+
+    def _get_webhook_info(self, params):
+        return {'url': (self.webhook or {}).get('url', ''), 'has_custom_certificate': False,
+                'pending_update_count': len(self._pending)}
+
+    async def _get_updates(self, params) -> list:
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self._pending = [update for update in self._pending if update['update_id'] >= offset]
+        if not self._pending:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self._pending[:limit]
+
+    async def _push(self, update: dict) -> None:
+        headers = {}
+        if self.webhook.get('secret_token'):
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook['secret_token']
+        await asyncio.sleep(self.latency)
+        await self._webhook_client.post(self.webhook['url'], json=update, headers=headers)
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """Run a Bot API method and return its ``result``."""
+        if method == 'getUpdates':
+            self.ready.set()
+            return await self._get_updates(params)
+        result = self._handlers[method](params)
+        call = Call(method, params, result, time.perf_counter())
+        self.calls.append(call)
+        chat_id = params.get('chat_id') or self._query_chats.pop(str(params.get('callback_query_id')), None)
+        if chat_id is not None:
+            self._chat_queues[int(chat_id)].put_nowait(call)
+        return result
+
+    # HTTP --------------------------------------------------------------------
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await asyncio.sleep(self.handshake)
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                if request_line == b'PRI * HTTP/2.0\r\n':
+                    await self._serve_h2(request_line, reader, writer)
+                    break
+                _, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self._dispatch(path.rsplit('/', 1)[-1], body)
+                await asyncio.sleep(self.latency)
+                data = json.dumps(payload).encode()
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n' % (status, HTTPStatus(status).phrase.encode(), len(data)) + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_h2(self, preface: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        connection.initiate_connection()
+        requests: Dict[int, List[Any]] = {}
+        responses = set()
+
+        async def respond(stream_id: int, path: str, body: bytes) -> None:
+            status, payload = await self._dispatch(path.rsplit('/', 1)[-1], body)
+            await asyncio.sleep(self.latency)
+            data = json.dumps(payload).encode()
+            connection.send_headers(stream_id, [(':status', str(status)), ('content-type', 'application/json'),
+                                                ('content-length', str(len(data)))])
+            connection.send_data(stream_id, data, end_stream=True)
+            writer.write(connection.data_to_send())
+
+        data = preface
+        try:
+            while data:
+                for event in connection.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        path = dict(event.headers)[b':path'].decode()
+                        requests[event.stream_id] = [path, bytearray()]
+                    elif isinstance(event, h2.events.DataReceived):
+                        requests[event.stream_id][1] += event.data
+                        connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        path, body = requests.pop(event.stream_id)
+                        task = asyncio.ensure_future(respond(event.stream_id, path, bytes(body)))
+                        responses.add(task)
+                        task.add_done_callback(responses.discard)
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                writer.write(connection.data_to_send())
+                await writer.drain()
+                data = await reader.read(65536)
+        finally:
+            for task in responses:
+                task.cancel()
+
+    def _flood_wait(self, params: Dict[str, Any]) -> float:
+        """Seconds the sender has to wait if this message is over the limits, else 0."""
+        chat_id = params.get('chat_id')
+        if self.flood_limits is None or chat_id is None:
+            return 0.0
+        chat = self._chat_buckets.get(chat_id)
+        if chat is None:
+            chat = self._chat_buckets[chat_id] = _Bucket(self.flood_limits.chat_rate, self.flood_limits.chat_burst)
+        now = time.monotonic()
+        wait = max(chat.wait(now), self._overall_bucket.wait(now))
+        if not wait:
+            chat.take(now)
+            self._overall_bucket.take(now)
+        return wait
+
+    async def _dispatch(self, method: str, body: bytes):
+        if method != 'getUpdates' and method not in self._handlers:
+            return 404, {'ok': False, 'error_code': 404, 'description': "Not Found: method not found"}
+        if self.outage and method != 'getUpdates':
+            self.outage_calls += 1
+            if self.outage == '5xx':
+                return 502, {'ok': False, 'error_code': 502, 'description': "Bad Gateway"}
+            while self.outage:
+                await asyncio.sleep(0.05)
+        params = _decode_params(body)
+        wait = self._flood_wait(params)
+        if wait:
+            self.rejected += 1
+            retry_after = math.ceil(wait)
+            return 429, {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {retry_after}",
+                         'parameters': {'retry_after': retry_after}}
+        return 200, {'ok': True, 'result': await self.call(method, params)}
+
+
+async def _run_scenario(conn, scenario, args, options: Dict[str, Any]) -> None:
+    loop = asyncio.get_running_loop()
+    async with FakeBotAPI(**options) as api:
+        conn.send(api.base_url)
+        await api.ready.wait()
+        conn.send(await scenario(api, *args))
+        # Keep serving the bot's shutdown calls until the parent is done with us
+        await loop.run_in_executor(None, conn.recv)
+
+
+def _scenario_process(conn, scenario, args, options: Dict[str, Any]) -> None:
+    asyncio.run(_run_scenario(conn, scenario, args, options))
+
+
+class FakeBotAPIProcess:
+    """Run :class:`FakeBotAPI` and ``scenario(api, *args)`` in a child process.
+
+    The scenario starts once the bot polls or sets its webhook; its return value
+    is available from :meth:`result`. Keyword arguments are passed on to
+    :class:`FakeBotAPI`. ``scenario`` must be a picklable top-level coroutine
+    function::
+
+        async with FakeBotAPIProcess(scenario, 100) as api:
+            application = build_application(token, api.base_url)
+            ...
+            outcome = await api.result()
+    """
+
+    def __init__(self, scenario: Callable[..., Awaitable[Any]], *args: Any, **options: Any):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_scenario_process, args=(child_conn, scenario, args, options), daemon=True)
+        self.base_url = ''
+
+    async def _recv(self) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(None, self._conn.recv)
+
+    async def __aenter__(self) -> "FakeBotAPIProcess":
+        self._process.start()
+        self.base_url = await self._recv()
+        return self
+
+    async def result(self) -> Any:
+        return await self._recv()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._conn.send(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._process.join, 5)
+        if self._process.is_alive():
+            self._process.terminate()
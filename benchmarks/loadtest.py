@@ -0,0 +1,181 @@
+"""Offline load test: simulated learners against the real handlers in bot.py.
+
+The fake Bot API server and the simulated learners run in a child process; the
+bot runs in this process exactly as in production, polling the fake server.
+Every learner sends /start, picks a topic, pages through the whole lesson with
+Next, answers every quiz question and returns to the menu, always tapping the
+buttons the bot actually sent.
+
+    python -m benchmarks.loadtest --users 500 [--topic advanced] [--latency-ms 30] [--double-tap 0.2]
+
+Reported:
+  * updates per second handled over the whole run,
+  * handler latency: time from Application.process_update starting on an update
+    until the answers and edits it started in the background were sent,
+  * reply latency: time from a tap reaching the fake server to the new page,
+  * outbound Bot API calls per learner session, in total and by method,
+  * message edits skipped because they would not have changed the message
+    (``--double-tap`` makes learners tap some buttons twice).
+"""
+import argparse
+import asyncio
+import contextvars
+import random
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.fake_bot_api import Call, FakeBotAPI, FakeBotAPIProcess
+from bot import CONTENT, build_application
+from replies import MESSAGE_EDITS, Replies
+
+TOKEN = '123456:fake-token'
+FORWARD_LABELS = ("Next", "Start Quiz")
+TOPIC_LABELS = dict(CONTENT.menu_topics)
+# The background sends started by the update being processed
+SENDS: contextvars.ContextVar = contextvars.ContextVar('sends')
+
+
+def track_sends() -> None:
+    spawn = Replies._spawn
+
+    def tracked(self, coroutine):
+        task = spawn(self, coroutine)
+        SENDS.get([]).append(task)
+        return task
+    Replies._spawn = tracked
+
+
+def buttons(call: Call) -> list:
+    return [button for row in call.params['reply_markup']['inline_keyboard'] for button in row]
+
+
+async def next_page(replies: asyncio.Queue) -> Call:
+    # Answers and standalone verdict messages come without a keyboard
+    while True:
+        call = await replies.get()
+        if call.params.get('reply_markup'):
+            return call
+
+
+async def learner(api: FakeBotAPI, user_id: int, topic: str, think_time: float, double_tap: float,
+                  latencies: list) -> None:
+    rng = random.Random(user_id)
+    replies = api.replies(user_id)
+
+    sent = time.perf_counter()
+    api.command(user_id, '/start')
+    page = await next_page(replies)
+    latencies.append(page.at - sent)
+    message_id = page.result['message_id']
+    data = next(button['callback_data'] for button in buttons(page) if button['text'] == TOPIC_LABELS[topic])
+    back_to_menu = False
+
+    while True:
+        await asyncio.sleep(think_time)
+        sent = time.perf_counter()
+        api.tap(user_id, message_id, data, page.params['text'])
+        if rng.random() < double_tap:
+            api.tap(user_id, message_id, data, page.params['text'])
+        page = await next_page(replies)
+        latencies.append(page.at - sent)
+        if back_to_menu:
+            return
+
+        labels = {button['text']: button['callback_data'] for button in buttons(page)}
+        forward = [labels[label] for label in FORWARD_LABELS if label in labels]
+        if forward:
+            data = forward[0]
+        elif "Back to Menu" in labels:
+            data = labels["Back to Menu"]
+            back_to_menu = True
+        else:
+            data = rng.choice(list(labels.values()))
+
+
+async def scenario(api: FakeBotAPI, users: int, topic: str, ramp_up: float, think_time: float,
+                   double_tap: float) -> dict:
+    latencies = []
+
+    async def staggered(user_id: int) -> None:
+        await asyncio.sleep(ramp_up * user_id / users)
+        await learner(api, user_id, topic, think_time, double_tap, latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(staggered(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    # answerCallbackQuery may trail the page it belongs to
+    await asyncio.sleep(0.2)
+    return {
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'calls': Counter(call.method for call in api.calls),
+    }
+
+
+def percentiles(samples: list) -> str:
+    cuts = statistics.quantiles(samples, n=100)
+    return f"p50 {cuts[49] * 1000:7.2f} ms  p95 {cuts[94] * 1000:7.2f} ms  p99 {cuts[98] * 1000:7.2f} ms"
+
+
+async def run(users: int, topic: str, latency: float, ramp_up: float, think_time: float,
+              double_tap: float) -> None:
+    handler_times = []
+    track_sends()
+    async with FakeBotAPIProcess(scenario, users, topic, ramp_up, think_time, double_tap, latency=latency) as api:
+        application = build_application(TOKEN, api.base_url)
+        process_update = application.process_update
+
+        def record(started: float) -> None:
+            handler_times.append(time.perf_counter() - started)
+
+        async def timed_process_update(update: object) -> None:
+            sends = []
+            SENDS.set(sends)
+            started = time.perf_counter()
+            try:
+                await process_update(update)
+            finally:
+                # Not awaited, which would hold up the user's next update
+                pending = [task for task in sends if not task.done()]
+                if pending:
+                    asyncio.gather(*pending, return_exceptions=True).add_done_callback(lambda _: record(started))
+                else:
+                    record(started)
+
+        application.process_update = timed_process_update
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            result = await api.result()
+            # Answers still on their way would fail once the application shuts down
+            await Replies.of(application).drain()
+            await application.updater.stop()
+            await application.stop()
+
+    updates = len(result['latencies'])
+    calls = result['calls']
+    outbound = sum(count for method, count in calls.items() if method not in ('getMe', 'deleteWebhook'))
+    print(f"{users} learners through '{topic}', {updates} updates in {result['elapsed']:.2f} s "
+          f"= {updates / result['elapsed']:.0f} updates/s")
+    print(f"handler latency  {percentiles(handler_times)}")
+    print(f"reply latency    {percentiles(result['latencies'])}")
+    print(f"outbound calls per session: {outbound / users:.1f} "
+          f"({', '.join(f'{method} {count / users:.1f}' for method, count in sorted(calls.items()) if method in ('answerCallbackQuery', 'editMessageText', 'sendMessage'))})")
+    print(f"edits skipped as unchanged: {MESSAGE_EDITS.labels('skipped').value}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--topic', default='advanced', choices=list(TOPIC_LABELS))
+    parser.add_argument('--latency-ms', type=float, default=0, help="simulated Bot API latency per call")
+    parser.add_argument('--ramp-up', type=float, default=1.0, help="seconds over which learners arrive")
+    parser.add_argument('--think-time', type=float, default=0.0, help="seconds a learner waits between taps")
+    parser.add_argument('--double-tap', type=float, default=0.0, help="fraction of taps sent twice")
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.topic, args.latency_ms / 1000, args.ramp_up, args.think_time, args.double_tap))
+
+
+if __name__ == "__main__":
+    main()
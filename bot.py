@@ -1,459 +1,539 @@
+import time
+# Taken before the other imports, for STARTUP_PROFILE
+STARTED = time.perf_counter()
+
 import os
+import asyncio
+import functools
 import logging
 import random
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import httpx
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import NetworkError
+from telegram.ext import Application, BasePersistence, BaseRateLimiter, CommandHandler, CallbackQueryHandler, ConversationHandler, filters
+
+from apirequest import DEFAULT_BASE_URL, build_request, check_bot_api
+from circuitbreaker import CircuitBreaker
+from content import ContentLibrary
+from logsetup import configure_logging, parse_sample_rates
+from metrics import Counter, Gauge, Histogram, MetricsServer, StateGauge
+from pages import (ANSWER, LESSON, MAX_ANSWER_TEXT_LENGTH, MENU, START_QUIZ, TOPIC, Page, PageTable, TopicPages,
+                   callback_data, parse_arguments, text_length)
+from ratelimiter import PriorityRateLimiter
+from session import CONTEXT_TYPES, Session, SessionContext
+from replies import Replies
+from router import CallbackRouter
+from search import snippet
+from startup import StartupProfile, format_import_breakdown, import_breakdown
+from updateprocessor import PerUserUpdateProcessor
 
-# Set up logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Logs are written as JSON lines (or LOG_FORMAT=text) to stderr or LOG_FILE by a
+# background thread. LOG_SAMPLE_RATES keeps only a fraction of high-volume
+# events, e.g. 'button_press=0.1' logs every tenth button press
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_FILE = os.getenv('LOG_FILE')
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', 'button_press=0.1'))
+
+# How quiz answers are acknowledged: 'toast' shows the verdict in the callback
+# notification (or, if too long for one, as with 'header'), 'header' prepends it
+# to the next question, 'message' sends it as a separate chat message (the
+# original behaviour, three calls per answer)
+QUIZ_FEEDBACK_MODES = ('toast', 'header', 'message')
+QUIZ_FEEDBACK = os.getenv('QUIZ_FEEDBACK', 'toast').lower()
+if QUIZ_FEEDBACK not in QUIZ_FEEDBACK_MODES:
+    raise ValueError(f"QUIZ_FEEDBACK must be one of {', '.join(QUIZ_FEEDBACK_MODES)}, got {QUIZ_FEEDBACK!r}")
+
+# Updates from different users are processed concurrently, each user's in order
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '256'))
+MAX_QUEUED_UPDATES_PER_USER = int(os.getenv('MAX_QUEUED_UPDATES_PER_USER', '16'))
+# Button presses that waited longer than this many seconds, or that were left
+# from before a start on a message older than that, are answered and dropped
+# instead of replayed; set CALLBACK_MAX_AGE to an empty value to keep them
+CALLBACK_MAX_AGE = os.getenv('CALLBACK_MAX_AGE', '10')
+
+# Outbound messages are spaced to stay under Telegram's flood limits:
+# RATE_LIMIT_OVERALL per second across all chats and RATE_LIMIT_PER_CHAT per
+# second to one chat. Set RATE_LIMIT_OVERALL to an empty value to send unthrottled
+RATE_LIMIT_OVERALL = os.getenv('RATE_LIMIT_OVERALL', '30')
+RATE_LIMIT_PER_CHAT = float(os.getenv('RATE_LIMIT_PER_CHAT', '1'))
+
+# Bot API calls go through a pool of BOT_API_POOL_SIZE connections; getUpdates
+# has a pool of its own so long polling never waits behind replies
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '256'))
+BOT_API_POOL_TIMEOUT = float(os.getenv('BOT_API_POOL_TIMEOUT', '1'))
+BOT_API_KEEPALIVE_CONNECTIONS = os.getenv('BOT_API_KEEPALIVE_CONNECTIONS')
+BOT_API_KEEPALIVE_EXPIRY = float(os.getenv('BOT_API_KEEPALIVE_EXPIRY', '5'))
+BOT_API_HTTP_VERSION = os.getenv('BOT_API_HTTP_VERSION', '1.1')
+GET_UPDATES_POOL_SIZE = int(os.getenv('GET_UPDATES_POOL_SIZE', '1'))
+
+# Point BOT_API_BASE_URL/BOT_API_BASE_FILE_URL at a self-hosted Bot API server
+# (e.g. http://localhost:8081/bot and http://localhost:8081/file/bot); set
+# BOT_API_LOCAL_MODE if that server runs with --local
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL') or None
+BOT_API_BASE_FILE_URL = os.getenv('BOT_API_BASE_FILE_URL') or None
+BOT_API_LOCAL_MODE = os.getenv('BOT_API_LOCAL_MODE', '').lower() in ('1', 'true', 'yes')
+
+# Idempotent Bot API calls are retried up to BOT_API_MAX_RETRIES times after a
+# network error or 5xx. After BOT_API_BREAKER_FAILURES failures in a row, calls
+# fail fast for BOT_API_BREAKER_RESET seconds instead of waiting for timeouts
+BOT_API_MAX_RETRIES = int(os.getenv('BOT_API_MAX_RETRIES', '2'))
+BOT_API_BREAKER_FAILURES = int(os.getenv('BOT_API_BREAKER_FAILURES', '5'))
+BOT_API_BREAKER_RESET = float(os.getenv('BOT_API_BREAKER_RESET', '10'))
+
+# Updates arrive by long polling unless WEBHOOK_URL is set. WEBHOOK_URL is the
+# public HTTPS address Telegram posts to; the bot itself listens on
+# WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH, with TLS if WEBHOOK_CERT/WEBHOOK_KEY
+# are given and behind a terminating proxy otherwise
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY')
+
+# Learner progress and conversation states are kept in this SQLite file across
+# restarts; set PERSISTENCE_FILE to an empty value to keep them in memory only
+PERSISTENCE_FILE = os.getenv('PERSISTENCE_FILE', 'bot_data.sqlite3')
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '60'))
+
+# Prometheus metrics are served on METRICS_HOST:METRICS_PORT/metrics; set
+# METRICS_PORT to an empty value to turn the endpoint off
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.getenv('METRICS_PORT', '9464')
+
+# Lessons, quizzes and the menu are read from the content packs in CONTENT_DIR
+# (see content.py). Changed packs are picked up every CONTENT_RELOAD_INTERVAL
+# seconds while the bot runs; set it to an empty value to never reload
+CONTENT_DIR = os.getenv('CONTENT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content'))
+CONTENT_RELOAD_INTERVAL = os.getenv('CONTENT_RELOAD_INTERVAL', '2')
+# Worker processes can instead share content compiled into CONTENT_STORE by
+# `python -m contentstore` (see contentstore.py); it is mapped, not compiled
+CONTENT_STORE = os.getenv('CONTENT_STORE')
+
+# With STARTUP_PROFILE=1 the bot starts polling, prints how long each startup
+# phase took and where import time went, and exits
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE', '').lower() in ('1', 'true', 'yes')
+
 # Define states
 CHOOSING, READING, QUIZZING = range(3)
 
-# Define lesson content
-lessons = {
-    'intro': [
-        "Aptos is a Layer 1 blockchain built with safety and user experience as key priorities.",
-        "It was founded by former members of the Diem project at Meta (formerly Facebook).",
-        "Aptos aims to be the most safe and scalable Layer 1 blockchain.",
-        "The blockchain uses a novel smart contract language called Move for added security and flexibility."
-    ],
-    'features': [
-        "Key features of Aptos include:",
-        "1. Move programming language: Designed for safe and flexible asset management.",
-        "2. Parallel execution engine: Allows for high transaction throughput.",
-        "3. Modular architecture: Enables easy upgrades and improvements.",
-        "4. Strong focus on security: Implements various measures to prevent common blockchain vulnerabilities."
-    ],
-    'start_guide': [
-        "Welcome to 'Getting Started with Aptos'! Let's begin your journey into the Aptos ecosystem.",
-        
-        "Step 1: Set up an Aptos Wallet\n"
-        "- Visit the official Petra Wallet website (https://petra.app)\n"
-        "- Download and install the Petra browser extension on browser or mobile app\n"
-        "- Create a new wallet and securely store your seed phrase",
-
-        "Step 1.5: Set up an Aptos Connect wallet\n"
-        "- Visit the official Aptos Connect website (https://aptosconnect.app/)\n"
-        "- Make an account without the need for a seed phrase or private key\n"
-        "- Enjoy the benefits of Aptos Connect and Keyless accounts",
-        
-        
-        "Step 2: Acquire Some APT Tokens\n"
-        "- For testnet: Use the Aptos Faucet to get free testnet tokens\n"
-        "- For mainnet: Acquire APT from a supported centralized or decentralized cryptocurrency exchange",
-        
-        "Step 3: Explore Aptos Explorer\n"
-        "- Visit https://explorer.aptoslabs.com\n"
-        "- Use it to view transactions, accounts, analytics, and network activity",
-        
-        "Step 4: Join the Aptos Community\n"
-        "- Follow Aptos on X (https://x.com/Aptos)\n"
-        "- Aptos is global.  Check out the regional communities (https://link3.to/aptos_community)\n"
-        "- Join the official Discord server and Telegram group for discussions and support",
-        
-        "Step 5: Learn about Move Programming\n"
-        "- Familiarize yourself with the Move language documentation (https://aptos.dev/) \n"
-        "- Try out some basic Move tutorials on the Aptos Learn website (https://learn.aptoslabs.com/)",
-        
-        "Congratulations! You've taken your first steps into the Aptos ecosystem. Continue exploring to learn more about Aptos's features and capabilities."
-    ],
-    'basic_ops': [
-        "Welcome to Basic Operations on Aptos! Let's explore the fundamental actions you can perform on the Aptos blockchain.",
-
-        "1. Sending Transactions\n"
-        "- Open your Petra or Aptos Connect wallet\n"
-        "- Select 'Send' and enter the recipient's address\n"
-        "- Specify the amount of APT to send\n"
-        "- Review the transaction details and confirm\n"
-        "- Wait for the transaction to be processed and confirmed on the blockchain",
-
-        "2. Exploring and Interacting with NFTs\n"
-        "- NFTs (Non-Fungible Tokens) on Aptos represent unique digital assets\n"
-        "- Browse NFT marketplaces like Topaz or BlueMove to explore Aptos NFTs\n"
-        "- Connect your Aptos wallet to these platforms to buy, sell, or trade NFTs\n"
-        "- You can also mint NFTs through various Aptos-based NFT projects\n"
-        "- Store your NFTs securely in your Aptos wallet\n"
-        "- View your NFT collection in your wallet or on NFT explorer platforms",
-
-        "3. Staking APT\n"
-        "- Staking allows you to earn rewards by supporting network security\n"
-        "- Choose a validator node to stake with\n"
-        "- Use your wallet or the Aptos staking interface to delegate your APT\n"
-        "- Monitor your staking rewards through the Aptos Explorer",
-
-        "4. Participating in Governance\n"
-        "- Aptos uses on-chain governance for protocol upgrades and parameter changes\n"
-        "- Review active proposals on the Aptos Governance platform\n"
-        "- Cast your vote using your staked APT\n"
-        "- Follow the outcome and implementation of passed proposals",
-
-        "5. Using Aptos Name Service (ANS)\n"
-        "- ANS allows you to register human-readable names for your Aptos address\n"
-        "- Visit the ANS website and connect your wallet\n"
-        "- Search for and register an available name\n"
-        "- Use your .apt name instead of your long address for transactions",
-
-        "6. Exploring DeFi on Aptos\n"
-        "- Aptos has a growing DeFi ecosystem\n"
-        "- You can swap tokens, provide liquidity, or participate in yield farming\n"
-        "- Always research protocols thoroughly and understand the risks involved",
-
-        "Remember, always double-check addresses, transaction details, and contract interactions to ensure the security of your assets on Aptos."
-    ],
-    'advanced': [
-        "Welcome to Advanced Topics in Aptos! Let's explore some of the more complex aspects of the Aptos blockchain.",
-
-        "1. Move Programming Language\n"
-        "- Move is the smart contract language used in Aptos\n"
-        "- Key features: resource-oriented programming, static typing, and formal verification\n"
-        "- Resources in Move are used to represent assets, ensuring they can't be copied or discarded\n"
-        "- Move modules are reusable libraries of code, while scripts are executable transaction logic\n"
-        "- The Move VM executes Move bytecode, providing a secure runtime environment",
-
-        "2. Parallel Execution Engine\n"
-        "- Aptos uses a novel parallel execution engine called Block-STM\n"
-        "- It allows for concurrent execution of transactions, significantly improving throughput\n"
-        "- Block-STM works by speculatively executing transactions in parallel\n"
-        "- If conflicts are detected, it automatically retries affected transactions\n"
-        "- This approach can achieve near-linear scalability with the number of CPU cores",
-
-        "3. Consensus Mechanism\n"
-        "- Aptos uses a Delegated Proof-of-Stake (DPoS) consensus mechanism\n"
-        "- Validators are responsible for proposing and voting on blocks\n"
-        "- The Byzantine Fault Tolerance (BFT) algorithm ensures consensus even if some validators are malicious\n"
-        "- In Aptos' BFT, consensus is reached when more than 2/3 of validators agree on a block\n"
-        "- This mechanism provides fast finality and high throughput",
-
-        "4. Aptos Governance\n"
-        "- Aptos uses an on-chain governance model for protocol upgrades and parameter changes\n"
-        "- AIP (Aptos Improvement Proposals) are formal documents proposing changes to the protocol\n"
-        "- APT token holders can vote on AIPs, with voting power proportional to their stake\n"
-        "- Approved proposals are automatically implemented through smart contracts\n"
-        "- This system ensures decentralized decision-making and protocol evolution",
-
-        "5. Layer 2 Solutions and Scalability\n"
-        "- While Aptos is highly scalable, Layer 2 solutions can further enhance its capabilities\n"
-        "- Sharding is a potential scalability solution, where the network is divided into smaller parts\n"
-        "- In Aptos, sharding could involve splitting the state and transaction processing across multiple chains\n"
-        "- This would allow for even greater parallelism and throughput\n"
-        "- Other Layer 2 solutions like rollups or state channels could also be implemented on Aptos",
-
-        "6. Interoperability\n"
-        "- Interoperability allows Aptos to communicate with other blockchains\n"
-        "- Cross-chain bridges enable asset transfers between Aptos and other chains\n"
-        "- These bridges typically use smart contracts on both chains to lock and mint assets\n"
-        "- Wrapped assets on Aptos represent tokens from other chains (e.g., Wrapped ETH)\n"
-        "- Interoperability protocols like LayerZero or Chainlink CCIP could be integrated with Aptos",
-
-        "7. Advanced DeFi Concepts\n"
-        "- Flash loans allow users to borrow large amounts without collateral for a single transaction\n"
-        "- Yield farming strategies involve moving assets between protocols to maximize returns\n"
-        "- Liquidity mining rewards users for providing liquidity to decentralized exchanges\n"
-        "- Risks in advanced DeFi include smart contract vulnerabilities, impermanent loss, and market volatility\n"
-        "- Opportunities include high yields, arbitrage, and participation in new financial instruments",
-
-        "These advanced topics form the cutting edge of Aptos technology. Understanding them provides deep insight into the Aptos ecosystem."
-    ],
-    # Add more lessons for 'start_guide', 'basic_ops', and 'advanced'
-}
-
-# Define quiz questions
-quizzes = {
-    'intro': [
-        {
-            'question': "What is Aptos?",
-            'options': ["A Layer 2 scaling solution", "A Layer 1 blockchain", "A cryptocurrency", "A smart contract platform"],
-            'correct': 1
-        },
-        {
-            'question': "Who founded Aptos?",
-            'options': ["Ethereum developers", "Bitcoin core team", "Former Diem (Facebook) project members", "Independent blockchain enthusiasts"],
-            'correct': 2
-        }
-    ],
-    'features': [
-        {
-            'question': "What programming language does Aptos use for smart contracts?",
-            'options': ["Solidity", "Rust", "Move", "Python"],
-            'correct': 2
-        },
-        {
-            'question': "Which feature allows Aptos to achieve high transaction throughput?",
-            'options': ["Proof of Stake", "Sharding", "Parallel execution engine", "Layer 2 scaling"],
-            'correct': 2
-        }
-    ],
-      'start_guide': [
-        {
-            'question': "What are the two main wallet options for Aptos?",
-            'options': ["MetaMask and Trust Wallet", "Petra Wallet and Aptos Connect", "Coinbase Wallet and Ledger", "MyEtherWallet and Trezor"],
-            'correct': 1
-        },
-        {
-            'question': "What unique feature does Aptos Connect offer?",
-            'options': ["Faster transactions", "Lower fees", "Account creation without seed phrase or private key", "Automatic staking"],
-            'correct': 2
-        },
-        {
-            'question': "How can you get free testnet tokens for Aptos?",
-            'options': ["Purchase them", "Mine them", "Use the Aptos Faucet", "They're automatically provided"],
-            'correct': 2
-        },
-        {
-            'question': "What tool should you use to view Aptos network activity and analytics?",
-            'options': ["Aptos Explorer", "Etherscan", "Blockchain.info", "Aptos Wallet"],
-            'correct': 0
-        },
-        {
-            'question': "Where can you find Aptos regional communities?",
-            'options': ["Meta", "LinkedIn", "Link3", "Reddit"],
-            'correct': 2
-        },
-        {
-            'question': "What is the primary programming language used for Aptos smart contracts?",
-            'options': ["Solidity", "Python", "JavaScript", "Move"],
-            'correct': 3
-        },
-        {
-            'question': "Where can you find official Aptos Move tutorials?",
-            'options': ["YouTube", "Stack Overflow", "Aptos Learn", "GitHub"],
-            'correct': 2
-        },
-        {
-            'question': "Which social media platform is mentioned for following Aptos updates?",
-            'options': ["Facebook", "Instagram", "LinkedIn", "X.com"],
-            'correct': 3
-        }
-    ],
-    'basic_ops': [
-        {
-            'question': "What is the first step in sending a transaction on Aptos?",
-            'options': ["Mining APT", "Opening your wallet", "Calling a smart contract", "Registering an ANS name"],
-            'correct': 1
-        },
-        {
-            'question': "What can you do with NFTs on Aptos?",
-            'options': ["Mine new APT tokens", "Create new blockchains", "Buy, sell, and trade unique digital assets", "Stake for network security"],
-            'correct': 2
-        },
-        {
-            'question': "What is the purpose of staking APT?",
-            'options': ["To send transactions", "To earn rewards and support network security", "To create smart contracts", "To register a domain name"],
-            'correct': 1
-        },
-        {
-            'question': "How does Aptos handle protocol upgrades and parameter changes?",
-            'options': ["Through off-chain voting", "By developer decisions only", "Using on-chain governance", "Automatically without user input"],
-            'correct': 2
-        },
-        {
-            'question': "What does ANS stand for in the Aptos ecosystem?",
-            'options': ["Aptos Network Security", "Automated Node System", "Aptos Name Service", "Advanced Notification Service"],
-            'correct': 2
-        },
-        {
-            'question': "What can you do with DeFi on Aptos?",
-            'options': ["Mine new APT tokens", "Swap tokens and provide liquidity", "Create new blockchains", "Register validator nodes"],
-            'correct': 1
-        },
-        {
-            'question': "What should you always do before confirming a transaction on Aptos?",
-            'options': ["Close your wallet", "Double-check addresses and details", "Transfer all your APT to another wallet", "Create a new account"],
-            'correct': 1
-        }
-    ],
-    'advanced': [
-        {
-            'question': "In Move programming, what are resources used to represent?",
-            'options': ["Functions", "Variables", "Assets", "Loops"],
-            'correct': 2
-        },
-        {
-            'question': "How does Block-STM handle transaction conflicts?",
-            'options': ["It cancels all transactions", "It automatically retries affected transactions", "It ignores conflicts", "It requires manual resolution"],
-            'correct': 1
-        },
-        {
-            'question': "In Aptos' BFT consensus, what percentage of validators must agree for consensus?",
-            'options': ["More than 50%", "Exactly 66%", "More than 2/3", "100%"],
-            'correct': 2
-        },
-        {
-            'question': "How are approved Aptos Improvement Proposals (AIPs) implemented?",
-            'options': ["Manually by developers", "Through community voting", "Automatically through smart contracts", "By validator nodes"],
-            'correct': 2
-        },
-        {
-            'question': "What is a potential benefit of sharding in Aptos?",
-            'options': ["Reduced security", "Greater parallelism and throughput", "Simpler consensus mechanism", "Lower hardware requirements"],
-            'correct': 1
-        },
-        {
-            'question': "How do cross-chain bridges typically work?",
-            'options': ["By physically moving assets between chains", "Using smart contracts to lock and mint assets", "Through centralized exchanges", "By converting all assets to a common currency"],
-            'correct': 1
-        },
-        {
-            'question': "What is a unique characteristic of flash loans in DeFi?",
-            'options': ["They require high collateral", "They last for months", "They allow borrowing without collateral for a single transaction", "They have very low interest rates"],
-            'correct': 2
-        }
-    ],
-    # Add more quizzes for other topics
-}
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logger.info(f"User {update.effective_user.id} started the bot")
+HANDLER_SECONDS = Histogram('bot_handler_seconds', "Time spent in each conversation handler.", ('handler',))
+UPDATE_QUEUE_DEPTH = Gauge('bot_update_queue_depth',
+                           "Updates waiting in the application queue or for their user's turn.", ('queue',))
+UPDATES_RUNNING = Gauge('bot_updates_running', "Updates being handled right now.")
+API_CIRCUIT_OPEN = Gauge('bot_api_circuit_open', "1 while Bot API calls are failed fast by the circuit breaker.")
+ERRORS = Counter('bot_errors', "Errors raised by handlers or while fetching updates, by exception type.", ('error',))
+SEARCHES = Counter('bot_searches', "/search queries, by whether any lesson page matched.", ('result',))
+EDITS_IN_FLIGHT = Gauge('bot_message_edits_in_flight', "Messages with an edit being sent.")
+Gauge('bot_content_versions', "Content versions in memory: the current one and those learners still read.").set_function(
+    lambda: CONTENT.live_versions)
+ACTIVE_CONVERSATIONS = StateGauge(
+    Gauge('bot_active_conversations', "Conversations per state since the bot started.", ('state',)),
+    {CHOOSING: 'CHOOSING', READING: 'READING', QUIZZING: 'QUIZZING'},
+)
+
+STALE_BUTTON_TEXT = "That button is no longer active, here is where you left off."
+CONTENT_UPDATED_TEXT = "This lesson has been updated since, starting it again."
+TOPIC_UNAVAILABLE_TEXT = "I'm sorry, that option isn't available yet."
+SEARCH_USAGE_TEXT = "Send /search followed by what you are looking for, for example: /search Block-STM"
+SEARCH_RESULTS_TEXT = "Lesson pages about \"{query}\":"
+SEARCH_NO_RESULTS_TEXT = "No lesson page mentions \"{query}\". Try other words, or pick a topic with /start."
+SEARCH_RESULTS = 5
+
+# Compile every screen once at startup; handlers only look pages up and send
+# them. A learner finishes a topic in the content version they started it in
+# (context.user_data.snapshot), even if it is reloaded meanwhile
+if CONTENT_STORE:
+    from contentstore import StoreLibrary
+    CONTENT = StoreLibrary(CONTENT_STORE)
+else:
+    CONTENT = ContentLibrary(CONTENT_DIR)
+
+def conversation_step(func):
+    """Time a conversation handler and track the state it returns."""
+    timed = HANDLER_SECONDS.time(func.__name__)(func)
+
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: SessionContext, *args) -> int:
+        state = await timed(update, context, *args)
+        ACTIVE_CONVERSATIONS.track(update.effective_user.id, state)
+        return state
+    return wrapper
+
+@conversation_step
+async def start(update: Update, context: SessionContext) -> int:
+    logger.info("User %s started the bot", update.effective_user.id,
+                extra={'event': 'start', 'user_id': update.effective_user.id})
     await send_main_menu(update, context)
     return CHOOSING
 
-async def send_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    keyboard = [
-        [InlineKeyboardButton("Introduction to Aptos", callback_data='intro')],
-        [InlineKeyboardButton("Key Features", callback_data='features')],
-        [InlineKeyboardButton("Getting Started", callback_data='start_guide')],
-        [InlineKeyboardButton("Basic Operations", callback_data='basic_ops')],
-        [InlineKeyboardButton("Advanced Topics", callback_data='advanced')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = "Welcome to the Aptos Educational Bot! I'm here to help you learn about the Aptos blockchain. What would you like to learn about?"
-    
-    if update.message:
-        await update.message.reply_text(message_text, reply_markup=reply_markup)
-    else:
-        await update.callback_query.message.edit_text(message_text, reply_markup=reply_markup)
+async def send_main_menu(update: Update, context: SessionContext, answer_text: Optional[str] = None) -> None:
+    # Back at the menu, the learner no longer needs the version they were reading
+    context.user_data.snapshot = None
+    await Replies.of(context).send_page(update, CONTENT.pages.main_menu, answer_text=answer_text)
 
-async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-    logger.info(f"User {update.effective_user.id} pressed button: {query.data}")
+@conversation_step
+async def show_menu(update: Update, context: SessionContext, argument: str) -> int:
+    await send_main_menu(update, context)
+    return CHOOSING
 
-    if query.data == 'menu':
-        await send_main_menu(update, context)
-        return CHOOSING
-    elif query.data in lessons:
-        context.user_data['lesson'] = query.data
-        context.user_data['lesson_index'] = 0
-        context.user_data['quiz_index'] = 0
-        context.user_data['score'] = 0
-        await send_lesson(update, context)
-        return READING
-    else:
-        await query.message.reply_text("I'm sorry, that option isn't available yet.")
+@conversation_step
+async def open_topic(update: Update, context: SessionContext, argument: str) -> int:
+    snapshot = CONTENT.current
+    # Menus sent before topic ids were used name the topic
+    topic_id = int(argument) if argument.isdigit() else snapshot.pages.topic_ids.get(argument)
+    if topic_id is None or topic_id >= len(snapshot.pages.by_id):
+        await send_main_menu(update, context, answer_text=TOPIC_UNAVAILABLE_TEXT)
         return CHOOSING
+    context.user_data.start(topic_id, snapshot)
+    return await send_lesson(update, context)
 
-async def send_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    lesson = context.user_data['lesson']
-    index = context.user_data['lesson_index']
+def session_pages(context: SessionContext) -> PageTable:
+    """The content the learner's topic is served from: the version they started it in."""
+    return (context.user_data.snapshot or CONTENT.current).pages
+
+def in_topic(context: SessionContext) -> bool:
+    """Whether the learner's position exists in the content they are reading.
+
+    It may not after a restart, which keeps positions but only the current content.
+    """
+    session = context.user_data
+    by_id = session_pages(context).by_id
+    if session.topic is None or not 0 <= session.topic < len(by_id):
+        return False
+    topic = by_id[session.topic]
+    return session.lesson_index <= len(topic.lesson) and 0 <= session.score <= session.quiz_index <= len(topic.quiz)
+
+def current_topic(context: SessionContext, topic_id: int, version: int) -> Optional[TopicPages]:
+    """The topic a button points into, in the content version the button was sent from.
+
+    That is the version the learner is reading or the current one, which the
+    learner then reads on; None if the topic changed since the button was sent.
+    """
+    session = context.user_data
+    for snapshot in (session.snapshot, CONTENT.current):
+        if snapshot is not None:
+            by_id = snapshot.pages.by_id
+            if 0 <= topic_id < len(by_id) and by_id[topic_id].version == version:
+                session.snapshot = snapshot
+                return by_id[topic_id]
+    return None
+
+async def restart_topic(update: Update, context: SessionContext, topic_id: int) -> int:
+    # The button's position may not exist any more, so start the topic over
+    snapshot = CONTENT.current
+    if not 0 <= topic_id < len(snapshot.pages.by_id):
+        return await redirect(update, context, CHOOSING)
+    context.user_data.start(topic_id, snapshot)
+    return await send_lesson(update, context, answer_text=CONTENT_UPDATED_TEXT)
+
+async def send_lesson(update: Update, context: SessionContext, answer_text: Optional[str] = None) -> int:
+    topic = session_pages(context).by_id[context.user_data.topic]
+    index = context.user_data.lesson_index
     
-    if index < len(lessons[lesson]):
-        keyboard = [[InlineKeyboardButton("Next", callback_data='next')]]
-        if index > 0:
-            keyboard[0].insert(0, InlineKeyboardButton("Previous", callback_data='prev'))
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.callback_query.message.edit_text(
-            lessons[lesson][index],
-            reply_markup=reply_markup
-        )
+    if index < len(topic.lesson):
+        await Replies.of(context).send_page(update, topic.lesson[index], answer_text=answer_text)
         return READING
     else:
-        await update.callback_query.message.edit_text(
-            "You've completed this lesson! Let's test your knowledge with a quiz.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Start Quiz", callback_data='start_quiz')]])
-        )
+        await Replies.of(context).send_page(update, topic.lesson_complete, answer_text=answer_text)
         return QUIZZING
 
-async def navigate_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-
-    if query.data == 'next':
-        context.user_data['lesson_index'] += 1
-    elif query.data == 'prev':
-        context.user_data['lesson_index'] -= 1
-    elif query.data == 'menu':
-        await send_main_menu(update, context)
-        return CHOOSING
-
+@conversation_step
+async def show_lesson_page(update: Update, context: SessionContext, argument: str) -> int:
+    position = parse_arguments(argument, 3)
+    if position is None:
+        return await redirect(update, context, READING)
+    topic_id, index, version = position
+    topic = current_topic(context, topic_id, version)
+    if topic is None or not 0 <= index <= len(topic.lesson):
+        return await restart_topic(update, context, topic_id)
+
+    context.user_data.move_to(topic_id, index)
     return await send_lesson(update, context)
 
-async def start_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-    
+@conversation_step
+async def start_quiz(update: Update, context: SessionContext, argument: str) -> int:
+    position = parse_arguments(argument, 2)
+    if position is None:
+        return await redirect(update, context, QUIZZING)
+    topic_id, version = position
+    topic = current_topic(context, topic_id, version)
+    if topic is None:
+        return await restart_topic(update, context, topic_id)
+
+    context.user_data.move_to(topic_id, len(topic.lesson))
     return await send_quiz_question(update, context)
 
-async def send_quiz_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    lesson = context.user_data['lesson']
-    index = context.user_data['quiz_index']
+async def send_quiz_question(update: Update, context: SessionContext,
+                             answer_text: Optional[str] = None, header: Optional[str] = None) -> int:
+    topic = session_pages(context).by_id[context.user_data.topic]
+    index = context.user_data.quiz_index
+    score = context.user_data.score
     
-    if index < len(quizzes[lesson]):
-        question = quizzes[lesson][index]
-        keyboard = [[InlineKeyboardButton(opt, callback_data=f'quiz_{i}') for i, opt in enumerate(question['options'])]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.callback_query.message.edit_text(
-            f"Question {index + 1}: {question['question']}",
-            reply_markup=reply_markup
-        )
+    if index < len(topic.quiz):
+        await Replies.of(context).send_page(update, topic.quiz[index][score], answer_text=answer_text, header=header)
         return QUIZZING
     else:
-        score = context.user_data['score']
-        total = len(quizzes[lesson])
-        await update.callback_query.message.edit_text(
-            f"Quiz completed! Your score: {score}/{total}\n"
-            "Choose another topic to continue learning.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Menu", callback_data='menu')]])
-        )
+        await Replies.of(context).send_page(update, topic.quiz_complete[score], answer_text=answer_text, header=header)
         return CHOOSING
 
-async def handle_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@conversation_step
+async def handle_quiz_answer(update: Update, context: SessionContext, argument: str) -> int:
     query = update.callback_query
-    await query.answer()
-    
-    lesson = context.user_data['lesson']
-    index = context.user_data['quiz_index']
-    question = quizzes[lesson][index]
-    
-    user_answer = int(query.data.split('_')[1])
-    if user_answer == question['correct']:
-        context.user_data['score'] += 1
-        await query.message.reply_text("Correct!")
+
+    position = parse_arguments(argument, 5)
+    if position is None:
+        return await redirect(update, context, QUIZZING)
+    # The score is the client's word for it; see pages.py for why that is enough
+    topic_id, question, choice, score, version = position
+    topic = current_topic(context, topic_id, version)
+    if topic is None or not 0 <= score <= question < len(topic.answers):
+        return await restart_topic(update, context, topic_id)
+    answer = topic.answers[question]
+
+    if choice == answer.correct:
+        score += 1
+        verdict = answer.correct_text
     else:
-        await query.message.reply_text(f"Sorry, the correct answer was: {question['options'][question['correct']]}")
-    
-    context.user_data['quiz_index'] += 1
+        verdict = answer.wrong_text
+    context.user_data.move_to(topic_id, len(topic.lesson), question + 1, score)
+
+    # A verdict naming a long option does not fit in a notification and goes above the next screen
+    if QUIZ_FEEDBACK == 'toast' and text_length(verdict) <= MAX_ANSWER_TEXT_LENGTH:
+        return await send_quiz_question(update, context, answer_text=verdict)
+    if QUIZ_FEEDBACK != 'message':
+        return await send_quiz_question(update, context, header=verdict)
+    await query.message.reply_text(verdict)
     return await send_quiz_question(update, context)
 
-def main() -> None:
-    logger.info("Starting bot...")
-    application = Application.builder().token(BOT_TOKEN).build()
+@conversation_step
+async def redirect(update: Update, context: SessionContext, state: int) -> int:
+    """Answer a button that cannot be served and show the user where they left off."""
+    if state == READING and in_topic(context):
+        return await send_lesson(update, context, answer_text=STALE_BUTTON_TEXT)
+    if state == QUIZZING and in_topic(context):
+        return await send_quiz_question(update, context, answer_text=STALE_BUTTON_TEXT)
+    await send_main_menu(update, context, answer_text=STALE_BUTTON_TEXT)
+    return CHOOSING
+
+async def record_error(update: object, context: SessionContext) -> None:
+    """Count and log errors raised by handlers or while fetching updates."""
+    error = context.error
+    ERRORS.labels(type(error).__name__).inc()
+    user_id = update.effective_user.id if isinstance(update, Update) and update.effective_user else None
+    extra = {'event': 'error', 'user_id': user_id, 'update_id': getattr(update, 'update_id', None)}
+    if isinstance(error, NetworkError):
+        # Expected while the Bot API is unreachable; the breaker logs the outage
+        logger.warning("Bot API call failed for user %s: %s", user_id, error, extra=extra)
+    else:
+        logger.error("Error while handling update for user %s", user_id, exc_info=error, extra=extra)
+
+@HANDLER_SECONDS.time('search')
+async def search(update: Update, context: SessionContext) -> None:
+    """Answer /search with buttons that open the best matching lesson pages.
+
+    The buttons are ordinary lesson page buttons, so a tap is served like a
+    Next press and the learner reads on from there.
+    """
+    query = ' '.join(context.args)
+    if not query:
+        await update.message.reply_text(SEARCH_USAGE_TEXT)
+        return
+    snapshot = CONTENT.current
+    results = snapshot.search.search(query, SEARCH_RESULTS)
+    SEARCHES.labels('found' if results else 'none').inc()
+    shown = query if len(query) <= 100 else query[:99] + '…'
+    if not results:
+        await update.message.reply_text(SEARCH_NO_RESULTS_TEXT.format(query=shown))
+        return
+
+    lines = [SEARCH_RESULTS_TEXT.format(query=shown)]
+    buttons = []
+    for number, result in enumerate(results, 1):
+        topic = snapshot.pages.by_id[result.topic_id]
+        label = f"{number}. {snapshot.search.titles[result.topic_id]}, page {result.page + 1} of {len(topic.lesson)}"
+        lines.append(f"\n{label}\n{snippet(topic.lesson[result.page].text, query)}")
+        buttons.append([InlineKeyboardButton(
+            label, callback_data=callback_data(LESSON, result.topic_id, result.page, topic.version))])
+    buttons.append([InlineKeyboardButton("Back to Menu", callback_data=callback_data(MENU))])
+    await Replies.of(context).send_page(update, Page('\n'.join(lines), InlineKeyboardMarkup(buttons)))
+
+# Every button carries the position it leads to (see pages.py), so a press
+# is served the same way whatever state the conversation is in, and its
+# handlers only write the session, to remember where the learner is
+BUTTON_ROUTES = {
+    TOPIC: open_topic,
+    LESSON: show_lesson_page,
+    START_QUIZ: start_quiz,
+    ANSWER: handle_quiz_answer,
+    MENU: show_menu,
+}
+ROUTER = CallbackRouter({state: BUTTON_ROUTES for state in (CHOOSING, READING, QUIZZING)}, unrouted=redirect)
+
+def build_application(token: Optional[str] = None, base_url: Optional[str] = None,
+                      base_file_url: Optional[str] = None, local_mode: bool = False,
+                      persistence: Optional[BasePersistence] = None,
+                      metrics_server: Optional[MetricsServer] = None,
+                      rate_limiter: Optional[BaseRateLimiter] = None,
+                      ssl_context: Optional[ssl.SSLContext] = None, warm_up: bool = False) -> Application:
+    """The bot with its handlers, ready to run.
+
+    With ``warm_up`` the getUpdates connection is opened while the application
+    initializes, so the first poll does not wait for a TLS handshake.
+    """
+    token = token or BOT_TOKEN
+    ssl_context = ssl_context or httpx.create_ssl_context()
+    breaker = CircuitBreaker(BOT_API_BREAKER_FAILURES, BOT_API_BREAKER_RESET)
+    update_processor = PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_QUEUED_UPDATES_PER_USER,
+                                              max_callback_age=float(CALLBACK_MAX_AGE) if CALLBACK_MAX_AGE else None)
+    builder = (Application.builder().token(token).context_types(CONTEXT_TYPES)
+               .concurrent_updates(update_processor)
+               .request(build_request(
+                   BOT_API_POOL_SIZE, BOT_API_HTTP_VERSION, pool_timeout=BOT_API_POOL_TIMEOUT,
+                   keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY, ssl_context=ssl_context, breaker=breaker,
+                   max_retries=BOT_API_MAX_RETRIES,
+                   keepalive_connections=int(BOT_API_KEEPALIVE_CONNECTIONS) if BOT_API_KEEPALIVE_CONNECTIONS else None))
+               .get_updates_request(build_request(
+                   GET_UPDATES_POOL_SIZE, BOT_API_HTTP_VERSION, keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+                   ssl_context=ssl_context,
+                   warm_up_url=f"{base_url or DEFAULT_BASE_URL}{token}/getMe" if warm_up else None)))
+    if base_url:
+        builder.base_url(base_url)
+    if base_file_url:
+        builder.base_file_url(base_file_url)
+    if local_mode:
+        builder.local_mode(True)
+    if persistence:
+        builder.persistence(persistence)
+    if rate_limiter:
+        builder.rate_limiter(rate_limiter)
+    if metrics_server:
+        builder.post_shutdown(lambda application: metrics_server.stop())
+    content_watcher: Optional[asyncio.Task] = None
+    replies = Replies()
+
+    async def post_init(application: Application) -> None:
+        nonlocal content_watcher
+        if metrics_server:
+            await metrics_server.start()
+        if CONTENT_RELOAD_INTERVAL:
+            content_watcher = asyncio.create_task(CONTENT.watch(float(CONTENT_RELOAD_INTERVAL)))
+
+    async def post_stop(application: Application) -> None:
+        if content_watcher:
+            content_watcher.cancel()
+        # Answers and edits are sent in the background; let the last ones out
+        await replies.drain(timeout=10)
+
+    builder.post_init(post_init)
+    builder.post_stop(post_stop)
+    application = builder.build()
+    replies.install(application)
+
+    UPDATE_QUEUE_DEPTH.labels('application').set_function(application.update_queue.qsize)
+    UPDATE_QUEUE_DEPTH.labels('per_user').set_function(lambda: update_processor.waiting_updates)
+    UPDATES_RUNNING.set_function(lambda: update_processor.running_updates)
+    API_CIRCUIT_OPEN.set_function(lambda: int(breaker.is_open))
+    EDITS_IN_FLIGHT.set_function(lambda: replies.edits.in_flight)
 
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            CHOOSING: [CallbackQueryHandler(button)],
-            READING: [CallbackQueryHandler(navigate_lesson)],
-            QUIZZING: [
-                CallbackQueryHandler(start_quiz, pattern='^start_quiz$'),
-                CallbackQueryHandler(handle_quiz_answer, pattern='^quiz_'),
-                CallbackQueryHandler(button, pattern='^menu$'),
-            ],
-        },
+        # A tap without a conversation (e.g. on a menu sent before a restart
+        # without persistence) is routed as if the user were choosing a topic
+        entry_points=[CommandHandler("start", start), CallbackQueryHandler(ROUTER.for_state(CHOOSING))],
+        states={state: [CallbackQueryHandler(ROUTER.for_state(state))] for state in ROUTER.routes},
         fallbacks=[CommandHandler("start", start)],
+        name='lessons',
+        persistent=persistence is not None,
     )
 
     application.add_handler(conv_handler)
+    # Outside the conversation, which it leaves in whatever state it is in
+    application.add_handler(CommandHandler("search", search, filters=filters.UpdateType.MESSAGE))
+    application.add_error_handler(record_error)
+    return application
+
+async def profile_polling(application: Application, profile: StartupProfile) -> None:
+    """Start polling the way ``run_polling`` does, marking each step, then stop."""
+    await application.initialize()
+    profile.mark("initialize (getMe, persistence)")
+    if application.post_init:
+        await application.post_init(application)
+    profile.mark("post_init")
+    await application.updater.start_polling()
+    await application.start()
+    profile.mark("start polling (deleteWebhook)")
+    await application.updater.stop()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
 
-    logger.info("Bot is running...")
-    application.run_polling()
+def main() -> None:
+    profile = StartupProfile(STARTED)
+    profile.mark("imports")
+    log_listener = configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_SAMPLE_RATES)
+    try:
+        logger.info("Starting bot...")
+        ssl_context = httpx.create_ssl_context()
+        with ThreadPoolExecutor(1) as executor:
+            # Connect to the Bot API while the application is set up
+            bot_api_check = executor.submit(check_bot_api, BOT_TOKEN, BOT_API_BASE_URL or DEFAULT_BASE_URL,
+                                            ssl_context=ssl_context)
+            persistence = None
+            if PERSISTENCE_FILE:
+                from persistence import SQLitePersistence
+                persistence = SQLitePersistence(PERSISTENCE_FILE, update_interval=PERSISTENCE_UPDATE_INTERVAL,
+                                                dump_user_data=Session.to_bytes, load_user_data=Session.from_bytes)
+            metrics_server = MetricsServer(METRICS_HOST, int(METRICS_PORT)) if METRICS_PORT else None
+            rate_limiter = None
+            if RATE_LIMIT_OVERALL:
+                rate_limiter = PriorityRateLimiter(float(RATE_LIMIT_OVERALL), chat_rate=RATE_LIMIT_PER_CHAT)
+            application = build_application(base_url=BOT_API_BASE_URL, base_file_url=BOT_API_BASE_FILE_URL,
+                                            local_mode=BOT_API_LOCAL_MODE, persistence=persistence,
+                                            metrics_server=metrics_server, rate_limiter=rate_limiter,
+                                            ssl_context=ssl_context, warm_up=not WEBHOOK_URL)
+            profile.mark("build application")
+            bot_api_check.result()
+        profile.mark("wait for Bot API check")
+
+        if STARTUP_PROFILE:
+            asyncio.run(profile_polling(application, profile))
+            print("Startup phases:")
+            print(profile.report())
+            print("Import time by package (cold, -X importtime):")
+            print(format_import_breakdown(import_breakdown('bot')))
+        elif WEBHOOK_URL:
+            logger.info("Bot is running with webhook %s...", WEBHOOK_URL)
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                cert=WEBHOOK_CERT,
+                key=WEBHOOK_KEY,
+            )
+        else:
+            logger.info("Bot is running...")
+            application.run_polling()
+    finally:
+        # Write out whatever is still queued
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""Circuit breaker for Bot API calls.
+
+When api.telegram.org stops answering, every call would otherwise wait for its
+full timeout, and handlers and their tasks pile up behind them. After
+``failure_threshold`` failures in a row the breaker opens: calls fail at once
+with :class:`CircuitOpenError` for ``reset_timeout`` seconds. Then one call is
+let through as a probe; if it succeeds the breaker closes, otherwise it stays
+open for another ``reset_timeout``.
+"""
+import logging
+import time
+from typing import Optional
+
+from telegram.error import NetworkError
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpenError(NetworkError):
+    """Raised instead of making a Bot API call while the breaker is open.
+
+    Attributes:
+        retry_in: Seconds until the breaker lets a call through again.
+    """
+
+    def __init__(self, method: str, retry_in: float):
+        super().__init__(f"Bot API unavailable, {method} not sent (retry in {retry_in:.1f} s)")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Fail Bot API calls fast after repeated failures.
+
+    Args:
+        failure_threshold: Consecutive failures that open the breaker.
+        reset_timeout: Seconds the breaker stays open before a probe call.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        if failure_threshold < 1:
+            raise ValueError("`failure_threshold` must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._probe_started: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def retry_in(self) -> Optional[float]:
+        """``None`` if a call may be made now, else seconds until one may."""
+        if self.state == CLOSED:
+            return None
+        now = time.monotonic()
+        if self.state == OPEN and now >= self._open_until:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # A probe that never reported back does not hold the breaker forever
+            if self._probe_started is None or now - self._probe_started > self.reset_timeout:
+                self._probe_started = now
+                return None
+            # Wait for the probe, but not as long as a full reset
+            return min(1.0, self.reset_timeout)
+        return self._open_until - now
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("Bot API is answering again, closing circuit breaker")
+        self.state = CLOSED
+        self._failures = 0
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state == CLOSED:
+                logger.warning("Bot API failed %d times in a row, failing calls fast for %.0f s",
+                               self._failures, self.reset_timeout)
+            self.state = OPEN
+            self._open_until = time.monotonic() + self.reset_timeout
+            self._probe_started = None
@@ -0,0 +1,260 @@
+"""Lesson content loaded from packs on disk and recompiled when they change.
+
+The content directory holds an ``index`` pack, with the main menu text and the
+topics in topic id order (add new topics at the end), and one pack per topic,
+named after it, with its lesson pages and quiz questions. Packs are JSON, or
+YAML (``.yaml``/``.yml``) if PyYAML is installed, and state the format
+``version`` they are written in::
+
+    index.json   {"version": 1, "menu_text": "...", "topics": [{"name": "intro", "title": "Introduction"}]}
+    intro.json   {"version": 1, "lesson": ["..."], "quiz": [{"question": "...", "options": ["..."], "correct": 0}]}
+
+:class:`ContentLibrary` compiles the packs into a :class:`~pages.PageTable` at
+startup, splitting lesson pages too long for one message (see pages.py).
+:meth:`ContentLibrary.reload` recompiles only the topics whose packs
+changed and replaces :attr:`ContentLibrary.current` in one assignment, so a
+handler sees the old content or the new, never a mix. If a pack does not load,
+the content stays as it was.
+
+Every reload makes a new :class:`ContentSnapshot`. Snapshots share the pages of
+the topics that did not change, so a version costs little more than the topics
+it changed. A learner's session holds on to the snapshot they started their
+topic in, and finishes the topic in that version; the library itself keeps only
+weak references to older snapshots, so each one is freed as soon as no session
+uses it any more.
+
+Each snapshot also carries a :class:`~search.SearchIndex` of its lesson pages,
+built along with them: only the recompiled topics are indexed again.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import Counter, Histogram
+from pages import PageTable, TopicPages, build_table, compile_topic
+from search import SearchIndex, TopicIndex
+
+logger = logging.getLogger(__name__)
+
+PACK_VERSION = 1
+INDEX_PACK = 'index'
+PACK_SUFFIXES = ('.json', '.yaml', '.yml')
+
+CONTENT_RELOADS = Counter('bot_content_reloads', "Content reloads after packs changed, by result.", ('result',))
+CONTENT_RELOAD_SECONDS = Histogram('bot_content_reload_seconds',
+                                   "Time to load and recompile changed content packs.",
+                                   buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+CONTENT_TOPICS_RECOMPILED = Counter('bot_content_topics_recompiled', "Topics recompiled by content reloads.")
+
+
+class ContentError(ValueError):
+    """A content pack is missing, unreadable or malformed."""
+
+
+def load_pack(path: str) -> Dict[str, Any]:
+    """Read a JSON or YAML pack and check its format version."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            if path.endswith('.json'):
+                pack = json.load(file)
+            else:
+                try:
+                    import yaml
+                except ImportError:
+                    raise ContentError(f"{path}: YAML packs need PyYAML (pip install pyyaml)") from None
+                pack = yaml.safe_load(file)
+    except ContentError:
+        raise
+    except Exception as exc:
+        raise ContentError(f"{path}: {exc}") from exc
+    if not isinstance(pack, dict) or pack.get('version') != PACK_VERSION:
+        raise ContentError(f"{path}: not a version {PACK_VERSION} content pack")
+    return pack
+
+
+def read_index(path: str) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """The menu text and the ``(topic, menu title)`` pairs of an index pack."""
+    pack = load_pack(path)
+    menu_text, topics = pack.get('menu_text'), pack.get('topics')
+    if not isinstance(menu_text, str) or not isinstance(topics, list):
+        raise ContentError(f"{path}: needs 'menu_text' and a list of 'topics'")
+    menu_topics = []
+    for topic in topics:
+        if not isinstance(topic, dict) or not isinstance(topic.get('name'), str):
+            raise ContentError(f"{path}: every topic needs a 'name'")
+        menu_topics.append((topic['name'], str(topic.get('title', topic['name']))))
+    names = [name for name, _ in menu_topics]
+    if len(set(names)) != len(names):
+        raise ContentError(f"{path}: topic names must be unique")
+    return menu_text, tuple(menu_topics)
+
+
+def read_topic(path: str) -> Tuple[List[str], List[dict]]:
+    """The lesson pages and quiz questions of a topic pack."""
+    pack = load_pack(path)
+    lesson, quiz = pack.get('lesson'), pack.get('quiz', [])
+    if not isinstance(lesson, list) or not lesson or not all(isinstance(page, str) and page for page in lesson):
+        raise ContentError(f"{path}: 'lesson' must be a list of page texts")
+    if not isinstance(quiz, list):
+        raise ContentError(f"{path}: 'quiz' must be a list of questions")
+    for number, question in enumerate(quiz, 1):
+        if not (isinstance(question, dict) and isinstance(question.get('question'), str)
+                and isinstance(question.get('options'), list)
+                and all(isinstance(option, str) for option in question['options'])
+                and isinstance(question.get('correct'), int)
+                and 0 <= question['correct'] < len(question['options'])):
+            raise ContentError(f"{path}: question {number} needs 'question', 'options' and a valid 'correct' index")
+    return lesson, quiz
+
+
+class ContentSnapshot:
+    """One version of the compiled content, numbered from 1 in load order."""
+
+    __slots__ = ('version', 'pages', 'search', '__weakref__')
+
+    def __init__(self, version: int, pages: PageTable, search: SearchIndex):
+        self.version = version
+        self.pages = pages
+        self.search = search
+
+    def __repr__(self) -> str:
+        return f"ContentSnapshot(version={self.version})"
+
+
+class ContentLibrary:
+    """The compiled content of a pack directory, kept up to date by :meth:`watch`.
+
+    Loads and compiles all packs when created.
+
+    Raises:
+        ContentError: A pack could not be loaded.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.current: Optional[ContentSnapshot] = None
+        self.menu_topics: Tuple[Tuple[str, str], ...] = ()
+        self._versions = itertools.count(1)
+        # Every snapshot still referenced, by the library or by a session
+        self._snapshots: "weakref.WeakValueDictionary[int, ContentSnapshot]" = weakref.WeakValueDictionary()
+        self._menu_text = ''
+        # Modification time and size of every pack file, as last loaded, and
+        # as last found when loading failed
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._failed_stamps: Optional[Dict[str, Tuple[int, int]]] = None
+        self._topics: Dict[str, Tuple[int, TopicPages, TopicIndex]] = {}
+        self.reload()
+
+    @property
+    def pages(self) -> PageTable:
+        """The current content."""
+        return self.current.pages
+
+    @property
+    def live_versions(self) -> int:
+        """Content versions still in memory, the current one included."""
+        return len(self._snapshots)
+
+    def pack_path(self, name: str) -> str:
+        for suffix in PACK_SUFFIXES:
+            path = os.path.join(self.directory, name + suffix)
+            if os.path.exists(path):
+                return path
+        raise ContentError(f"No content pack {name!r} in {self.directory}")
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        stamps = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(PACK_SUFFIXES) and entry.is_file():
+                        stat = entry.stat()
+                        stamps[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as exc:
+            raise ContentError(f"Cannot read content directory: {exc}") from exc
+        return stamps
+
+    def reload(self) -> int:
+        """Recompile the topics whose packs changed; returns how many were.
+
+        Raises:
+            ContentError: A changed pack could not be loaded. The current
+                content is kept, and the same files are not tried again until
+                they change.
+        """
+        stamps = self._scan()
+        if stamps == self._stamps or stamps == self._failed_stamps:
+            return 0
+        started = time.perf_counter()
+        try:
+            changed = self._recompile(stamps)
+        except ContentError:
+            CONTENT_RELOADS.labels('failed').inc()
+            self._failed_stamps = stamps
+            raise
+        elapsed = time.perf_counter() - started
+        CONTENT_RELOADS.labels('ok').inc()
+        CONTENT_RELOAD_SECONDS.observe(elapsed)
+        CONTENT_TOPICS_RECOMPILED.inc(changed)
+        logger.info("Content version %d loaded: %d of %d topics recompiled in %.1f ms, %d versions in use",
+                    self.current.version, changed, len(self._topics), elapsed * 1000, self.live_versions,
+                    extra={'event': 'content_reload'})
+        return changed
+
+    def _recompile(self, stamps: Dict[str, Tuple[int, int]]) -> int:
+        index_path = self.pack_path(INDEX_PACK)
+        if self.current is None or stamps.get(index_path) != self._stamps.get(index_path):
+            menu_text, menu_topics = read_index(index_path)
+        else:
+            menu_text, menu_topics = self._menu_text, self.menu_topics
+
+        topics: Dict[str, Tuple[int, TopicPages, TopicIndex]] = {}
+        changed = 0
+        for topic_id, (name, _) in enumerate(menu_topics):
+            path = self.pack_path(name)
+            previous = self._topics.get(name)
+            # Buttons carry the topic id, so a topic that moved is recompiled too
+            if previous is not None and previous[0] == topic_id and stamps.get(path) == self._stamps.get(path):
+                topics[name] = previous
+            else:
+                lesson, quiz = read_topic(path)
+                try:
+                    compiled = compile_topic(topic_id, lesson, quiz)
+                except ValueError as exc:
+                    raise ContentError(f"{path}: {exc}") from exc
+                if len(compiled.lesson) > len(lesson):
+                    logger.info("Topic %s: %d lesson entries split into %d pages to fit in a message",
+                                name, len(lesson), len(compiled.lesson), extra={'event': 'content_reload'})
+                topics[name] = (topic_id, compiled, TopicIndex(page.text for page in compiled.lesson))
+                changed += 1
+        try:
+            pages = build_table({name: compiled for name, (_, compiled, _) in topics.items()}, menu_text, menu_topics)
+        except ValueError as exc:
+            raise ContentError(f"{index_path}: {exc}") from exc
+        search = SearchIndex([index for _, _, index in topics.values()], [title for _, title in menu_topics],
+                             previous=self.current.search if self.current else None)
+
+        self._stamps, self._topics = stamps, topics
+        self._menu_text, self.menu_topics = menu_text, menu_topics
+        snapshot = ContentSnapshot(next(self._versions), pages, search)
+        self._snapshots[snapshot.version] = snapshot
+        self.current = snapshot
+        return changed
+
+    async def watch(self, interval: float) -> None:
+        """Look for changed packs every ``interval`` seconds until cancelled.
+
+        Reloads run in a thread, so updates keep being served meanwhile.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except ContentError as exc:
+                logger.error("Content not reloaded, keeping the current version: %s", exc,
+                             extra={'event': 'content_reload'})
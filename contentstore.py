@@ -0,0 +1,401 @@
+"""Compiled content in one binary file that bot processes map into memory.
+
+Each process that compiles the packs itself (see content.py) holds its own copy
+of every page. With several worker processes and a large course, build the
+content once into a store instead and point the workers at it with
+``CONTENT_STORE``: they map the file read-only, so the operating system keeps
+one copy in the page cache for all of them, and decode a page only when it is
+shown, keeping the most recently shown ones decoded::
+
+    python -m contentstore content/ content.store --watch 2
+
+The store holds every compiled page as a record: its text as UTF-8 and its
+keyboard as JSON. A header points to an index of record offsets and to a small
+JSON block with the menu, the topics and the quiz answers::
+
+    header   magic, format version, index offset, record count, meta offset, meta length
+    records  per page: text length, text, keyboard
+    index    record count + 1 offsets; record i spans offsets i to i + 1
+    lists    per search term: page keys, weights, best page keys, best weights
+    meta     {"menu_topics": ..., "topics": [{"name", "version", "lesson", "quiz", "first", "answers", "page_counts"}],
+              "search": {"pages", "titles", "byteorder", "terms": {term: [offset, pages, best pages]}}}
+
+A topic's records start at ``first``: its lesson pages, the lesson complete
+page, the quiz pages by question and score, and the quiz complete pages by
+score. Record 0 is the main menu. A new store is written next to the old one
+and renamed over it, so workers that still map the old file keep reading it
+until they switch.
+
+The search index (see search.py) is in the store too: the term lists are
+8-byte aligned arrays in the machine's byte order, which workers read through
+the map like the pages. Workers given a store written without them, or on a
+machine of the other byte order, index the lesson texts themselves, and index
+again only the topics whose version changed when they map a new store.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import weakref
+from collections import OrderedDict
+from types import MappingProxyType
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from content import ContentError, ContentLibrary, ContentSnapshot
+from pages import Page, PageTable, QuizAnswer, TopicPages
+from search import SearchIndex, SearchResult, TermList, TopicIndex, query_terms, rank
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'APCS'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sHxxIIII')
+_OFFSET = struct.Struct('<I')
+_SPAN = struct.Struct('<II')
+_TEXT_LENGTH = struct.Struct('<I')
+# Decoded pages kept per store and process
+DEFAULT_CACHE_SIZE = 2048
+
+
+def _encode_page(page: Page) -> bytes:
+    text = page.text.encode()
+    keyboard = [[[button.text, button.callback_data] for button in row] for row in page.reply_markup.inline_keyboard]
+    return _TEXT_LENGTH.pack(len(text)) + text + json.dumps(keyboard, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _topic_pages(topic: TopicPages) -> List[Page]:
+    return [*topic.lesson, topic.lesson_complete, *itertools.chain.from_iterable(topic.quiz), *topic.quiz_complete]
+
+
+def write_store(pages: PageTable, menu_topics: Sequence[Tuple[str, str]], path: str,
+                search: Optional[SearchIndex] = None) -> None:
+    """Write compiled content and its search index to ``path``, replacing any store there in one rename.
+
+    Without ``search`` the workers reading the store index it themselves.
+    """
+    records = [_encode_page(pages.main_menu)]
+    topics = []
+    for name, topic in pages.topics.items():
+        topics.append({'name': name, 'version': topic.version, 'lesson': len(topic.lesson),
+                       'quiz': len(topic.quiz), 'first': len(records),
+                       'answers': [list(answer) for answer in topic.answers],
+                       'page_counts': list(topic.page_counts)})
+        records.extend(_encode_page(page) for page in _topic_pages(topic))
+    offsets = [_HEADER.size]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    index_offset = offsets[-1]
+    lists_offset = -(-(index_offset + _OFFSET.size * len(offsets)) // 8) * 8
+    lists = []
+    meta = {'menu_topics': [list(entry) for entry in menu_topics], 'topics': topics}
+    if search is not None:
+        entries = {}
+        offset = lists_offset
+        for term, term_list in search.lists.items():
+            entries[term] = [offset, len(term_list.keys), len(term_list.best_keys)]
+            for column, typecode in zip(term_list, 'qdqd'):
+                lists.append(array(typecode, column).tobytes())
+                offset += len(lists[-1])
+        meta['search'] = {'pages': search.pages, 'titles': list(search.titles), 'byteorder': sys.byteorder,
+                          'terms': entries}
+    meta_offset = lists_offset + sum(map(len, lists))
+    meta = json.dumps(meta, ensure_ascii=False).encode()
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, index_offset, len(records), meta_offset, len(meta))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(header)
+        file.writelines(records)
+        file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        file.write(bytes(lists_offset - index_offset - _OFFSET.size * len(offsets)))
+        file.writelines(lists)
+        file.write(meta)
+    os.replace(temporary, path)
+
+
+class MappedStore:
+    """A store file mapped read-only, decoding pages on demand.
+
+    Args:
+        path: The store file.
+        cache_size: Decoded pages to keep, most recently used first.
+
+    Raises:
+        ContentError: The file is not a content store this version can read.
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        try:
+            with open(path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as exc:
+            raise ContentError(f"Cannot map content store {path}: {exc}") from exc
+        try:
+            magic, version, self._index_offset, self.records, meta_offset, meta_length = \
+                _HEADER.unpack_from(self._map)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"not a version {FORMAT_VERSION} content store")
+            self.meta = json.loads(self._map[meta_offset:meta_offset + meta_length])
+        except (struct.error, ValueError) as exc:
+            self._map.close()
+            raise ContentError(f"{path}: {exc}") from exc
+        self._cache: "OrderedDict[int, Page]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def _span(self, record: int) -> Tuple[int, int, int]:
+        if not 0 <= record < self.records:
+            raise IndexError(record)
+        start, end = _SPAN.unpack_from(self._map, self._index_offset + _OFFSET.size * record)
+        return start, start + _TEXT_LENGTH.size + _TEXT_LENGTH.unpack_from(self._map, start)[0], end
+
+    def text(self, record: int) -> str:
+        """The text of a page, without decoding its keyboard or caching it."""
+        start, text_end, _ = self._span(record)
+        return self._map[start + _TEXT_LENGTH.size:text_end].decode()
+
+    def page(self, record: int) -> Page:
+        page = self._cache.get(record)
+        if page is not None:
+            self._cache.move_to_end(record)
+            return page
+        start, text_end, end = self._span(record)
+        keyboard = json.loads(self._map[text_end:end])
+        page = Page(
+            self._map[start + _TEXT_LENGTH.size:text_end].decode(),
+            InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=data) for label, data in row]
+                                  for row in keyboard]),
+        )
+        self._cache[record] = page
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return page
+
+    def pages(self) -> PageTable:
+        """The store's content as a page table, with topics that decode pages when read."""
+        topics = {entry['name']: MappedTopic(self, entry) for entry in self.meta['topics']}
+        main_menu = self.page(0)
+        return PageTable(main_menu, MappingProxyType(topics), tuple(topics.values()),
+                         MappingProxyType({name: topic_id for topic_id, name in enumerate(topics)}))
+
+    def search(self) -> Optional["MappedSearchIndex"]:
+        """The store's search index, or ``None`` if the store has none this machine can read."""
+        search = self.meta.get('search')
+        if search is None or search['byteorder'] != sys.byteorder:
+            return None
+        return MappedSearchIndex(memoryview(self._map), search)
+
+
+class MappedSearchIndex:
+    """The search index of a :class:`MappedStore`, with the interface of :class:`~search.SearchIndex`.
+
+    Term lists are read from the map when a query uses them.
+    """
+
+    __slots__ = ('titles', 'pages', '_view', '_terms')
+
+    def __init__(self, view: memoryview, meta: dict):
+        self.titles = tuple(meta['titles'])
+        self.pages = meta['pages']
+        self._view = view
+        self._terms: Dict[str, List[int]] = meta['terms']
+
+    def _list(self, term: str) -> Optional[TermList]:
+        entry = self._terms.get(term)
+        if entry is None:
+            return None
+        offset, count, best = entry
+        columns = []
+        for length, typecode in zip((count, count, best, best), 'qdqd'):
+            columns.append(self._view[offset:offset + 8 * length].cast(typecode))
+            offset += 8 * length
+        return TermList(*columns)
+
+    def search(self, query: str, limit: int = 5) -> List[SearchResult]:
+        """The ``limit`` pages that best match ``query``, best first."""
+        return rank(self.pages, [self._list(term) for term in query_terms(query)], limit)
+
+
+class _Records(Sequence):
+    """``count`` consecutive records, read like a tuple of pages."""
+
+    __slots__ = ('_store', '_first', '_count')
+
+    def __init__(self, store: MappedStore, first: int, count: int):
+        self._store = store
+        self._first = first
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> Page:
+        if not -self._count <= index < self._count:
+            raise IndexError(index)
+        return self._store.page(self._first + index % self._count)
+
+
+class _QuizRecords(Sequence):
+    """Quiz pages by question, then by score; question ``i`` has ``i + 1`` scores."""
+
+    __slots__ = ('_store', '_first', '_count')
+
+    def __init__(self, store: MappedStore, first: int, count: int):
+        self._store = store
+        self._first = first
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> _Records:
+        if not -self._count <= index < self._count:
+            raise IndexError(index)
+        index %= self._count
+        return _Records(self._store, self._first + index * (index + 1) // 2, index + 1)
+
+
+class MappedTopic:
+    """A topic of a :class:`MappedStore`, with the attributes of :class:`~pages.TopicPages`."""
+
+    __slots__ = ('version', 'lesson', 'quiz', 'quiz_complete', 'answers', 'page_counts', '_store', '_lesson_complete')
+
+    def __init__(self, store: MappedStore, entry: dict):
+        first, lessons, questions = entry['first'], entry['lesson'], entry['quiz']
+        quiz_first = first + lessons + 1
+        self.version = entry['version']
+        self.lesson = _Records(store, first, lessons)
+        self.quiz = _QuizRecords(store, quiz_first, questions)
+        self.quiz_complete = _Records(store, quiz_first + questions * (questions + 1) // 2, questions + 1)
+        self.answers = tuple(QuizAnswer(*answer) for answer in entry['answers'])
+        # Stores written before lesson pages were split have one page per entry
+        self.page_counts = tuple(entry.get('page_counts', (1,) * lessons))
+        self._store = store
+        self._lesson_complete = first + lessons
+
+    @property
+    def lesson_complete(self) -> Page:
+        return self._store.page(self._lesson_complete)
+
+
+class StoreLibrary:
+    """Content served from a store file, with the interface of :class:`~content.ContentLibrary`.
+
+    :meth:`reload` maps the file again once it has been replaced.
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.current: Optional[ContentSnapshot] = None
+        self.menu_topics: Tuple[Tuple[str, str], ...] = ()
+        self._versions = itertools.count(1)
+        self._snapshots: "weakref.WeakValueDictionary[int, ContentSnapshot]" = weakref.WeakValueDictionary()
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        # Search index of every topic, by name, version and lesson pages, for stores without one
+        self._indexes: Dict[Tuple[str, int, int], TopicIndex] = {}
+        self.reload()
+
+    @property
+    def pages(self) -> PageTable:
+        return self.current.pages
+
+    @property
+    def live_versions(self) -> int:
+        return len(self._snapshots)
+
+    def reload(self) -> int:
+        """Map the store again if the file changed; returns 1 if it did, else 0.
+
+        Raises:
+            ContentError: The new file could not be read; the current content is kept.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError as exc:
+            raise ContentError(f"Cannot read content store: {exc}") from exc
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return 0
+        started = time.perf_counter()
+        self._stamp = stamp
+        store = MappedStore(self.path, self.cache_size)
+        self.menu_topics = tuple(tuple(entry) for entry in store.meta['menu_topics'])
+        search = store.search() or self._index(store)
+        # The map is closed when the last session reading this version lets go
+        snapshot = ContentSnapshot(next(self._versions), store.pages(), search)
+        self._snapshots[snapshot.version] = snapshot
+        self.current = snapshot
+        logger.info("Content store %s mapped as version %d in %.1f ms, %d versions in use", self.path,
+                    snapshot.version, (time.perf_counter() - started) * 1000, self.live_versions,
+                    extra={'event': 'content_reload'})
+        return 1
+
+    def _index(self, store: MappedStore) -> SearchIndex:
+        """Index the lesson texts of a store written without a search index."""
+        indexes = {}
+        for entry in store.meta['topics']:
+            key = (entry['name'], entry['version'], entry['lesson'])
+            indexes[key] = self._indexes.get(key) or TopicIndex(
+                store.text(record) for record in range(entry['first'], entry['first'] + entry['lesson']))
+        titles = dict(self.menu_topics)
+        previous = self.current.search if self.current else None
+        search = SearchIndex(list(indexes.values()), [titles.get(name, name) for name, _, _ in indexes],
+                             previous=previous if isinstance(previous, SearchIndex) else None)
+        self._indexes = indexes
+        return search
+
+    async def watch(self, interval: float) -> None:
+        """Look for a new store file every ``interval`` seconds until cancelled.
+
+        A new store is mapped in a thread.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except ContentError as exc:
+                logger.error("Content store not reloaded, keeping the current version: %s", exc,
+                             extra={'event': 'content_reload'})
+
+
+def build(library: ContentLibrary, path: str) -> None:
+    started = time.perf_counter()
+    write_store(library.pages, library.menu_topics, path, library.current.search)
+    logger.info("Wrote %d topics to %s (%d bytes) in %.1f ms", len(library.pages.by_id), path,
+                os.path.getsize(path), (time.perf_counter() - started) * 1000)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compile content packs into a store that bot workers map.")
+    parser.add_argument('content_dir')
+    parser.add_argument('store')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help="keep running and rebuild the store when packs change")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    library = ContentLibrary(args.content_dir)
+    build(library, args.store)
+    while args.watch:
+        time.sleep(args.watch)
+        current = library.current
+        try:
+            library.reload()
+        except ContentError as exc:
+            logger.error("Store not rebuilt: %s", exc)
+            continue
+        if library.current is not current:
+            build(library, args.store)
+
+
+if __name__ == "__main__":
+    main()
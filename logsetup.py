@@ -0,0 +1,154 @@
+"""Logging that never writes from the event loop.
+
+Handlers on the event loop only put records on a queue; a ``QueueListener``
+thread formats them and writes them out, so a slow terminal or disk delays the
+log, not the bot. Messages use %-style arguments and are only formatted on that
+thread. High-volume events (button presses) are tagged with ``extra={'event':
+...}`` and can be sampled so that only a fraction of them is queued at all.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Dict, Optional
+
+from metrics import Counter
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+LOG_RECORDS_DROPPED = Counter('bot_log_records_dropped', "Log records dropped because the log queue was full.")
+
+# Attributes every LogRecord has; anything else on a record came from ``extra``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            document['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(document, default=str, ensure_ascii=False)
+
+
+class EventSampler(logging.Filter):
+    """Keep only a fraction of the records of each sampled event.
+
+    Sampling is deterministic: at a rate of 0.1 every tenth record of that event
+    is kept. Kept records carry ``sample_rate`` so counts can be scaled back up.
+    Records without an ``event`` or of an event without a rate always pass.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        # Start one step short of a full credit so the first record is kept
+        self._credit = {event: 1 - rate for event, rate in rates.items()}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        rate = self.rates.get(event)
+        if rate is None or rate >= 1:
+            return True
+        credit = self._credit[event] + rate
+        if credit < 1 - 1e-9:
+            self._credit[event] = credit
+            return False
+        self._credit[event] = credit - 1
+        record.sample_rate = rate
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue records as they are, leaving all formatting to the listener thread.
+
+    The standard ``QueueHandler`` formats every record before queuing it, which
+    is the work this pipeline moves off the event loop. The record is queued
+    unchanged instead, so its arguments must not be mutated after logging;
+    this is fine for the ids and strings the bot logs. When the queue is full
+    the record is dropped and counted rather than blocking.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def skip_unused_record_fields() -> None:
+    """Stop collecting caller, thread and process details for every record.
+
+    None of the formats here print them, and looking up the calling frame is
+    the most expensive part of creating a record. These are the switches the
+    logging documentation lists under "Optimization".
+    """
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse ``'event=rate,event=rate'`` into a dict."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        event, separator, rate = item.partition('=')
+        if not separator:
+            raise ValueError(f"Expected event=rate, got {item!r}")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level: str = 'INFO', fmt: str = 'json', filename: Optional[str] = None,
+                      sample_rates: Optional[Dict[str, float]] = None,
+                      max_queued: int = 10000) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a writer thread and start it.
+
+    Args:
+        level: Root log level.
+        fmt: ``'json'`` for JSON lines, ``'text'`` for the classic one-line format.
+        filename: Append to this file instead of writing to stderr.
+        sample_rates: Fraction of records to keep per ``event``.
+        max_queued: Records held in the queue before new ones are dropped.
+
+    Returns:
+        The running listener; call its ``stop`` method on shutdown to flush the
+        queue.
+    """
+    if fmt not in ('json', 'text'):
+        raise ValueError(f"Log format must be 'json' or 'text', got {fmt!r}")
+    output = logging.FileHandler(filename, encoding='utf-8') if filename else logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    skip_unused_record_fields()
+    records = queue.Queue(max_queued)
+    handler = LazyQueueHandler(records)
+    if sample_rates:
+        handler.addFilter(EventSampler(sample_rates))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,291 @@
+"""Precompiled, immutable reply pages for the menu, lesson and quiz screens.
+
+Everything a handler sends is built once at startup by :func:`compile_pages`, so
+serving a tap is a tuple lookup instead of rebuilding keyboards and strings.
+
+Every lesson and quiz button carries the position it leads to in its
+callback_data: topic id, page or question index, the score so far for quiz
+answers, and the topic's content version. A tap can therefore be served from
+the page table alone, without the learner's session.
+
+callback_data comes back from the client unchecked, so a learner can send any
+position, a made-up score included. The score is display-only: it picks the
+question and completion screens shown to that learner and is kept in their
+session, and nothing else reads it. Anything that ranks or rewards learners
+by it must keep its own count instead. Signing the buttons would not help:
+pages are shared by all learners and stored in the content store, so a
+signature could not tie a button to a learner, and any score shown to someone
+once could be replayed.
+
+Lesson pages longer than Telegram allows in one message are split into several
+pages at compile time, at paragraph breaks where possible, and the buttons
+number the pages after splitting. Quiz screens cannot be split, so a question
+too long to send fails compilation instead of the update that would show it.
+"""
+import json
+import zlib
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+LESSON_COMPLETE_TEXT = "You've completed this lesson! Let's test your knowledge with a quiz."
+QUIZ_COMPLETE_TEXT = "Quiz completed! Your score: {score}/{total}\nChoose another topic to continue learning."
+CORRECT_TEXT = "Correct!"
+WRONG_TEXT = "Sorry, the correct answer was: {answer}"
+
+# callback_data is an action code, optionally followed by ':'-separated arguments:
+#   t:<topic>                                        open a topic
+#   l:<topic>:<page>:<version>                       lesson page; page len(lesson) is the lesson complete screen
+#   s:<topic>:<version>                              first quiz question
+#   a:<topic>:<question>:<choice>:<score>:<version>  answer, with the score before it (untrusted, display-only)
+MENU, TOPIC, LESSON, START_QUIZ, ANSWER = 'm', 't', 'l', 's', 'a'
+ACTION_NAMES = {MENU: 'menu', TOPIC: 'topic', LESSON: 'lesson_page', START_QUIZ: 'start_quiz', ANSWER: 'quiz_answer'}
+# Buttons sent by earlier versions; those that relied on the session decode
+# without a position
+LEGACY_ACTIONS = {'menu': MENU, 'next': LESSON, 'prev': LESSON, 'n': LESSON, 'p': LESSON, 'start_quiz': START_QUIZ}
+# Telegram's limit for callback_data
+MAX_CALLBACK_DATA = 64
+# Telegram's limits for message texts and media captions, in UTF-16 code units
+MAX_TEXT_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+# Telegram's limit for the notification answerCallbackQuery shows
+MAX_ANSWER_TEXT_LENGTH = 200
+# Where long texts are split, in order of preference
+_SEPARATORS = ('\n\n', '\n', ' ')
+
+
+class Page(NamedTuple):
+    text: str
+    reply_markup: InlineKeyboardMarkup
+
+
+class QuizAnswer(NamedTuple):
+    correct: int
+    correct_text: str
+    wrong_text: str
+
+
+class TopicPages(NamedTuple):
+    # Changes whenever the topic's lesson or quiz content changes
+    version: int
+    lesson: Tuple[Page, ...]
+    lesson_complete: Page
+    # Indexed by question, then by the score so far, which the answer buttons carry
+    quiz: Tuple[Tuple[Page, ...], ...]
+    # One completion screen per possible score, indexed by score
+    quiz_complete: Tuple[Page, ...]
+    answers: Tuple[QuizAnswer, ...]
+    # How many lesson pages each lesson entry was split into, in lesson order
+    page_counts: Tuple[int, ...]
+
+
+class PageTable(NamedTuple):
+    main_menu: Page
+    topics: Mapping[str, TopicPages]
+    # Topics by id, and the id of each topic; ids follow the order of the lessons dict
+    by_id: Tuple[TopicPages, ...]
+    topic_ids: Mapping[str, int]
+
+
+def callback_data(action: str, *arguments: object) -> str:
+    data = ':'.join((action, *map(str, arguments)))
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data {data!r} is longer than {MAX_CALLBACK_DATA} bytes")
+    return data
+
+
+def decode_callback_data(data: str) -> Tuple[str, str]:
+    """Split callback data into its action code and argument."""
+    action, _, argument = data.partition(':')
+    if action in ACTION_NAMES:
+        return action, argument
+    if data in LEGACY_ACTIONS:
+        return LEGACY_ACTIONS[data], ''
+    if data.startswith('quiz_'):
+        return ANSWER, ''
+    # Old menus used the bare topic name
+    return TOPIC, data
+
+
+def parse_arguments(argument: str, count: int) -> Optional[Tuple[int, ...]]:
+    """The ``count`` integers of a callback argument, or None if it holds anything else."""
+    parts = argument.split(':')
+    if len(parts) != count:
+        return None
+    try:
+        return tuple(map(int, parts))
+    except ValueError:
+        return None
+
+
+def content_version(lesson: Sequence[str], quiz: Sequence[dict]) -> int:
+    """A short checksum of a topic's content, to tell buttons of older content apart."""
+    return zlib.crc32(json.dumps([lesson, quiz], sort_keys=True).encode()) & 0xFFFF
+
+
+def text_length(text: str) -> int:
+    """Length of ``text`` as Telegram counts it, in UTF-16 code units."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def split_text(text: str, limit: int = MAX_TEXT_LENGTH) -> Tuple[str, ...]:
+    """Split ``text`` into parts of at most ``limit`` UTF-16 code units.
+
+    Splits at paragraph breaks, then at line breaks, then between words, and
+    only cuts through a word that is longer than ``limit`` by itself.
+    """
+    if text_length(text) <= limit:
+        return (text,)
+    parts = (part.strip() for part in _split(text, limit, _SEPARATORS))
+    return tuple(part for part in parts if part)
+
+
+def _split(text: str, limit: int, separators: Sequence[str]) -> list:
+    if text_length(text) <= limit:
+        return [text]
+    if not separators:
+        return _cut(text, limit)
+    separator = separators[0]
+    parts = []
+    current = None
+    for chunk in text.split(separator):
+        joined = chunk if current is None else current + separator + chunk
+        if text_length(joined) <= limit:
+            current = joined
+            continue
+        if current is not None:
+            parts.append(current)
+        # The rest of a chunk split at a finer separator may still take the next chunks
+        *whole, current = _split(chunk, limit, separators[1:])
+        parts.extend(whole)
+    parts.append(current)
+    return parts
+
+
+def _cut(text: str, limit: int) -> list:
+    parts = []
+    start = length = 0
+    for index, char in enumerate(text):
+        size = 2 if ord(char) > 0xFFFF else 1
+        if length + size > limit:
+            parts.append(text[start:index])
+            start, length = index, 0
+        length += size
+    parts.append(text[start:])
+    return parts
+
+
+def _keyboard(*rows: Sequence[InlineKeyboardButton]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([list(row) for row in rows])
+
+
+def compile_topic(topic_id: int, lesson: Sequence[str], quiz: Sequence[dict],
+                  limit: int = MAX_TEXT_LENGTH) -> TopicPages:
+    """Compile a topic's pages, splitting lesson pages longer than ``limit``.
+
+    Raises:
+        ValueError: A quiz question would not fit in ``limit``, even with the
+            verdict on the previous answer shown above it, or a button's
+            callback_data is too long.
+    """
+    entries = [split_text(text, limit) for text in lesson]
+    page_counts = tuple(map(len, entries))
+    lesson = [text for parts in entries for text in parts]
+    # Topics whose pages all fit keep the version they had before splitting
+    version = content_version(lesson, quiz)
+
+    def lesson_button(label: str, page: int) -> InlineKeyboardButton:
+        return InlineKeyboardButton(label, callback_data=callback_data(LESSON, topic_id, page, version))
+
+    lesson_pages = tuple(
+        Page(text, _keyboard(
+            [lesson_button("Next", index + 1)] if index == 0
+            else [lesson_button("Previous", index - 1), lesson_button("Next", index + 1)]
+        ))
+        for index, text in enumerate(lesson)
+    )
+    lesson_complete = Page(
+        LESSON_COMPLETE_TEXT,
+        _keyboard([InlineKeyboardButton("Start Quiz", callback_data=callback_data(START_QUIZ, topic_id, version))]),
+    )
+
+    # Question ``index`` can be reached with any score from 0 to ``index``
+    quiz_pages = tuple(
+        tuple(
+            Page(
+                f"Question {index + 1}: {question['question']}",
+                _keyboard([
+                    InlineKeyboardButton(option, callback_data=callback_data(ANSWER, topic_id, index, i, score, version))
+                    for i, option in enumerate(question['options'])
+                ]),
+            )
+            for score in range(index + 1)
+        )
+        for index, question in enumerate(quiz)
+    )
+    menu_markup = _keyboard([InlineKeyboardButton("Back to Menu", callback_data=callback_data(MENU))])
+    total = len(quiz)
+    quiz_complete = tuple(
+        Page(QUIZ_COMPLETE_TEXT.format(score=score, total=total), menu_markup)
+        for score in range(total + 1)
+    )
+    answers = tuple(
+        QuizAnswer(
+            question['correct'],
+            CORRECT_TEXT,
+            WRONG_TEXT.format(answer=question['options'][question['correct']]),
+        )
+        for question in quiz
+    )
+    # With QUIZ_FEEDBACK=header the verdict on an answer is shown above the next screen
+    headers = [''] + [max(answer.correct_text, answer.wrong_text, key=text_length) + '\n\n' for answer in answers]
+    for index, pages in enumerate(quiz_pages):
+        if text_length(headers[index] + pages[0].text) > limit:
+            raise ValueError(f"quiz question {index + 1} is longer than the {limit} characters a message can hold")
+    if text_length(headers[-1] + quiz_complete[-1].text) > limit:
+        raise ValueError(f"the answer to the last quiz question is longer than the {limit} characters a message can hold")
+    return TopicPages(version, lesson_pages, lesson_complete, quiz_pages, quiz_complete, answers, page_counts)
+
+
+def compile_pages(
+    lessons: Mapping[str, Sequence[str]],
+    quizzes: Mapping[str, Sequence[dict]],
+    menu_text: str,
+    menu_topics: Sequence[Tuple[str, str]],
+) -> PageTable:
+    """Compile the lesson and quiz dicts into a frozen table of ready-to-send pages.
+
+    ``menu_topics`` is a sequence of ``(topic, button label)`` pairs in menu order.
+    """
+    topics = {
+        topic: compile_topic(topic_id, pages, quizzes.get(topic, ()))
+        for topic_id, (topic, pages) in enumerate(lessons.items())
+    }
+    return build_table(topics, menu_text, menu_topics)
+
+
+def build_table(
+    topics: Mapping[str, TopicPages],
+    menu_text: str,
+    menu_topics: Sequence[Tuple[str, str]],
+) -> PageTable:
+    """Put compiled topics, in topic id order, into a page table with the main menu.
+
+    Lets a content reload reuse the pages of topics that did not change.
+
+    Raises:
+        ValueError: ``menu_text`` does not fit in a message.
+    """
+    if text_length(menu_text) > MAX_TEXT_LENGTH:
+        raise ValueError(f"the menu text is longer than the {MAX_TEXT_LENGTH} characters a message can hold")
+    topic_ids = {topic: topic_id for topic_id, topic in enumerate(topics)}
+    # Menu entries without a lesson keep their name and are answered as unavailable
+    main_menu = Page(
+        menu_text,
+        _keyboard(*(
+            [InlineKeyboardButton(label, callback_data=callback_data(TOPIC, topic_ids.get(topic, topic)))]
+            for topic, label in menu_topics
+        )),
+    )
+    return PageTable(main_menu, MappingProxyType(topics), tuple(topics.values()), MappingProxyType(topic_ids))
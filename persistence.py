@@ -0,0 +1,223 @@
+"""SQLite-backed persistence for learner progress and conversation states.
+
+The database runs in WAL mode and every query goes through a single worker
+thread, so the event loop never waits on disk. Writes handed over by the
+application on each ``update_interval`` are collected and committed in one
+transaction. User data is not read at startup: a user's row is loaded the first
+time one of their updates is handled (``refresh_user_data``), so startup cost
+does not grow with the number of learners.
+"""
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple, Union
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+KEY_COLUMNS = {'user_data': 'user_id', 'chat_data': 'chat_id', 'bot_data': 'id'}
+
+
+def _pickle(data: Any) -> bytes:
+    return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+class SQLitePersistence(BasePersistence[Dict[Any, Any], Dict[Any, Any], Dict[Any, Any]]):
+    """Persist user, chat and bot data and conversation states in an SQLite file.
+
+    Args:
+        filepath: Path of the database file; it is created if missing.
+        store_data: What to persist. Defaults to user data only, which is all this
+            bot keeps. Callback data is not supported.
+        update_interval: Seconds between the application's persistence runs.
+        dump_user_data: Turns one user's data into bytes. Defaults to pickle.
+        load_user_data: Turns those bytes back into user data. The result is
+            merged into the live object with its ``update`` method.
+    """
+
+    def __init__(self, filepath: str, store_data: Optional[PersistenceInput] = None,
+                 update_interval: float = 60, dump_user_data: Optional[Callable[[Any], bytes]] = None,
+                 load_user_data: Callable[[bytes], Any] = pickle.loads):
+        store_data = store_data or PersistenceInput(bot_data=False, chat_data=False, callback_data=False)
+        if store_data.callback_data:
+            raise ValueError("SQLitePersistence does not store callback data")
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self._dump_user_data = dump_user_data or _pickle
+        self._load_user_data = load_user_data
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._loaded_users: Set[int] = set()
+        self._loaded_chats: Set[int] = set()
+        # Writes waiting for the next transaction, keyed by table and row
+        self._pending: Dict[Tuple[str, Any], Optional[bytes]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._writer: Optional[asyncio.Task] = None
+
+    # Database thread ---------------------------------------------------------
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-persistence')
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.filepath, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _select_one(self, table: str, row_id: int) -> Optional[bytes]:
+        row = self._db().execute(f"SELECT data FROM {table} WHERE {KEY_COLUMNS[table]} = ?", (row_id,)).fetchone()
+        return row[0] if row else None
+
+    def _select_conversations(self, name: str) -> Dict[Tuple[Union[int, str], ...], object]:
+        # Let SQLite assemble one JSON document; decoding it in a single call is
+        # far cheaper than decoding every key and state separately
+        (document,) = self._db().execute(
+            "SELECT '[' || group_concat('[' || key || ',' || state || ']') || ']' FROM conversations WHERE name = ?",
+            (name,),
+        ).fetchone()
+        return {tuple(key): state for key, state in json.loads(document or '[]')}
+
+    def _write(self, rows: Dict[Tuple[str, Any], Optional[bytes]],
+               conversations: Dict[Tuple[str, str], Optional[str]]) -> None:
+        db = self._db()
+        with db:
+            for (table, row_id), data in rows.items():
+                column = KEY_COLUMNS[table]
+                if data is None:
+                    db.execute(f"DELETE FROM {table} WHERE {column} = ?", (row_id,))
+                else:
+                    db.execute(f"INSERT OR REPLACE INTO {table} ({column}, data) VALUES (?, ?)", (row_id, data))
+            db.executemany(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                [(name, key, state) for (name, key), state in conversations.items() if state is not None],
+            )
+            db.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), state in conversations.items() if state is None],
+            )
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    # Write batching ----------------------------------------------------------
+
+    def _queue_write(self, table: str, row_id: Any, data: Optional[bytes]) -> None:
+        self._pending[(table, row_id)] = data
+        self._schedule_write()
+
+    def _schedule_write(self) -> None:
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        # The application hands over all changes of one run before awaiting any of
+        # them, so yielding once lets the whole run land in a single transaction
+        await asyncio.sleep(0)
+        while self._pending or self._pending_conversations:
+            rows, self._pending = self._pending, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                await self._run(self._write, rows, conversations)
+            except sqlite3.Error:
+                logger.exception("Writing %d rows to %s failed, retrying on the next update",
+                                 len(rows) + len(conversations), self.filepath)
+                # Keep anything that was queued in the meantime, it is newer
+                self._pending = {**rows, **self._pending}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                return
+
+    # BasePersistence -----------------------------------------------------------
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Loaded per user in refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        data = await self._run(self._select_one, 'bot_data', 0)
+        return pickle.loads(data) if data else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Union[int, str], ...], object]:
+        return await self._run(self._select_conversations, name)
+
+    async def update_conversation(self, name: str, key: Tuple[Union[int, str], ...], new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, json.dumps(key))] = None if new_state is None else json.dumps(new_state)
+        self._schedule_write()
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # A user whose row was never loaded has only an empty placeholder in memory
+        if user_id in self._loaded_users:
+            self._queue_write('user_data', user_id, self._dump_user_data(data))
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        if chat_id in self._loaded_chats:
+            self._queue_write('chat_data', chat_id, _pickle(data))
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._queue_write('bot_data', 0, _pickle(data))
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded_users.add(user_id)
+        self._queue_write('user_data', user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded_chats.add(chat_id)
+        self._queue_write('chat_data', chat_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id not in self._loaded_users:
+            data = await self._run(self._select_one, 'user_data', user_id)
+            if user_id not in self._loaded_users:
+                self._loaded_users.add(user_id)
+                if data:
+                    user_data.update(self._load_user_data(data))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        if chat_id not in self._loaded_chats:
+            data = await self._run(self._select_one, 'chat_data', chat_id)
+            if chat_id not in self._loaded_chats:
+                self._loaded_chats.add(chat_id)
+                if data:
+                    chat_data.update(pickle.loads(data))
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
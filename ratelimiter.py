@@ -0,0 +1,220 @@
+"""Outbound rate limiting that keeps the bot under Telegram's flood limits.
+
+Telegram allows a bot about 30 messages a second overall and about one a second
+per chat (20 a minute in groups), with short bursts tolerated; going over gets
+a 429 ``RetryAfter``. :class:`PriorityRateLimiter` spaces requests that concern
+a chat with a token bucket per chat and one shared by all chats. When requests
+queue for the shared bucket, interactive ones (replies and edits for a learner
+who is waiting) go before bulk ones (broadcasts), which callers mark with
+``rate_limit_args=BULK``. A ``RetryAfter`` that still gets through holds back
+that chat for the time Telegram asks and retries the request.
+"""
+import asyncio
+import datetime
+import logging
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first; pass as ``rate_limit_args`` to a bot method
+INTERACTIVE, BULK = 0, 1
+PRIORITY_NAMES = ('interactive', 'bulk')
+
+RATE_LIMITER_QUEUED = Gauge('bot_rate_limiter_queued', "Bot API requests waiting for the rate limiter.",
+                            ('priority',))
+RATE_LIMITER_WAIT_SECONDS = Histogram('bot_rate_limiter_wait_seconds',
+                                      "Time Bot API requests waited for the rate limiter.", ('priority',),
+                                      buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+RATE_LIMITER_RETRIES = Counter('bot_rate_limiter_retries', "Requests retried after a RetryAfter from Telegram.",
+                               ('method',))
+
+
+class TokenBucket:
+    """Token bucket kept as the time the bucket is next empty (GCRA).
+
+    Args:
+        rate: Tokens added per second.
+        burst: Tokens the bucket holds when full.
+    """
+
+    __slots__ = ('interval', 'tolerance', 'next_free')
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0 or burst < 1:
+            raise ValueError("`rate` must be positive and `burst` at least 1")
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.next_free = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds from ``now`` until a token is available."""
+        return max(0.0, self.next_free - self.tolerance - now)
+
+    def take(self, now: float) -> None:
+        self.next_free = max(self.next_free, now) + self.interval
+
+
+def _retry_after_seconds(exc: RetryAfter) -> float:
+    retry_after = exc.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """Per-chat and global token buckets with priority classes and RetryAfter backoff.
+
+    Requests without a ``chat_id`` (answering callback queries, ``getMe``,
+    webhook setup) are not limited. The others first wait for their chat's
+    bucket, in the order they arrived, then for the global bucket, where
+    :data:`INTERACTIVE` requests are served before :data:`BULK` ones.
+
+    Args:
+        overall_rate: Requests per second across all chats.
+        overall_burst: Requests that may go out at once after a quiet period.
+        chat_rate: Requests per second to one private chat.
+        chat_burst: Burst allowed per private chat.
+        group_rate: Requests per second to one group or channel.
+        group_burst: Burst allowed per group or channel.
+        max_retries: How often a request is retried after a ``RetryAfter``
+            before the error is raised to the caller.
+    """
+
+    __slots__ = ('_overall', '_chat_bucket', '_group_bucket', '_max_retries', '_chats', '_prune_at',
+                 '_waiting', '_dispatcher', '_queued', '_waits')
+
+    def __init__(self, overall_rate: float = 30, overall_burst: int = 30, chat_rate: float = 1,
+                 chat_burst: int = 3, group_rate: float = 20 / 60, group_burst: int = 3, max_retries: int = 3):
+        self._overall = TokenBucket(overall_rate, overall_burst)
+        # Per-chat buckets share these parameters; only their next_free is stored per chat
+        self._chat_bucket = TokenBucket(chat_rate, chat_burst)
+        self._group_bucket = TokenBucket(group_rate, group_burst)
+        self._max_retries = max_retries
+        self._chats: Dict[Union[int, str], float] = {}
+        self._prune_at = 1024
+        self._waiting: Tuple[Deque[asyncio.Future], ...] = tuple(deque() for _ in PRIORITY_NAMES)
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._queued = [RATE_LIMITER_QUEUED.labels(name) for name in PRIORITY_NAMES]
+        self._waits = [RATE_LIMITER_WAIT_SECONDS.labels(name) for name in PRIORITY_NAMES]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for waiting in self._waiting:
+            for waiter in waiting:
+                waiter.cancel()
+            waiting.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        """Wait for the buckets, make the request and retry it after ``RetryAfter``.
+
+        Args:
+            rate_limit_args: :data:`INTERACTIVE` (the default) or :data:`BULK`.
+        """
+        chat_id = data.get('chat_id')
+        priority = INTERACTIVE if rate_limit_args is None else rate_limit_args
+        retries = 0
+        while True:
+            if chat_id is not None:
+                await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if retries == self._max_retries:
+                    raise
+                retries += 1
+                delay = _retry_after_seconds(exc)
+                RATE_LIMITER_RETRIES.labels(endpoint).inc()
+                logger.warning("Flood limit hit by %s to chat %s, retrying in %.1f s", endpoint, chat_id, delay)
+                if chat_id is None:
+                    await asyncio.sleep(delay)
+                else:
+                    self._hold_chat(chat_id, delay)
+
+    def _bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        # Private chats have positive ids; groups and channels negative ids or @usernames
+        return self._chat_bucket if isinstance(chat_id, int) and chat_id > 0 else self._group_bucket
+
+    def _hold_chat(self, chat_id: Union[int, str], delay: float) -> None:
+        bucket = self._bucket(chat_id)
+        now = asyncio.get_running_loop().time()
+        self._chats[chat_id] = max(self._chats.get(chat_id, 0.0), now + delay + bucket.tolerance)
+
+    def _reserve_chat(self, chat_id: Union[int, str], now: float) -> float:
+        """Take the chat's next token and return how long until it is due."""
+        if len(self._chats) > self._prune_at:
+            # A chat whose bucket is full again is the same as one never seen
+            self._chats = {chat: next_free for chat, next_free in self._chats.items() if next_free > now}
+            self._prune_at = max(1024, 2 * len(self._chats))
+        bucket = self._bucket(chat_id)
+        bucket.next_free = self._chats.get(chat_id, 0.0)
+        delay = bucket.delay(now)
+        bucket.take(now)
+        self._chats[chat_id] = bucket.next_free
+        return delay
+
+    async def _acquire(self, chat_id: Union[int, str], priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        delay = self._reserve_chat(chat_id, started)
+        if not delay and not any(self._waiting) and not self._overall.delay(started):
+            self._overall.take(started)
+            self._waits[priority].observe(0.0)
+            return
+
+        self._queued[priority].inc()
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            waiter = loop.create_future()
+            self._waiting[priority].append(waiter)
+            if self._dispatcher is None:
+                self._dispatcher = asyncio.create_task(self._dispatch())
+            await waiter
+        finally:
+            self._queued[priority].dec()
+        self._waits[priority].observe(loop.time() - started)
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while any(self._waiting):
+                # Pick the waiter only once a token is due, so that an
+                # interactive request arriving meanwhile still goes first
+                delay = self._overall.delay(loop.time())
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+                waiter = self._pop_waiter()
+                if waiter is None:
+                    return
+                self._overall.take(loop.time())
+                waiter.set_result(None)
+        finally:
+            self._dispatcher = None
+
+    def _pop_waiter(self) -> Optional[asyncio.Future]:
+        for waiting in self._waiting:
+            while waiting:
+                waiter = waiting.popleft()
+                if not waiter.done():
+                    return waiter
+        return None
@@ -0,0 +1,251 @@
+"""Shared send path for precompiled pages.
+
+Callback taps need two Bot API calls: answerCallbackQuery to stop the client's
+spinner and editMessageText to show the next page. They do not depend on each
+other, so :meth:`Replies.send_page` starts both at once and the tap costs one
+round trip instead of two.
+
+Telegram rejects an edit that would not change the message, so an
+:class:`EditCache` remembers a fingerprint of what each recent message shows
+and identical edits (a double tap, the menu button on the menu) are skipped
+before they reach the network.
+
+Edits go through an :class:`EditCoalescer`, which keeps at most one edit per
+message in flight. Pages requested meanwhile, say by a learner tapping "Next"
+several times a second, only replace the one waiting behind it, so a burst of
+taps costs about two edits and the message ends on the latest page. Answers
+and edits are sent in the background, so a handler does not hold up the
+learner's next tap; :meth:`Replies.drain` waits for them on shutdown. Their
+failures go to the application's error handlers, as a handler's would.
+
+Message ids are only unique within a bot's chats, so each application has a
+:class:`Replies` of its own, kept in ``bot_data``; see :meth:`Replies.of`.
+"""
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple, Union
+
+from telegram import InlineKeyboardMarkup, Update
+from telegram.error import BadRequest
+from telegram.ext import Application, CallbackContext
+
+from circuitbreaker import CircuitOpenError
+from metrics import Counter
+from pages import Page
+
+logger = logging.getLogger(__name__)
+
+_BOT_DATA_KEY = 'replies'
+
+MESSAGE_EDITS = Counter('bot_message_edits',
+                        "Message edits by result: 'sent', 'failed', 'skipped' as they would not have changed the "
+                        "message, 'coalesced' into a later edit of the same message, or 'held' back while the Bot "
+                        "API was down.", ('result',))
+
+
+class EditCache:
+    """Fingerprints of the text and keyboard each message shows, keyed by chat and message id.
+
+    Holds at most ``maxsize`` messages and evicts the least recently edited.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._fingerprints: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._skipped = MESSAGE_EDITS.labels('skipped')
+
+    @staticmethod
+    def fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> int:
+        return hash((text, reply_markup))
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def shows(self, key: Tuple[int, int], fingerprint: int) -> bool:
+        """Whether the message shows, or is about to show, this content."""
+        if self._fingerprints.get(key) == fingerprint:
+            self._fingerprints.move_to_end(key)
+            self._skipped.inc()
+            return True
+        return False
+
+    def remember(self, key: Tuple[int, int], fingerprint: int) -> None:
+        self._fingerprints[key] = fingerprint
+        self._fingerprints.move_to_end(key)
+        if len(self._fingerprints) > self.maxsize:
+            self._fingerprints.popitem(last=False)
+
+    def forget(self, key: Tuple[int, int]) -> None:
+        self._fingerprints.pop(key, None)
+
+
+class Edit(NamedTuple):
+    fingerprint: int
+    send: Callable[[], Awaitable[object]]
+    update: Update
+
+
+class EditCoalescer:
+    """Send one edit per message at a time; of the edits waiting, only the newest.
+
+    :meth:`submit` returns at once. The edit is sent by a task that, when done,
+    sends the edit submitted last for the same message in the meantime, if any.
+    Failed edits are passed to ``on_error`` and the message is dropped from
+    ``cache``. While the circuit breaker fails calls fast, the task keeps the
+    newest edit and tries again once the breaker lets calls through, so an
+    outage costs one task and one edit per message.
+    """
+
+    def __init__(self, cache: EditCache, spawn: Callable[[Awaitable[None]], asyncio.Task],
+                 on_error: Callable[[Update, Exception], Awaitable[None]]):
+        self.cache = cache
+        self._spawn = spawn
+        self._on_error = on_error
+        # A message is present while one of its edits is in flight; the value is
+        # the edit waiting behind it
+        self._waiting: Dict[Tuple[int, int], Optional[Edit]] = {}
+        self._sent = MESSAGE_EDITS.labels('sent')
+        self._failed = MESSAGE_EDITS.labels('failed')
+        self._coalesced = MESSAGE_EDITS.labels('coalesced')
+        self._held = MESSAGE_EDITS.labels('held')
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._waiting)
+
+    def submit(self, key: Tuple[int, int], edit: Edit) -> None:
+        if key in self._waiting:
+            if self._waiting[key] is not None:
+                self._coalesced.inc()
+            self._waiting[key] = edit
+            return
+        self._waiting[key] = None
+        self._spawn(self._send(key, edit))
+
+    async def _send(self, key: Tuple[int, int], edit: Optional[Edit]) -> None:
+        shown = None
+        try:
+            while edit is not None:
+                # A page tapped away from and back to while the edit was in flight
+                if edit.fingerprint != shown:
+                    shown = await self._send_one(key, edit)
+                else:
+                    self._coalesced.inc()
+                edit, self._waiting[key] = self._waiting[key], None
+        finally:
+            del self._waiting[key]
+
+    async def _send_one(self, key: Tuple[int, int], edit: Edit) -> Optional[int]:
+        try:
+            await edit.send()
+        except CircuitOpenError as exc:
+            self._held.inc()
+            if self._waiting[key] is None:
+                self._waiting[key] = edit
+            else:
+                self._coalesced.inc()
+            # Jittered, so held edits do not all arrive together when the API is back
+            await asyncio.sleep(exc.retry_in + random.uniform(0, exc.retry_in))
+            return None
+        except Exception as exc:
+            if isinstance(exc, BadRequest) and 'not modified' in exc.message:
+                # The message showed this page before the cache knew about it
+                self._sent.inc()
+                return edit.fingerprint
+            self._failed.inc()
+            self.cache.forget(key)
+            await self._on_error(edit.update, exc)
+            return None
+        self._sent.inc()
+        return edit.fingerprint
+
+
+class Replies:
+    """The replies of one application: the edits its messages show and the
+    answers and edits it is sending in the background.
+
+    Args:
+        cache_size: How many messages :attr:`cache` remembers.
+    """
+
+    def __init__(self, cache_size: int = 100_000):
+        self.cache = EditCache(cache_size)
+        self.edits = EditCoalescer(self.cache, self._spawn, self._report)
+        self._background: Set[asyncio.Task] = set()
+        self._application: Optional[Application] = None
+
+    def install(self, application: Application) -> None:
+        """Serve ``application``'s handlers and report failures to its error handlers."""
+        application.bot_data[_BOT_DATA_KEY] = self
+        self._application = application
+
+    @staticmethod
+    def of(holder: Union[Application, CallbackContext]) -> "Replies":
+        """The replies of an application, or of the one handling a callback context's update."""
+        return holder.bot_data[_BOT_DATA_KEY]
+
+    def _spawn(self, coroutine: Awaitable[None]) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _report(self, update: Update, error: Exception) -> None:
+        if self._application is not None:
+            await self._application.process_error(update, error)
+        else:
+            logger.error("Sending a reply to update %s failed: %s", update.update_id, error)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Wait until every answer and edit started so far has been sent.
+
+        After ``timeout`` seconds, e.g. while edits are held back because the
+        Bot API is down, the rest are cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self._background:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                for task in self._background:
+                    task.cancel()
+                logger.warning("Gave up on %d answers and edits not sent in %.0f s", len(self._background), timeout)
+                await asyncio.gather(*self._background, return_exceptions=True)
+                return
+            await asyncio.wait(self._background, timeout=remaining)
+
+    async def send_page(self, update: Update, page: Page, answer_text: Optional[str] = None,
+                        header: Optional[str] = None) -> None:
+        """Show ``page`` in reply to a command, or in place of the tapped message.
+
+        For callback queries the edit is handed to :attr:`edits` and the query
+        is answered (with ``answer_text`` as the notification, if given) in the
+        background, since nothing the handler does next depends on them.
+        """
+        text, reply_markup = page
+        if header:
+            text = f"{header}\n\n{text}"
+
+        fingerprint = EditCache.fingerprint(text, reply_markup)
+        if update.message:
+            sent = await update.message.reply_text(text, reply_markup=reply_markup)
+            self.cache.remember((sent.chat_id, sent.message_id), fingerprint)
+            return
+
+        query = update.callback_query
+        key = (query.message.chat.id, query.message.message_id)
+        if not self.cache.shows(key, fingerprint):
+            # Remembered before the edit goes out, so a second identical tap arriving
+            # meanwhile is skipped too
+            self.cache.remember(key, fingerprint)
+            edit = Edit(fingerprint, lambda: query.message.edit_text(text, reply_markup=reply_markup), update)
+            self.edits.submit(key, edit)
+        self._spawn(self._answer(update, answer_text))
+
+    async def _answer(self, update: Update, answer_text: Optional[str]) -> None:
+        try:
+            await update.callback_query.answer(answer_text)
+        except Exception as exc:
+            await self._report(update, exc)
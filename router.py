@@ -0,0 +1,64 @@
+"""Table-driven routing of button presses for the lesson conversation.
+
+Each conversation state has a dict from action code (see ``pages``) to the
+handler for it, so dispatching a tap is one decode and one dict lookup
+whatever the number of buttons. Taps whose action has no route in the current
+state, typically a button on an old message, are handed to an ``unrouted``
+handler that answers them at once instead of leaving the client's spinner
+running until Telegram gives up.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Mapping
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from metrics import Counter
+from pages import ACTION_NAMES, decode_callback_data
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_QUERIES = Counter('bot_callback_queries',
+                           "Button presses by action; 'unrouted' ones did not fit the conversation state.", ('type',))
+
+ActionHandler = Callable[[Update, CallbackContext, str], Awaitable[Any]]
+UnroutedHandler = Callable[[Update, CallbackContext, Any], Awaitable[Any]]
+
+
+class CallbackRouter:
+    """Dispatch callback queries through a per-state table of action handlers.
+
+    Args:
+        routes: For each conversation state, the handler of each action code.
+            Handlers are called with the update, the context and the argument
+            part of the callback data, and return the next state.
+        unrouted: Called with the update, the context and the current state for
+            taps that have no route in that state; returns the next state.
+    """
+
+    def __init__(self, routes: Mapping[Any, Mapping[str, ActionHandler]], unrouted: UnroutedHandler):
+        self.routes = routes
+        self.unrouted = unrouted
+        self._counters = {action: CALLBACK_QUERIES.labels(name) for action, name in ACTION_NAMES.items()}
+        self._unrouted_counter = CALLBACK_QUERIES.labels('unrouted')
+
+    def for_state(self, state: Any) -> Callable[[Update, CallbackContext], Awaitable[Any]]:
+        """The callback for a ``CallbackQueryHandler`` in ``state``."""
+        table = dict(self.routes[state])
+        counters = self._counters
+
+        async def dispatch(update: Update, context: CallbackContext) -> Any:
+            data = update.callback_query.data
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("User %s pressed button: %s", update.effective_user.id, data,
+                            extra={'event': 'button_press', 'user_id': update.effective_user.id, 'data': data})
+            action, argument = decode_callback_data(data)
+            handler = table.get(action)
+            if handler is None:
+                self._unrouted_counter.inc()
+                return await self.unrouted(update, context, state)
+            counters[action].inc()
+            return await handler(update, context, argument)
+
+        dispatch.__name__ = dispatch.__qualname__ = f'dispatch_{state}'
+        return dispatch
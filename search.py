@@ -0,0 +1,357 @@
+"""Full-text search over lesson pages with an inverted index and BM25 ranking.
+
+Every compiled lesson page is a document. :class:`TopicIndex` tokenizes a
+topic's pages once, when the content is compiled: words are lowercased,
+common English words dropped and the rest reduced to a stem by
+:func:`stem`, so "modules" finds "module" and "staking" finds "stake". A
+:class:`SearchIndex` puts the topic indexes of one content version together
+and ranks pages with BM25 (Robertson, Walker et al., TREC-3).
+
+Topic indexes are immutable and shared between versions like the compiled
+pages are, so a reload indexes only the topics it recompiled, and
+:class:`SearchIndex` updates only the terms those topics use.
+
+Search happens on the event loop, so it must stay well under a millisecond
+with thousands of pages; see benchmarks/bench_search.py. Queries of only
+words found on a large part of the pages cost more, as proving which pages
+are best takes scoring every page they occur on.
+"""
+import bisect
+import functools
+import heapq
+import math
+import re
+from array import array
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+# BM25 parameters: term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+# Query terms beyond this are ignored
+MAX_QUERY_TERMS = 10
+# How far the average page length may move before a reload computes every weight again
+AVERAGE_LENGTH_DRIFT = 0.1
+# Pages of highest weight kept in order per term
+MAX_LIST_DEPTH = 512
+# Entries of those lists one query reads, shared between its terms
+QUERY_BUDGET = 768
+# Pages of those read that a query scores by all its terms before it scores every page instead
+RESCORED = 32
+# Slack for scores summed in a different order, so pages tied with the best are not lost
+_ROUNDING = 1e-9
+
+_WORD = re.compile(r'\w+')
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can could do does for from has have how if in into is it
+its may more most no not of on one or other our so some such than that the their them then there these they this to
+up us was we were what when where which while who will with would you your
+""".split())
+# Tried in order, the first that leaves a stem of at least three letters is removed
+_SUFFIXES = (
+    ('ations', ''), ('ation', ''), ('ments', ''), ('ment', ''), ('ness', ''), ('ings', ''), ('ing', ''),
+    ('edly', ''), ('ed', ''), ('ies', 'y'), ('ly', ''), ('s', ''),
+)
+_VERB_SUFFIXES = frozenset(('ings', 'ing', 'edly', 'ed'))
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """A light suffix-stripping stem of a lowercase word.
+
+    Not a linguistic stem, only one that words of the same family share:
+    "modules" and "module" both stem to "modul", "staking" and "stake" to "stak".
+    """
+    for suffix, replacement in _SUFFIXES:
+        if not word.endswith(suffix) or len(word) - len(suffix) < 3:
+            continue
+        # "address", "status" and "analysis" are not plurals
+        if suffix == 's' and word[-2] in 'siu':
+            continue
+        word = word[:-len(suffix)] + replacement
+        if suffix in _VERB_SUFFIXES and word[-1] == word[-2] and word[-1] not in 'lsz':
+            word = word[:-1]
+        break
+    if len(word) >= 3 and word.endswith('e'):
+        word = word[:-1]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    """The stemmed terms of ``text``, in order, without stopwords."""
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class SearchResult(NamedTuple):
+    score: float
+    topic_id: int
+    page: int
+
+
+class TopicIndex:
+    """The postings of one topic's lesson pages.
+
+    Args:
+        texts: The topic's lesson pages, in page order.
+    """
+
+    __slots__ = ('postings', 'lengths', 'length', '_norms')
+
+    def __init__(self, texts: Iterable[str]):
+        postings: Dict[str, List[int]] = {}
+        lengths = []
+        for page, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for term in terms(text):
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, []).extend((page, count))
+            lengths.append(sum(counts.values()))
+        # Every page the term occurs on and how often, in one flat tuple:
+        # page, count, page, count...
+        self.postings: Mapping[str, Tuple[int, ...]] = MappingProxyType(
+            {term: tuple(pages) for term, pages in postings.items()})
+        self.lengths = tuple(lengths)
+        self.length = sum(lengths)
+        self._norms: Tuple[float, Tuple[float, ...]] = (0.0, ())
+
+    def norms(self, average_length: float) -> Tuple[float, ...]:
+        """The length normalization of every page, for the collection's average page length."""
+        cached_for, norms = self._norms
+        if cached_for != average_length:
+            norms = tuple(K1 * (1 - B + B * length / average_length) for length in self.lengths)
+            # One assignment, as the index of another version may share this topic
+            self._norms = (average_length, norms)
+        return norms
+
+
+class TermList(NamedTuple):
+    """The pages a term occurs on, as page keys (``topic id << 16 | page``).
+
+    ``keys`` are in ascending order, with the BM25 term frequency weight of
+    each page in ``weights``; ``best_keys`` and ``best_weights`` repeat the
+    :data:`MAX_LIST_DEPTH` pages of highest weight, best first, ties in key
+    order. Arrays in memory, or views of a mapped content store.
+    """
+    keys: Sequence[int]
+    weights: Sequence[float]
+    best_keys: Sequence[int]
+    best_weights: Sequence[float]
+
+
+class SearchIndex:
+    """The lesson pages of one content version, searchable by :meth:`search`.
+
+    Every term has a :class:`TermList`, built with the index, so no search
+    builds anything. A query reads no more than its terms' best pages, see
+    :func:`rank`, so a word found on most pages costs no more than a rare one.
+
+    Page lengths are normalized by the average page length of the version
+    the weights were computed for; a reload keeps it unless the average moved
+    by more than :data:`AVERAGE_LENGTH_DRIFT`, so the weights of the pages of
+    unchanged topics stay valid, and a reload only replaces the pages of the
+    recompiled topics in the lists of the terms they use.
+
+    Args:
+        topics: The index of every topic, by topic id.
+        titles: The menu title of every topic, by topic id.
+        previous: The index of the version before, updated for the topics
+            that changed instead of built again.
+    """
+
+    __slots__ = ('topics', 'titles', 'pages', 'average_length', 'lists')
+
+    def __init__(self, topics: Sequence[TopicIndex], titles: Sequence[str], previous: Optional["SearchIndex"] = None):
+        self.topics = tuple(topics)
+        self.titles = tuple(titles)
+        self.pages = sum(len(topic.lengths) for topic in self.topics)
+        average_length = sum(topic.length for topic in self.topics) / self.pages if self.pages else 1.0
+        keep_average = (previous is not None and
+                        abs(average_length - previous.average_length) <= previous.average_length * AVERAGE_LENGTH_DRIFT)
+        self.average_length = previous.average_length if keep_average else average_length or 1.0
+        self.lists: Dict[str, TermList] = {}
+        if not keep_average:
+            self._build()
+            return
+
+        old, new = previous.topics, self.topics
+        changed = [topic_id for topic_id in range(max(len(old), len(new)))
+                   if topic_id >= len(old) or topic_id >= len(new) or old[topic_id] is not new[topic_id]]
+        touched: Set[str] = set()
+        for topic_id in changed:
+            touched.update(self._postings(previous, topic_id))
+            touched.update(self._postings(self, topic_id))
+        self.lists = dict(previous.lists)
+        for term in touched:
+            self._update(term, changed)
+
+    @staticmethod
+    def _postings(index: "SearchIndex", topic_id: int) -> Mapping[str, Tuple[int, ...]]:
+        return index.topics[topic_id].postings if topic_id < len(index.topics) else MappingProxyType({})
+
+    def _build(self) -> None:
+        columns: Dict[str, Tuple[array, array]] = {}
+        for topic_id in range(len(self.topics)):
+            for term in self.topics[topic_id].postings:
+                keys, weights = columns.get(term) or columns.setdefault(term, (array('q'), array('d')))
+                for weight, key in self._weights(term, topic_id):
+                    keys.append(key)
+                    weights.append(weight)
+        self.lists = {term: _term_list(keys, weights) for term, (keys, weights) in columns.items()}
+
+    def _update(self, term: str, changed: Sequence[int]) -> None:
+        """Replace the changed topics' pages in a term's list, which keeps the weights of the others."""
+        previous = self.lists.get(term)
+        keys, weights = (array('q', previous.keys), array('d', previous.weights)) if previous else (array('q'), array('d'))
+        added: List[Tuple[float, int]] = []
+        removed = False
+        for topic_id in changed:
+            # A topic's pages are next to each other in key order
+            start = bisect.bisect_left(keys, topic_id << 16)
+            end = bisect.bisect_left(keys, (topic_id + 1) << 16, start)
+            new = list(self._weights(term, topic_id))
+            removed = removed or end > start
+            keys[start:end] = array('q', [key for _, key in new])
+            weights[start:end] = array('d', [weight for weight, _ in new])
+            added.extend(new)
+        if not keys:
+            del self.lists[term]
+        elif previous is None or len(previous.best_keys) < MAX_LIST_DEPTH or removed and any(
+                key >> 16 in changed for key in previous.best_keys):
+            self.lists[term] = _term_list(keys, weights)
+        else:
+            # None of the best pages went, so the best of the new list are among them and the added pages
+            best = sorted([*zip(previous.best_weights, previous.best_keys), *added], key=_best_first)[:MAX_LIST_DEPTH]
+            self.lists[term] = TermList(keys, weights, array('q', [key for _, key in best]),
+                                        array('d', [weight for weight, _ in best]))
+
+    def _weights(self, term: str, topic_id: int) -> Iterator[Tuple[float, int]]:
+        """The BM25 term frequency weight and page key of every page of the topic the term occurs on."""
+        pages = self._postings(self, topic_id).get(term, ())
+        if pages:
+            norms = self.topics[topic_id].norms(self.average_length)
+            base = topic_id << 16
+            for page, count in zip(pages[::2], pages[1::2]):
+                yield count * (K1 + 1) / (count + norms[page]), base | page
+
+    def search(self, query: str, limit: int = 5) -> List[SearchResult]:
+        """The ``limit`` pages that best match ``query``, best first."""
+        return rank(self.pages, [self.lists.get(term) for term in query_terms(query)], limit)
+
+
+def _best_first(entry: Tuple[float, int]) -> Tuple[float, int]:
+    return -entry[0], entry[1]
+
+
+def _term_list(keys: array, weights: array) -> TermList:
+    # Stable, so ties stay in key order
+    best = heapq.nlargest(MAX_LIST_DEPTH, range(len(keys)), key=weights.__getitem__)
+    return TermList(keys, weights, array('q', [keys[i] for i in best]), array('d', [weights[i] for i in best]))
+
+
+def query_terms(query: str) -> List[str]:
+    """The distinct terms of a query, at most :data:`MAX_QUERY_TERMS`."""
+    return list(dict.fromkeys(terms(query[:1000])[:MAX_QUERY_TERMS]))
+
+
+def rank(pages: int, lists: Sequence[Optional[TermList]], limit: int) -> List[SearchResult]:
+    """The ``limit`` pages of ``pages`` that best match the query terms with ``lists``, best first.
+
+    A term without a list (``None``) occurs on no page. The query reads
+    :data:`QUERY_BUDGET` entries of the terms' best pages, which bounds what
+    each page could score: a page scores no more in a list than the last
+    weight read from it, unless it was read there. It then scores the pages
+    of highest bound by all the terms until no page left could score more
+    than those found. If that takes more than :data:`RESCORED` pages, every
+    page the terms occur on is scored instead, so the result is always exact
+    BM25.
+    """
+    entries = []
+    for term_list in lists:
+        if term_list is not None:
+            matches = len(term_list.keys)
+            idf = math.log(1 + (pages - matches + 0.5) / (matches + 0.5))
+            entries.append((idf, term_list))
+    if not entries:
+        return []
+    depth = max(limit, QUERY_BUDGET // len(entries))
+    # The most a page could score is the last weight read from each list, plus
+    # what the page scores over that in the lists it was read in
+    unread = 0.0
+    over: Dict[int, float] = {}
+    for idf, term_list in entries:
+        read = min(depth, len(term_list.best_keys))
+        last = idf * term_list.best_weights[read - 1] if read < len(term_list.keys) else 0.0
+        unread += last
+        get = over.get
+        for key, weight in zip(term_list.best_keys[:read], term_list.best_weights[:read]):
+            over[key] = get(key, 0.0) + idf * weight - last
+    if not unread:
+        return _best(over, limit)
+    # Scores with the negated page key, so ties go to the earlier topic and page
+    best: List[Tuple[float, int]] = []
+    candidates = heapq.nlargest(RESCORED + 1, over, key=over.__getitem__)
+    for key in candidates[:RESCORED]:
+        # Strictly, as a page left with the same score may come first
+        if len(best) >= limit and best[0][0] - _ROUNDING > over[key] + unread:
+            break
+        score = _score(entries, key)
+        if len(best) < limit:
+            heapq.heappush(best, (score, -key))
+        elif (score, -key) > best[0]:
+            heapq.heapreplace(best, (score, -key))
+    else:
+        left = over[candidates[RESCORED]] + unread if len(candidates) > RESCORED else unread
+        if len(best) < limit or best[0][0] - _ROUNDING <= left:
+            scores: Dict[int, float] = {}
+            for idf, term_list in entries:
+                get = scores.get
+                for key, weight in zip(term_list.keys, term_list.weights):
+                    scores[key] = get(key, 0.0) + idf * weight
+            return _best(scores, limit)
+    return [SearchResult(score, -key >> 16, -key & 0xFFFF) for score, key in sorted(best, reverse=True)]
+
+
+def _score(entries: Sequence[Tuple[float, TermList]], key: int) -> float:
+    """The score of a page in the lists of ``entries``."""
+    score = 0.0
+    for idf, term_list in entries:
+        keys = term_list.keys
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            score += idf * term_list.weights[index]
+    return score
+
+
+def _best(scores: Dict[int, float], limit: int) -> List[SearchResult]:
+    """The ``limit`` pages of highest score, ties in key order."""
+    if len(scores) > limit:
+        lowest = heapq.nlargest(limit, scores.values())[-1]
+        scores = {key: score for key, score in scores.items() if score >= lowest}
+    best = sorted(scores.items(), key=_best_first_item)[:limit]
+    return [SearchResult(score, key >> 16, key & 0xFFFF) for key, score in best]
+
+
+def _best_first_item(item: Tuple[int, float]) -> Tuple[float, int]:
+    return -item[1], item[0]
+
+
+def snippet(text: str, query: str, width: int = 100) -> str:
+    """About ``width`` characters of ``text`` around the first word matching ``query``."""
+    wanted = set(terms(query[:1000]))
+    start = 0
+    for match in _WORD.finditer(text):
+        word = match.group().lower()
+        if word not in STOPWORDS and stem(word) in wanted:
+            start = max(0, match.start() - width // 3)
+            break
+    if start:
+        # Start at a word
+        space = text.find(' ', start)
+        start = space + 1 if 0 <= space < match.start() else start
+    end = start + width
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    part = ' '.join(text[start:end].split())
+    return ('…' if start else '') + part + ('…' if end < len(text) else '')
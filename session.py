@@ -0,0 +1,87 @@
+"""Compact per-learner session state.
+
+Every learner who opens a lesson carries one :class:`Session` as their
+``context.user_data``. It keeps the four progress fields in slots instead of a
+dict, names the topic by its id in the page table, and packs into nine bytes
+for persistence. It also holds the content snapshot the learner's topic is
+served from (see content.py), which is not persisted: after a restart only the
+current content exists.
+"""
+import logging
+import struct
+from typing import Any, Dict, Optional
+
+from telegram.ext import CallbackContext, ContextTypes, ExtBot
+
+logger = logging.getLogger(__name__)
+
+# Format version, topic id (0xFFFF for none), lesson index, quiz index, score
+_PACKED = struct.Struct('<BHhhh')
+_VERSION = 1
+_NO_TOPIC = 0xFFFF
+
+
+class Session:
+    __slots__ = ('topic', 'lesson_index', 'quiz_index', 'score', 'snapshot')
+
+    def __init__(self, topic: Optional[int] = None, lesson_index: int = 0, quiz_index: int = 0, score: int = 0,
+                 snapshot: Any = None):
+        self.topic = topic
+        self.lesson_index = lesson_index
+        self.quiz_index = quiz_index
+        self.score = score
+        self.snapshot = snapshot
+
+    def start(self, topic: int, snapshot: Any = None) -> None:
+        """Begin ``topic`` from its first page, in the content ``snapshot``."""
+        self.topic = topic
+        self.snapshot = snapshot
+        self.lesson_index = 0
+        self.quiz_index = 0
+        self.score = 0
+
+    def move_to(self, topic: int, lesson_index: int, quiz_index: int = 0, score: int = 0) -> None:
+        """Record the position a button press took the learner to."""
+        self.topic = topic
+        self.lesson_index = lesson_index
+        self.quiz_index = quiz_index
+        self.score = score
+
+    def update(self, other: "Session") -> None:
+        """Copy ``other`` into this session, like ``dict.update`` does for dicts."""
+        self.topic = other.topic
+        self.lesson_index = other.lesson_index
+        self.quiz_index = other.quiz_index
+        self.score = other.score
+        self.snapshot = other.snapshot
+
+    def to_bytes(self) -> bytes:
+        topic = _NO_TOPIC if self.topic is None else self.topic
+        return _PACKED.pack(_VERSION, topic, self.lesson_index, self.quiz_index, self.score)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Session":
+        if len(data) != _PACKED.size or data[0] != _VERSION:
+            logger.warning("Discarding session stored in an unknown format")
+            return cls()
+        _, topic, lesson_index, quiz_index, score = _PACKED.unpack(data)
+        return cls(None if topic == _NO_TOPIC else topic, lesson_index, quiz_index, score)
+
+    def __copy__(self) -> "Session":
+        return Session(self.topic, self.lesson_index, self.quiz_index, self.score, self.snapshot)
+
+    def __deepcopy__(self, memo: dict) -> "Session":
+        return self.__copy__()
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Session):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    def __repr__(self) -> str:
+        return (f"Session(topic={self.topic}, lesson_index={self.lesson_index}, "
+                f"quiz_index={self.quiz_index}, score={self.score})")
+
+
+SessionContext = CallbackContext[ExtBot, Session, Dict, Dict]
+CONTEXT_TYPES = ContextTypes(user_data=Session)
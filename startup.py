@@ -0,0 +1,54 @@
+"""Startup profiling: where the time until the bot polls for updates goes.
+
+With ``STARTUP_PROFILE=1`` the bot starts up as usual, records each phase in a
+:class:`StartupProfile` up to the first getUpdates call, prints the phases and
+a per-package breakdown of import time, and exits.
+"""
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+
+class StartupProfile:
+    """Durations of consecutive startup phases, from ``started`` on."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: List[Tuple[str, float]] = []
+        self._last = started
+
+    def mark(self, phase: str) -> None:
+        """Record that ``phase`` ended now, having begun when the previous one ended."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        lines = [f"  {phase:<36} {seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        lines.append(f"  {'total':<36} {(self._last - self.started) * 1000:8.1f} ms")
+        return '\n'.join(lines)
+
+
+def import_breakdown(module: str, limit: int = 12) -> List[Tuple[str, float]]:
+    """Seconds spent importing ``module`` per top-level package, slowest first.
+
+    Imports ``module`` in a fresh interpreter with ``-X importtime``, so the
+    numbers are those of a cold start whatever this process has loaded.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    packages: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, self_us, _ = line[len('import time:'):].split('|')
+        name = line.rsplit('|', 1)[1].strip()
+        package = name.split('.')[0]
+        # Self times summed per package, so nested imports are not counted twice
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def format_import_breakdown(breakdown: List[Tuple[str, float]]) -> str:
+    return '\n'.join(f"  {package:<36} {seconds * 1000:8.1f} ms" for package, seconds in breakdown)
@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+
+TOPICS = {
+    'intro': {
+        'lesson': ["Aptos is a Layer 1 blockchain.", "Move is its smart contract language.",
+                   "Validators run the AptosBFT consensus."],
+        'quiz': [{'question': "What is Move?", 'options': ["A language", "A wallet"], 'correct': 0}],
+    },
+    'staking': {
+        'lesson': ["Staking secures the network.", "Delegators stake through pools."],
+        'quiz': [{'question': "What does staking secure?", 'options': ["The network", "Nothing"], 'correct': 0}],
+    },
+    'modules': {
+        'lesson': ["Modules are published under an account.", "A module declares structs and functions."],
+        'quiz': [],
+    },
+}
+
+
+class Course:
+    """A content directory of small packs that tests can change."""
+
+    topics = TOPICS
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._revision = 0
+        self.write_index(list(TOPICS))
+        for name, pack in TOPICS.items():
+            self.write_topic(name, **pack)
+
+    def _write(self, name: str, pack: dict) -> None:
+        path = os.path.join(self.directory, f'{name}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'version': 1, **pack}, file)
+        # Writes in quick succession can get the same modification time
+        self._revision += 1
+        os.utime(path, ns=(self._revision * 10 ** 9, self._revision * 10 ** 9))
+
+    def write_index(self, names: list) -> None:
+        self._write('index', {'menu_text': "Choose a topic:",
+                              'topics': [{'name': name, 'title': name.title()} for name in names]})
+
+    def write_topic(self, name: str, lesson: list, quiz: list = ()) -> None:
+        self._write(name, {'lesson': lesson, 'quiz': list(quiz)})
+
+    def write_raw(self, name: str, text: str) -> None:
+        path = os.path.join(self.directory, f'{name}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        self._revision += 1
+        os.utime(path, ns=(self._revision * 10 ** 9, self._revision * 10 ** 9))
+
+
+@pytest.fixture
+def course(tmp_path) -> Course:
+    return Course(str(tmp_path))
@@ -0,0 +1,191 @@
+"""CircuitBreaker states and InstrumentedRequest's retries around it."""
+import asyncio
+import json
+
+import httpx
+import pytest
+from telegram.error import NetworkError, TimedOut
+
+import apirequest
+import circuitbreaker
+from apirequest import API_CALLS_REJECTED, API_RETRIES, InstrumentedRequest
+from circuitbreaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+URL = 'https://api.telegram.org/bot123456:fake-token/'
+OK = json.dumps({'ok': True, 'result': True}).encode()
+
+
+class Clock:
+    """Stands in for the ``time`` module, moved on by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(circuitbreaker, 'time', clock)
+    return clock
+
+
+class Server:
+    """Answers Bot API calls with the outcomes queued for them, then with 200."""
+
+    def __init__(self):
+        self.outcomes = []
+        self.calls = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request.url.path.rsplit('/', 1)[-1])
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, content=OK)
+
+
+async def call(request: InstrumentedRequest, method: str) -> int:
+    status, _ = await request.do_request(URL + method, 'POST')
+    return status
+
+
+def requests(server: Server, breaker: CircuitBreaker = None, max_retries: int = 2) -> InstrumentedRequest:
+    return InstrumentedRequest(breaker=breaker, max_retries=max_retries,
+                               httpx_kwargs={'transport': httpx.MockTransport(server.handle)})
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(apirequest, 'backoff', lambda attempt: 0.0)
+
+
+def test_breaker_opens_after_the_threshold_and_closes_after_a_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.retry_in() is None
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_in() == pytest.approx(10)
+    clock.now += 4
+    assert breaker.retry_in() == pytest.approx(6)
+    clock.now += 6
+    # One probe is let through, other calls wait for it
+    assert breaker.retry_in() is None
+    assert breaker.state == HALF_OPEN
+    assert breaker.retry_in() == pytest.approx(1)
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.retry_in() is None
+    # Counting starts again from nothing
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.retry_in() is None
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_in() == pytest.approx(10)
+
+
+def test_probe_that_never_reports_back_is_replaced_after_the_reset_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.retry_in() is None
+    clock.now += 10
+    assert breaker.retry_in() == pytest.approx(1)
+    clock.now += 0.5
+    assert breaker.retry_in() is None
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(ValueError):
+        CircuitBreaker(failure_threshold=0)
+
+
+def test_idempotent_call_is_retried_on_5xx_and_network_errors():
+    server = Server()
+    server.outcomes = [502, httpx.ConnectError("connection refused")]
+    before = API_RETRIES.labels('getMe').value
+
+    async def run():
+        async with requests(server) as request:
+            return await call(request, 'getMe')
+
+    assert asyncio.run(run()) == 200
+    assert server.calls == ['getMe'] * 3
+    assert API_RETRIES.labels('getMe').value == before + 2
+
+
+def test_idempotent_call_gives_up_after_max_retries():
+    server = Server()
+    server.outcomes = [503] * 3 + [httpx.ConnectError("connection refused")] * 3
+
+    async def run():
+        async with requests(server) as request:
+            assert await call(request, 'getChat') == 503
+            with pytest.raises(NetworkError):
+                await call(request, 'getChat')
+
+    asyncio.run(run())
+    assert server.calls == ['getChat'] * 6
+
+
+def test_send_message_is_never_retried():
+    server = Server()
+    server.outcomes = [500, httpx.ReadError("connection reset")]
+
+    async def run():
+        async with requests(server) as request:
+            assert await call(request, 'sendMessage') == 500
+            with pytest.raises(NetworkError):
+                await call(request, 'sendMessage')
+
+    asyncio.run(run())
+    assert server.calls == ['sendMessage'] * 2
+
+
+def test_pool_timeout_is_neither_retried_nor_counted_against_the_breaker():
+    server = Server()
+    server.outcomes = [httpx.PoolTimeout("no free connection")]
+    breaker = CircuitBreaker(failure_threshold=1)
+
+    async def run():
+        async with requests(server, breaker) as request:
+            with pytest.raises(TimedOut) as raised:
+                await call(request, 'getMe')
+            assert isinstance(raised.value.__cause__, httpx.PoolTimeout)
+
+    asyncio.run(run())
+    assert server.calls == ['getMe']
+    assert breaker.state == CLOSED
+
+
+def test_calls_fail_fast_while_the_breaker_is_open(clock):
+    server = Server()
+    server.outcomes = [500, 500]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    before = API_CALLS_REJECTED.labels('sendMessage').value
+
+    async def run():
+        async with requests(server, breaker) as request:
+            # The retry is refused: the failures so far opened the breaker
+            with pytest.raises(CircuitOpenError) as raised:
+                await call(request, 'getMe')
+            assert raised.value.retry_in == pytest.approx(10)
+            with pytest.raises(CircuitOpenError):
+                await call(request, 'sendMessage')
+            clock.now += 10
+            # The probe succeeds and the breaker closes
+            assert await call(request, 'sendMessage') == 200
+            assert breaker.state == CLOSED
+
+    asyncio.run(run())
+    assert server.calls == ['getMe', 'getMe', 'sendMessage']
+    assert API_CALLS_REJECTED.labels('sendMessage').value == before + 1
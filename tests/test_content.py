@@ -0,0 +1,78 @@
+"""ContentLibrary: loading packs, and reloading only what changed."""
+import pytest
+
+from content import ContentError, ContentLibrary
+
+
+def test_loads_every_topic_in_index_order(course):
+    library = ContentLibrary(course.directory)
+    assert [name for name, _ in library.menu_topics] == list(course.topics)
+    assert library.pages.topic_ids == {name: topic_id for topic_id, name in enumerate(course.topics)}
+    assert [page.text for page in library.pages.topics['intro'].lesson] == course.topics['intro']['lesson']
+
+
+def test_reload_without_changes_keeps_the_snapshot(course):
+    library = ContentLibrary(course.directory)
+    snapshot = library.current
+    assert library.reload() == 0
+    assert library.current is snapshot
+
+
+def test_reload_recompiles_only_changed_topics(course):
+    library = ContentLibrary(course.directory)
+    before = library.pages
+    course.write_topic('staking', ["Staking secures the network, now with rewards."])
+
+    assert library.reload() == 1
+    after = library.pages
+    assert after.topics['intro'] is before.topics['intro']
+    assert after.topics['modules'] is before.topics['modules']
+    assert after.topics['staking'] is not before.topics['staking']
+    assert after.topics['staking'].version != before.topics['staking'].version
+    assert after.topics['staking'].lesson[0].text == "Staking secures the network, now with rewards."
+
+
+def test_topics_that_moved_are_recompiled(course):
+    library = ContentLibrary(course.directory)
+    before = library.pages
+    course.write_index(['intro', 'modules', 'staking'])
+
+    assert library.reload() == 2
+    after = library.pages
+    assert after.topics['intro'] is before.topics['intro']
+    assert after.topic_ids['modules'] == 1
+    # Buttons carry the topic id
+    assert after.topics['modules'].lesson[0].reply_markup.inline_keyboard[0][0].callback_data.startswith('l:1:')
+
+
+def test_bad_pack_keeps_the_current_content(course):
+    library = ContentLibrary(course.directory)
+    snapshot = library.current
+    course.write_raw('staking', '{"version": 1, "lesson": [')
+
+    with pytest.raises(ContentError, match='staking'):
+        library.reload()
+    assert library.current is snapshot
+    # The same files are not tried again until they change
+    assert library.reload() == 0
+
+    course.write_topic('staking', ["Fixed."])
+    assert library.reload() == 1
+    assert library.pages.topics['staking'].lesson[0].text == "Fixed."
+
+
+@pytest.mark.parametrize('pack', [
+    {'lesson': []},
+    {'lesson': ["Page"], 'quiz': [{'question': "Q?", 'options': ["A"], 'correct': 1}]},
+])
+def test_malformed_topic_is_a_content_error(course, pack):
+    library = ContentLibrary(course.directory)
+    course.write_topic('modules', **pack)
+    with pytest.raises(ContentError):
+        library.reload()
+
+
+def test_missing_pack_is_a_content_error(course):
+    course.write_index([*course.topics, 'missing'])
+    with pytest.raises(ContentError, match='missing'):
+        ContentLibrary(course.directory)
@@ -0,0 +1,81 @@
+"""Compiled pages: splitting lesson pages to fit in a message."""
+import pytest
+
+from content import ContentError, ContentLibrary
+from pages import MAX_TEXT_LENGTH, compile_topic, parse_arguments, split_text, text_length
+
+EMOJI = "\U0001F680"  # outside the Basic Multilingual Plane, two UTF-16 code units
+
+
+def buttons(page) -> dict:
+    return {button.text: button.callback_data for row in page.reply_markup.inline_keyboard for button in row}
+
+
+def test_text_length_counts_utf16_code_units():
+    assert text_length("abc") == 3
+    assert text_length("é") == 1
+    assert text_length(EMOJI) == 2
+    assert text_length(f"a{EMOJI}b") == 4
+
+
+def test_short_text_is_not_split():
+    assert split_text("One page.", 20) == ("One page.",)
+
+
+def test_split_prefers_paragraphs_then_lines_then_words():
+    assert split_text("First paragraph.\n\nSecond paragraph.", 20) == ("First paragraph.", "Second paragraph.")
+    assert split_text("line one\nline two\nline three", 18) == ("line one\nline two", "line three")
+    assert split_text("one two three four", 9) == ("one two", "three", "four")
+
+
+def test_words_longer_than_the_limit_are_cut():
+    assert split_text("x" * 25, 10) == ("x" * 10, "x" * 10, "x" * 5)
+
+
+def test_astral_characters_count_double_and_are_not_cut_in_half():
+    parts = split_text(EMOJI * 7, 4)
+    assert parts == (EMOJI * 2, EMOJI * 2, EMOJI * 2, EMOJI)
+    text = " ".join([EMOJI * 3] * 20)
+    parts = split_text(text, 15)
+    assert all(text_length(part) <= 15 for part in parts)
+    assert " ".join(parts) == text
+
+
+def test_split_pages_are_numbered_in_the_buttons():
+    long = "a" * 60 + " " + "b" * 60
+    # A limit that still fits the quiz completion screen
+    topic = compile_topic(3, ["short", long, "end"], [], limit=100)
+    assert [page.text for page in topic.lesson] == ["short", "a" * 60, "b" * 60, "end"]
+    assert topic.page_counts == (1, 2, 1)
+    for index, page in enumerate(topic.lesson):
+        links = {label: parse_arguments(data.partition(':')[2], 3) for label, data in buttons(page).items()}
+        assert links["Next"] == (3, index + 1, topic.version)
+        if index:
+            assert links["Previous"] == (3, index - 1, topic.version)
+        else:
+            assert "Previous" not in links
+
+
+def test_topics_that_fit_keep_their_version():
+    lesson = ["one", "x" * 150]
+    assert compile_topic(0, lesson, []).version == compile_topic(0, lesson, [], limit=150).version
+    assert compile_topic(0, lesson, []).version != compile_topic(0, lesson, [], limit=100).version
+
+
+def test_quiz_question_too_long_for_a_message_is_rejected():
+    question = {'question': "?" * MAX_TEXT_LENGTH, 'options': ["A", "B"], 'correct': 0}
+    with pytest.raises(ValueError, match='question 1'):
+        compile_topic(0, ["page"], [question])
+
+
+def test_library_splits_long_pages_and_rejects_long_questions(course):
+    course.write_topic('modules', ["word " * 1000])
+    library = ContentLibrary(course.directory)
+    topic = library.pages.topics['modules']
+    assert topic.page_counts == (2,)
+    assert all(text_length(page.text) <= MAX_TEXT_LENGTH for page in topic.lesson)
+
+    course.write_topic('modules', ["page"], [{'question': "?" * MAX_TEXT_LENGTH, 'options': ["A"], 'correct': 0}])
+    with pytest.raises(ContentError, match='modules'):
+        library.reload()
+    assert library.pages.topics['modules'] is topic
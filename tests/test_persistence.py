@@ -0,0 +1,84 @@
+"""SQLitePersistence and the packed Session it stores."""
+import asyncio
+import logging
+import sqlite3
+import threading
+
+from persistence import SQLitePersistence
+from session import Session
+
+
+def persistence(path) -> SQLitePersistence:
+    return SQLitePersistence(str(path), dump_user_data=Session.to_bytes, load_user_data=Session.from_bytes)
+
+
+async def stored(path, user_ids) -> tuple:
+    """The sessions of ``user_ids`` and the conversations, as a restarted bot reads them."""
+    fresh = persistence(path)
+    sessions = []
+    for user_id in user_ids:
+        session = Session()
+        await fresh.refresh_user_data(user_id, session)
+        sessions.append(session)
+    conversations = await fresh.get_conversations('lessons')
+    await fresh.flush()
+    return sessions, conversations
+
+
+def test_user_data_and_conversations_survive_a_restart(tmp_path):
+    path = tmp_path / 'bot.sqlite3'
+
+    async def run():
+        first = persistence(path)
+        for user_id in (1, 2):
+            await first.refresh_user_data(user_id, Session())
+        await first.update_user_data(1, Session(2, lesson_index=3, quiz_index=1, score=1))
+        await first.update_user_data(2, Session(0, lesson_index=1))
+        await first.drop_user_data(2)
+        # Never loaded, so only a placeholder that must not overwrite the row
+        await first.update_user_data(3, Session(5))
+        await first.update_conversation('lessons', (1, 1), 2)
+        await first.update_conversation('lessons', (2, 2), 1)
+        await first.update_conversation('lessons', (2, 2), None)
+        await first.flush()
+        return await stored(path, (1, 2, 3))
+
+    sessions, conversations = asyncio.run(run())
+    assert sessions == [Session(2, lesson_index=3, quiz_index=1, score=1), Session(), Session()]
+    assert conversations == {(1, 1): 2}
+
+
+def test_failed_write_is_retried_with_the_changes_made_meanwhile(tmp_path, caplog):
+    path = tmp_path / 'bot.sqlite3'
+    writing, fail = threading.Event(), threading.Event()
+    calls = []
+
+    async def run():
+        first = persistence(path)
+        write = first._write
+
+        def failing_once(rows, conversations):
+            calls.append(sorted(rows))
+            if len(calls) == 1:
+                writing.set()
+                fail.wait(5)
+                raise sqlite3.OperationalError("database is locked")
+            write(rows, conversations)
+
+        first._write = failing_once
+        for user_id in (1, 2):
+            await first.refresh_user_data(user_id, Session())
+        await first.update_user_data(1, Session(1, lesson_index=1))
+        await first.update_user_data(2, Session(2, lesson_index=2))
+        await asyncio.to_thread(writing.wait, 5)
+        # Newer than the data of the write under way
+        await first.update_user_data(1, Session(1, lesson_index=5))
+        fail.set()
+        await first.flush()
+        return await stored(path, (1, 2))
+
+    with caplog.at_level(logging.ERROR, logger='persistence'):
+        sessions, _ = asyncio.run(run())
+    assert sessions == [Session(1, lesson_index=5), Session(2, lesson_index=2)]
+    assert calls == [[('user_data', 1), ('user_data', 2)], [('user_data', 1), ('user_data', 2)]]
+    assert "retrying" in caplog.text
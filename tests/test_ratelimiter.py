@@ -0,0 +1,141 @@
+"""PriorityRateLimiter and its token buckets, alone and against the fake Bot API's flood limits."""
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from benchmarks.fake_bot_api import FakeBotAPI, FloodLimits
+from ratelimiter import BULK, RATE_LIMITER_RETRIES, PriorityRateLimiter, TokenBucket
+
+TOKEN = '123456:fake-token'
+
+
+class Requests:
+    """Bot API calls made through a limiter, with the time each went out."""
+
+    def __init__(self, limiter: PriorityRateLimiter):
+        self.limiter = limiter
+        self.sent = []
+        self.failures = {}
+
+    async def _call(self, name: str) -> bool:
+        self.sent.append((name, asyncio.get_running_loop().time()))
+        failures = self.failures.get(name, 0)
+        if failures:
+            self.failures[name] = failures - 1
+            raise RetryAfter(0.1)
+        return True
+
+    def request(self, name: str, chat_id=None, priority=None):
+        data = {} if chat_id is None else {'chat_id': chat_id}
+        return self.limiter.process_request(self._call, (name,), {}, 'sendMessage', data, priority)
+
+    def times(self, name: str) -> list:
+        return [at for sent, at in self.sent if sent == name]
+
+
+def test_token_bucket_allows_a_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, burst=3)
+    for _ in range(3):
+        assert bucket.delay(0.0) == 0.0
+        bucket.take(0.0)
+    assert bucket.delay(0.0) == pytest.approx(0.1)
+    bucket.take(0.1)
+    assert bucket.delay(0.1) == pytest.approx(0.1)
+    # Full again after a quiet period
+    assert bucket.delay(1.0) == 0.0
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_interactive_requests_go_before_bulk_ones():
+    requests = Requests(PriorityRateLimiter(overall_rate=50, overall_burst=1, chat_rate=1000, chat_burst=10))
+
+    async def run():
+        await requests.request('first', chat_id=1)
+        # Both wait for the next token, the bulk request arriving first
+        await asyncio.gather(requests.request('bulk', chat_id=2, priority=BULK),
+                             requests.request('interactive', chat_id=3))
+
+    asyncio.run(run())
+    assert [name for name, _ in requests.sent] == ['first', 'interactive', 'bulk']
+    interactive, bulk = requests.times('interactive')[0], requests.times('bulk')[0]
+    assert bulk - interactive >= 0.019
+
+
+def test_retry_after_holds_back_only_that_chat():
+    requests = Requests(PriorityRateLimiter(overall_rate=1000, overall_burst=100, chat_rate=1000, chat_burst=10))
+    requests.failures['flooded'] = 1
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        flooded = asyncio.ensure_future(requests.request('flooded', chat_id=1))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(requests.request('other chat', chat_id=2), requests.request('same chat', chat_id=1))
+        await flooded
+        return started
+
+    started = asyncio.run(run())
+    assert requests.times('other chat')[0] - started < 0.05
+    assert requests.times('same chat')[0] - started >= 0.09
+    first, retried = requests.times('flooded')
+    assert retried - first >= 0.09
+
+
+def test_retry_after_is_retried_up_to_max_retries():
+    requests = Requests(PriorityRateLimiter(max_retries=2))
+    requests.failures['chat'] = requests.failures['no chat'] = 10
+    before = RATE_LIMITER_RETRIES.labels('sendMessage').value
+
+    async def run():
+        for name, chat_id in (('chat', 1), ('no chat', None)):
+            with pytest.raises(RetryAfter):
+                await requests.request(name, chat_id=chat_id)
+
+    asyncio.run(run())
+    assert len(requests.times('chat')) == len(requests.times('no chat')) == 3
+    assert RATE_LIMITER_RETRIES.labels('sendMessage').value == before + 4
+
+
+def test_chats_with_a_full_bucket_are_pruned():
+    limiter = PriorityRateLimiter(chat_rate=1, chat_burst=1)
+    for chat_id in range(1, 1025):
+        limiter._reserve_chat(chat_id, 0.0)
+    # Still owes a token at the time of pruning
+    limiter._reserve_chat(-7, 1.5)
+    assert len(limiter._chats) == 1025
+    limiter._reserve_chat(5000, 2.0)
+    assert set(limiter._chats) == {-7, 5000}
+    # A pruned chat starts with a full bucket, as it would have had anyway
+    assert limiter._reserve_chat(1, 2.0) == 0.0
+    assert limiter._reserve_chat(1, 2.0) == pytest.approx(1.0)
+
+
+def test_messages_within_the_limits_are_not_rejected_by_the_fake_api():
+    async def run():
+        async with FakeBotAPI(flood_limits=FloodLimits(chat_rate=5, chat_burst=1)) as api:
+            # A little under the server's limit, as arrival times there jitter
+            limiter = PriorityRateLimiter(chat_rate=4, chat_burst=1)
+            async with ExtBot(TOKEN, base_url=api.base_url, rate_limiter=limiter) as bot:
+                for text in ("One", "Two", "Three"):
+                    await bot.send_message(1, text)
+            return api.rejected, api.count('sendMessage')
+
+    assert asyncio.run(run()) == (0, 3)
+
+
+def test_message_rejected_with_429_by_the_fake_api_is_sent_once_allowed():
+    async def run():
+        async with FakeBotAPI(flood_limits=FloodLimits(chat_rate=1, chat_burst=1)) as api:
+            # Looser than the server, so the second message is answered with 429
+            limiter = PriorityRateLimiter(chat_rate=100, chat_burst=10)
+            async with ExtBot(TOKEN, base_url=api.base_url, rate_limiter=limiter) as bot:
+                started = asyncio.get_running_loop().time()
+                await asyncio.gather(bot.send_message(1, "One"), bot.send_message(1, "Two"))
+                elapsed = asyncio.get_running_loop().time() - started
+            return api.rejected, api.count('sendMessage'), elapsed
+
+    rejected, sent, elapsed = asyncio.run(run())
+    assert (rejected, sent) == (1, 2)
+    assert elapsed >= 0.9
@@ -0,0 +1,155 @@
+"""Replies: skipping identical edits, coalescing bursts and reporting failed edits."""
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from pages import Page
+from replies import MESSAGE_EDITS, Replies
+
+
+class Message:
+    """The message a learner's buttons are on; edits can be held up or made to fail."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(id=1)
+        self.message_id = 1
+        self.edits = []
+        self.answers = []
+        self.errors = []
+        self.gate = None
+        self.fail = None
+
+    async def edit_text(self, text, reply_markup=None):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail is not None:
+            raise self.fail
+        self.edits.append(text)
+
+    async def answer(self, text=None):
+        self.answers.append(text)
+
+    async def process_error(self, update, error):
+        self.errors.append((update, error))
+
+
+def setup():
+    message = Message()
+    application = SimpleNamespace(bot_data={}, process_error=message.process_error)
+    replies = Replies()
+    replies.install(application)
+    query = SimpleNamespace(id='1', message=message, answer=message.answer)
+    update = SimpleNamespace(message=None, callback_query=query, update_id=1)
+    return replies, message, update
+
+
+def counts() -> dict:
+    return {result: MESSAGE_EDITS.labels(result).value for result in ('sent', 'failed', 'skipped', 'coalesced')}
+
+
+def changes(before: dict) -> dict:
+    return {result: value - before[result] for result, value in counts().items() if value != before[result]}
+
+
+def test_identical_edit_is_skipped():
+    replies, message, update = setup()
+    before = counts()
+
+    async def run():
+        await replies.send_page(update, Page("One", None))
+        await replies.send_page(update, Page("One", None))
+        await replies.drain()
+
+    asyncio.run(run())
+    assert message.edits == ["One"]
+    assert message.answers == [None, None]
+    assert changes(before) == {'sent': 1, 'skipped': 1}
+
+
+def test_burst_of_taps_sends_the_edit_in_flight_and_the_newest():
+    replies, message, update = setup()
+    before = counts()
+
+    async def run():
+        message.gate = asyncio.Event()
+        for text in ("One", "Two", "Three", "Four"):
+            await replies.send_page(update, Page(text, None))
+            await asyncio.sleep(0)
+        assert replies.edits.in_flight == 1
+        message.gate.set()
+        await replies.drain()
+        assert replies.edits.in_flight == 0
+
+    asyncio.run(run())
+    assert message.edits == ["One", "Four"]
+    assert changes(before) == {'sent': 2, 'coalesced': 2}
+
+
+def test_page_tapped_away_from_and_back_to_is_not_sent_again():
+    replies, message, update = setup()
+    before = counts()
+
+    async def run():
+        message.gate = asyncio.Event()
+        for text in ("One", "Two", "One"):
+            await replies.send_page(update, Page(text, None))
+            await asyncio.sleep(0)
+        message.gate.set()
+        await replies.drain()
+
+    asyncio.run(run())
+    assert message.edits == ["One"]
+    assert changes(before) == {'sent': 1, 'coalesced': 2}
+
+
+def test_failed_edit_is_counted_forgotten_and_reported():
+    replies, message, update = setup()
+    before = counts()
+    error = RuntimeError("chat not found")
+
+    async def run():
+        message.fail = error
+        await replies.send_page(update, Page("One", None))
+        await replies.drain()
+        # Forgotten, so the same page is tried again
+        message.fail = None
+        await replies.send_page(update, Page("One", None))
+        await replies.drain()
+
+    asyncio.run(run())
+    assert message.edits == ["One"]
+    assert message.errors == [(update, error)]
+    assert changes(before) == {'sent': 1, 'failed': 1}
+
+
+def test_edit_not_modifying_the_message_counts_as_sent():
+    replies, message, update = setup()
+    before = counts()
+
+    async def run():
+        message.fail = BadRequest("Message is not modified: specified new message content is the same")
+        await replies.send_page(update, Page("One", None))
+        await replies.drain()
+        # Still remembered as shown
+        await replies.send_page(update, Page("One", None))
+        await replies.drain()
+
+    asyncio.run(run())
+    assert message.errors == []
+    assert changes(before) == {'sent': 1, 'skipped': 1}
+
+
+def test_drain_cancels_what_is_left_after_the_timeout():
+    replies, message, update = setup()
+
+    async def run():
+        message.gate = asyncio.Event()
+        await replies.send_page(update, Page("One", None))
+        await asyncio.wait_for(replies.drain(timeout=0.05), 1)
+        assert replies.edits.in_flight == 0
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(run())
+    assert message.edits == []
+    assert message.answers == [None]
@@ -0,0 +1,135 @@
+"""Search: stemming, BM25 ranking, incremental index updates and indexes in a content store."""
+import math
+import os
+import random
+
+import pytest
+
+import search
+from content import ContentLibrary
+from contentstore import MappedSearchIndex, StoreLibrary, write_store
+from search import SearchIndex, TopicIndex, query_terms, snippet, stem
+
+WORDS = ("alpha", "bravo", "delta", "gamma", "kappa", "omega", "sigma", "theta", "zulu", "echo")
+
+
+def random_topic(rng: random.Random, words: int = 6) -> TopicIndex:
+    # Pages of the same length keep the average page length, and so every weight, the same
+    return TopicIndex(' '.join(rng.choices(WORDS, k=rng.randint(1, words) if words > 6 else words))
+                      for _ in range(rng.randint(1, 6)))
+
+
+def exhaustive(index: SearchIndex, query: str, limit: int = 5) -> list:
+    scores = {}
+    for term in query_terms(query):
+        term_list = index.lists.get(term)
+        if term_list is None:
+            continue
+        matches = len(term_list.keys)
+        idf = math.log(1 + (index.pages - matches + 0.5) / (matches + 0.5))
+        for key, weight in zip(term_list.keys, term_list.weights):
+            scores[key] = scores.get(key, 0.0) + idf * weight
+    best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return [(key >> 16, key & 0xFFFF) for key, _ in best]
+
+
+def columns(index: SearchIndex) -> dict:
+    return {term: tuple(map(list, term_list)) for term, term_list in index.lists.items()}
+
+
+def test_stem_joins_word_families():
+    assert stem("modules") == stem("module") == "modul"
+    assert stem("staking") == stem("stake") == "stak"
+    assert stem("address") == "address"
+    assert query_terms("The modules, the MODULE and staking") == ["modul", "stak"]
+
+
+def test_snippet_starts_near_the_first_match():
+    text = "Lorem ipsum dolor sit amet. " * 10 + "Validators stake their coins. " + "Tail text. " * 10
+    part = snippet(text, "staking", width=60)
+    assert part.startswith('…') and part.endswith('…')
+    assert "stake" in part
+    assert snippet("Short text.", "nothing") == "Short text."
+
+
+def test_search_ranks_pages_by_bm25():
+    index = SearchIndex([TopicIndex(["alpha bravo", "alpha alpha delta", "gamma"]), TopicIndex(["bravo delta"])],
+                        ["One", "Two"])
+    assert [(result.topic_id, result.page) for result in index.search("alpha")] == [(0, 1), (0, 0)]
+    assert [(result.topic_id, result.page) for result in index.search("bravo delta")] == [(1, 0), (0, 0), (0, 1)]
+    assert index.search("nothing") == []
+    assert index.search("") == []
+
+
+def test_search_is_exact_when_no_list_is_cut():
+    rng = random.Random(3)
+    index = SearchIndex([random_topic(rng) for _ in range(30)], [str(number) for number in range(30)])
+    assert all(len(term_list.best_keys) == len(term_list.keys) for term_list in index.lists.values())
+    for _ in range(200):
+        query = ' '.join(rng.sample(WORDS, rng.randint(1, 4)))
+        assert [(result.topic_id, result.page) for result in index.search(query)] == exhaustive(index, query)
+
+
+@pytest.mark.parametrize('words', [6, 30])
+def test_search_is_exact_when_lists_are_cut(words):
+    rng = random.Random(words)
+    topics = [random_topic(rng, words) for _ in range(400)]
+    index = SearchIndex(topics, [str(number) for number in range(len(topics))])
+    assert all(len(term_list.best_keys) < len(term_list.keys) for term_list in index.lists.values())
+    for _ in range(200):
+        query = ' '.join(rng.sample(WORDS, rng.randint(1, 4)))
+        assert [(result.topic_id, result.page) for result in index.search(query)] == exhaustive(index, query)
+
+
+def test_search_finds_the_best_page_of_a_rare_term_among_common_ones(monkeypatch):
+    monkeypatch.setattr(search, 'MAX_LIST_DEPTH', 4)
+    monkeypatch.setattr(search, 'QUERY_BUDGET', 8)
+    topics = [TopicIndex(["alpha bravo"] * 20) for _ in range(3)] + [TopicIndex(["alpha bravo zulu"])]
+    index = SearchIndex(topics, ["One", "Two", "Three", "Four"])
+    assert [(result.topic_id, result.page) for result in index.search("alpha bravo zulu", 1)] == [(3, 0)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_incremental_update_matches_a_fresh_build(monkeypatch, seed):
+    # Short lists so that updates cut and merge the lists of best pages
+    monkeypatch.setattr(search, 'MAX_LIST_DEPTH', 8)
+    monkeypatch.setattr(search, 'QUERY_BUDGET', 16)
+    rng = random.Random(seed)
+    topics = [random_topic(rng) for _ in range(rng.randint(1, 20))]
+    index = SearchIndex(topics, [str(number) for number in range(len(topics))])
+    for _ in range(30):
+        topics = list(topics)
+        for _ in range(rng.randint(1, 3)):
+            change = rng.random()
+            if change < 0.6 and topics:
+                topics[rng.randrange(len(topics))] = random_topic(rng)
+            elif change < 0.8 or len(topics) < 2:
+                topics.append(random_topic(rng))
+            else:
+                topics.pop()
+        titles = [str(number) for number in range(len(topics))]
+        index = SearchIndex(topics, titles, previous=index)
+        fresh = SearchIndex(topics, titles)
+        assert index.average_length == fresh.average_length
+        assert columns(index) == columns(fresh)
+        for _ in range(5):
+            query = ' '.join(rng.sample(WORDS, rng.randint(1, 3)))
+            assert index.search(query) == fresh.search(query)
+
+
+def test_store_serves_the_search_index_it_was_written_with(course):
+    library = ContentLibrary(course.directory)
+    path = os.path.join(course.directory, 'content.store')
+    write_store(library.pages, library.menu_topics, path, library.current.search)
+    store = StoreLibrary(path)
+    assert isinstance(store.current.search, MappedSearchIndex)
+    assert store.current.search.titles == library.current.search.titles
+    for query in ("staking", "module account", "Move language", "nothing"):
+        assert store.current.search.search(query) == library.current.search.search(query)
+
+    # A store written without an index is indexed by the worker
+    write_store(library.pages, library.menu_topics, path)
+    os.utime(path, ns=(10 ** 9, 10 ** 9))
+    assert store.reload() == 1
+    assert isinstance(store.current.search, SearchIndex)
+    assert store.current.search.search("staking") == library.current.search.search("staking")
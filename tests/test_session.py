@@ -0,0 +1,20 @@
+"""Session: packing a learner's progress for persistence."""
+import logging
+
+from session import Session
+
+
+def test_session_round_trips_through_bytes():
+    session = Session(3, lesson_index=4, quiz_index=1, score=1)
+    assert len(session.to_bytes()) == 9
+    assert Session.from_bytes(session.to_bytes()) == session
+    assert Session.from_bytes(Session().to_bytes()).topic is None
+
+
+def test_session_of_an_unknown_format_is_discarded(caplog):
+    data = Session(3, lesson_index=4).to_bytes()
+    with caplog.at_level(logging.WARNING, logger='session'):
+        assert Session.from_bytes(data[:-1]) == Session()
+        assert Session.from_bytes(data + b'\0') == Session()
+        assert Session.from_bytes(bytes([2]) + data[1:]) == Session()
+    assert len(caplog.records) == 3
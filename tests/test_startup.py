@@ -0,0 +1,20 @@
+"""Time to the first getUpdates stays within budget.
+
+Spawns bot.py against the fake Bot API the way benchmarks/bench_startup.py
+does, with its default 50 ms per call and 100 ms per new connection. The
+budget is loose, about twice the median measured when startup was last
+optimized, so only a real regression, such as an eager import or a blocking
+call added before polling starts, fails it.
+"""
+import asyncio
+import statistics
+
+from benchmarks.bench_startup import start_once
+
+BUDGET_SECONDS = 2.0
+RUNS = 3
+
+
+def test_first_get_updates_within_budget():
+    timings = [asyncio.run(start_once(latency=0.05, handshake=0.1)) for _ in range(RUNS)]
+    assert statistics.median(timings) < BUDGET_SECONDS, f"startup took {sorted(timings)} s"
@@ -0,0 +1,254 @@
+"""PerUserUpdateProcessor: ordering per user, queue caps and shedding button presses."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+from updateprocessor import CALLBACK_QUERIES_SHED, PerUserUpdateProcessor
+
+
+class FakeBot:
+    """Records the callback queries answered."""
+
+    def __init__(self):
+        self.answered = []
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        self.answered.append(callback_query_id)
+        return True
+
+
+def tap(bot: FakeBot, update_id: int, user_id: int, message_id: int = 1, age: float = 0.0,
+        edited: Optional[float] = None) -> Update:
+    """A button press on a message of the bot sent ``age`` and edited ``edited`` seconds ago."""
+    now = datetime.now(timezone.utc)
+    message = Message(message_id, now - timedelta(seconds=age), Chat(user_id, Chat.PRIVATE),
+                      edit_date=now - timedelta(seconds=edited) if edited is not None else None)
+    query = CallbackQuery(str(update_id), User(user_id, "Learner", False), 'chat', message=message, data='x')
+    query.set_bot(bot)
+    return Update(update_id, callback_query=query)
+
+
+def message(update_id: int, user_id: int) -> Update:
+    chat = Chat(user_id, Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(timezone.utc), chat,
+                                             from_user=User(user_id, "Learner", False), text='/start'))
+
+
+def shed(reason: str) -> float:
+    return CALLBACK_QUERIES_SHED.labels(reason).value
+
+
+class Handlers:
+    """Handler coroutines that log when they start and finish and can be held up."""
+
+    def __init__(self):
+        self.log = []
+        self.gates = {}
+
+    def hold(self, update_id: int) -> asyncio.Event:
+        self.gates[update_id] = asyncio.Event()
+        return self.gates[update_id]
+
+    async def handle(self, update: Update) -> None:
+        self.log.append(('start', update.update_id))
+        gate = self.gates.get(update.update_id)
+        if gate is not None:
+            await gate.wait()
+        await asyncio.sleep(0)
+        self.log.append(('end', update.update_id))
+
+    def handled(self) -> list:
+        return [update_id for event, update_id in self.log if event == 'end']
+
+
+async def submit(processor: PerUserUpdateProcessor, handlers: Handlers, update: Update) -> asyncio.Task:
+    task = asyncio.ensure_future(processor.do_process_update(update, handlers.handle(update)))
+    # Let it reach its turn or its handler
+    await asyncio.sleep(0)
+    return task
+
+
+def test_updates_of_one_user_run_in_order_and_users_in_parallel():
+    bot = FakeBot()
+    handlers = Handlers()
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor()
+        gate = handlers.hold(1)
+        tasks = [await submit(processor, handlers, tap(bot, update_id, 1, message_id=update_id))
+                 for update_id in (1, 2, 3)]
+        # The first user is held up, the second is not held behind them
+        tasks.append(await submit(processor, handlers, tap(bot, 4, 2)))
+        await tasks[-1]
+        assert handlers.handled() == [4]
+        assert processor.active_keys == 1 and processor.waiting_updates == 2
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert processor.active_keys == 0 and processor.waiting_updates == 0
+
+    asyncio.run(run())
+    first_user = [entry for entry in handlers.log if entry[1] != 4]
+    assert first_user == [('start', 1), ('end', 1), ('start', 2), ('end', 2), ('start', 3), ('end', 3)]
+    assert bot.answered == []
+
+
+def test_update_over_the_queue_cap_is_dropped_and_a_tap_answered():
+    bot = FakeBot()
+    handlers = Handlers()
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor(max_queued_per_key=1)
+        gate = handlers.hold(1)
+        tasks = [await submit(processor, handlers, tap(bot, 1, 1, message_id=1)),
+                 await submit(processor, handlers, tap(bot, 2, 1, message_id=2))]
+        # Both over the cap: the tap is answered, the message only dropped
+        await submit(processor, handlers, tap(bot, 3, 1, message_id=3))
+        await submit(processor, handlers, message(4, 1))
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    before = shed('dropped')
+    asyncio.run(run())
+    assert handlers.handled() == [1, 2]
+    assert bot.answered == ['3']
+    assert shed('dropped') == before + 1
+
+
+def test_waiting_tap_on_the_same_message_is_superseded_by_a_newer_one():
+    bot = FakeBot()
+    handlers = Handlers()
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor()
+        gate = handlers.hold(1)
+        tasks = [await submit(processor, handlers, tap(bot, 1, 1, message_id=1))]
+        for update_id in (2, 3):
+            tasks.append(await submit(processor, handlers, tap(bot, update_id, 1, message_id=7)))
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert processor.active_keys == 0
+
+    before = shed('superseded')
+    asyncio.run(run())
+    assert handlers.handled() == [1, 3]
+    assert bot.answered == ['2']
+    assert shed('superseded') == before + 1
+
+
+def test_tap_that_waited_longer_than_the_max_age_is_shed():
+    bot = FakeBot()
+    handlers = Handlers()
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor(max_callback_age=0.05)
+        gate = handlers.hold(1)
+        tasks = [await submit(processor, handlers, tap(bot, update_id, 1, message_id=update_id))
+                 for update_id in (1, 2)]
+        await asyncio.sleep(0.1)
+        gate.set()
+        await asyncio.gather(*tasks)
+        # A tap that did not wait is handled
+        await submit(processor, handlers, tap(bot, 3, 1, message_id=3))
+
+    before = shed('stale')
+    asyncio.run(run())
+    assert handlers.handled() == [1, 3]
+    assert bot.answered == ['2']
+    assert shed('stale') == before + 1
+
+
+def test_cancelled_waiting_update_leaves_the_queue():
+    handlers = Handlers()
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor()
+        gate = handlers.hold(1)
+        tasks = [await submit(processor, handlers, message(update_id, 1)) for update_id in (1, 2, 3)]
+        tasks[1].cancel()
+        gate.set()
+        # A turn never passed on would hold the rest up for good
+        results = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 1)
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert processor.active_keys == 0
+
+    asyncio.run(run())
+    assert handlers.handled() == [1, 3]
+
+
+def test_update_cancelled_as_it_gets_its_turn_passes_the_turn_on():
+    handlers = Handlers()
+    cancelled = []
+
+    class Processor(PerUserUpdateProcessor):
+        def _release(self, key):
+            super()._release(key)
+            # Cancel the next update between being handed the turn and taking it
+            if not cancelled:
+                cancelled.append(True)
+                tasks[1].cancel()
+
+    tasks = []
+
+    async def run() -> None:
+        processor = Processor()
+        gate = handlers.hold(1)
+        for update_id in (1, 2, 3):
+            tasks.append(await submit(processor, handlers, message(update_id, 1)))
+        gate.set()
+        # A turn never passed on would hold the rest up for good
+        results = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 1)
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert processor.active_keys == 0
+
+    asyncio.run(run())
+    assert handlers.handled() == [1, 3]
+
+
+def test_taps_left_from_before_the_start_are_shed():
+    bot = FakeBot()
+    handled = []
+
+    async def handle(update: Update) -> None:
+        handled.append(update.update_id)
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor(max_callback_age=0.2)
+        await processor.initialize()
+        # On a message last changed a minute ago, so at least that old
+        old = tap(bot, 1, 1, age=60)
+        await processor.do_process_update(old, handle(old))
+        # On a message changed a moment ago, so made a moment ago at most
+        recent = tap(bot, 2, 2, age=0.05)
+        await processor.do_process_update(recent, handle(recent))
+        edited = tap(bot, 4, 3, age=3600, edited=0.05)
+        await processor.do_process_update(edited, handle(edited))
+        # Once the backlog is through, taps on old messages are handled
+        await asyncio.sleep(0.3)
+        later = tap(bot, 3, 1, age=60)
+        await processor.do_process_update(later, handle(later))
+
+    before = shed('stale')
+    asyncio.run(run())
+    assert handled == [2, 4, 3]
+    assert bot.answered == ['1']
+    assert shed('stale') == before + 1
+
+
+def test_taps_from_before_the_start_are_kept_without_a_max_age():
+    bot = FakeBot()
+    handled = []
+
+    async def handle(update: Update) -> None:
+        handled.append(update.update_id)
+
+    async def run() -> None:
+        processor = PerUserUpdateProcessor(max_callback_age=None)
+        await processor.initialize()
+        old = tap(bot, 1, 1, age=3600)
+        await processor.do_process_update(old, handle(old))
+
+    asyncio.run(run())
+    assert handled == [1]
+    assert bot.answered == []
@@ -0,0 +1,127 @@
+"""Learners finish a topic in the content version they started it in."""
+import asyncio
+import gc
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from content import ContentLibrary
+from pages import LESSON, callback_data
+from replies import Replies
+from session import Session
+
+
+class Chat:
+    """A learner's chat: the message their buttons are on, and what the bot did with it."""
+
+    def __init__(self):
+        self.session = Session()
+        self.application = SimpleNamespace(bot_data={})
+        Replies().install(self.application)
+        self.context = SimpleNamespace(user_data=self.session, bot_data=self.application.bot_data)
+        self.shown = []
+        self.answers = []
+
+    async def _edit_text(self, text, reply_markup=None):
+        self.shown.append(text)
+
+    async def _answer(self, text=None):
+        self.answers.append(text)
+
+    def tap(self, handler, argument: str):
+        """Press a button served by ``handler`` with the callback argument, until the page is shown."""
+        message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1, edit_text=self._edit_text)
+        query = SimpleNamespace(id='1', message=message, answer=self._answer)
+        update = SimpleNamespace(message=None, callback_query=query, effective_user=SimpleNamespace(id=1),
+                                 update_id=1)
+
+        async def run():
+            state = await handler(update, self.context, argument)
+            await Replies.of(self.context).drain()
+            return state
+        return asyncio.run(run())
+
+
+@pytest.fixture
+def library(course, monkeypatch):
+    library = ContentLibrary(course.directory)
+    monkeypatch.setattr(bot, 'CONTENT', library)
+    return library
+
+
+def lesson_argument(topic, topic_id: int, page: int) -> str:
+    return callback_data(LESSON, topic_id, page, topic.version).partition(':')[2]
+
+
+def test_learner_stays_on_their_version_across_a_reload(course, library):
+    chat = Chat()
+    topic_id = library.pages.topic_ids['intro']
+    chat.tap(bot.open_topic, str(topic_id))
+    started = library.current
+    old_topic = started.pages.by_id[topic_id]
+    assert chat.session.snapshot is started
+
+    course.write_topic('intro', ["Rewritten first page.", "Rewritten second page."])
+    library.reload()
+    assert library.current is not started
+
+    # Next on the page sent before the reload still leads through the old lesson
+    assert chat.tap(bot.show_lesson_page, lesson_argument(old_topic, topic_id, 1)) == bot.READING
+    assert chat.shown[-1] == old_topic.lesson[1].text
+    assert chat.session.snapshot is started
+    assert bot.session_pages(chat.context) is started.pages
+    chat.tap(bot.show_lesson_page, lesson_argument(old_topic, topic_id, 2))
+    assert chat.shown[-1] == old_topic.lesson[2].text
+
+
+def test_stale_button_restarts_the_topic_in_the_current_version(course, library):
+    chat = Chat()
+    topic_id = library.pages.topic_ids['intro']
+    chat.tap(bot.open_topic, str(topic_id))
+    old_topic = library.pages.by_id[topic_id]
+
+    course.write_topic('intro', ["First revision."])
+    library.reload()
+    course.write_topic('intro', ["Second revision.", "With a second page."])
+    library.reload()
+    # The learner moves on to the current version, then taps a button of the first one
+    chat.session.snapshot = None
+    chat.tap(bot.show_lesson_page, lesson_argument(old_topic, topic_id, 1))
+
+    assert chat.shown[-1] == "Second revision."
+    assert chat.answers[-1] == bot.CONTENT_UPDATED_TEXT
+    assert chat.session.snapshot is library.current
+    assert (chat.session.topic, chat.session.lesson_index) == (topic_id, 0)
+
+
+def test_button_for_a_position_past_the_topic_restarts_it(library):
+    chat = Chat()
+    topic_id = library.pages.topic_ids['staking']
+    chat.tap(bot.open_topic, str(topic_id))
+    topic = library.pages.by_id[topic_id]
+
+    chat.tap(bot.show_lesson_page, lesson_argument(topic, topic_id, len(topic.lesson) + 5))
+    assert chat.shown[-1] == topic.lesson[0].text
+    assert chat.answers[-1] == bot.CONTENT_UPDATED_TEXT
+
+
+def test_old_versions_are_freed_once_no_session_holds_them(course, library):
+    readers = [Chat() for _ in range(3)]
+    topic_id = library.pages.topic_ids['intro']
+    for revision, reader in enumerate(readers):
+        reader.tap(bot.open_topic, str(topic_id))
+        course.write_topic('intro', [f"Revision {revision}."])
+        library.reload()
+    gc.collect()
+    assert library.live_versions == 4
+
+    readers[0].tap(bot.show_menu, '')
+    assert readers[0].session.snapshot is None
+    readers[1].session.start(topic_id, library.current)
+    gc.collect()
+    assert library.live_versions == 2
+
+    del readers[2], reader
+    gc.collect()
+    assert library.live_versions == 1
@@ -0,0 +1,241 @@
+"""Update processor that keeps each user's updates in order but runs users in parallel.
+
+Plain ``concurrent_updates`` is unsafe for this bot: the conversation states and
+``context.user_data`` assume one user's taps are handled one after another.
+:class:`PerUserUpdateProcessor` serializes updates that share a key (the user,
+or the chat for updates without one) and lets different keys run concurrently.
+
+Under a backlog it also sheds button presses nobody is waiting for any more: a
+callback query that waited longer than ``max_callback_age`` since it reached
+the processor, or one that a newer tap on the same message has replaced while
+both were waiting. Shed queries are answered without text, which stops the
+client's spinner, and are never handed to the handlers. So are button presses
+dropped because their user already has ``max_queued_per_key`` updates waiting.
+
+Taps that piled up at Telegram while the bot was down reach the processor
+all at once after a start, so how long they waited here says nothing. A tap
+comes after the last change of the message its button is on, though, so for
+``max_callback_age`` seconds after :meth:`~PerUserUpdateProcessor.initialize`
+a tap on a message that last changed before the start and more than
+``max_callback_age`` ago counts as stale too. That also sheds a tap made
+after the start on such a message; it is answered, and the next one is
+handled.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_QUERIES_SHED = Counter('bot_callback_queries_shed',
+                                "Button presses answered without being handled: 'stale' ones waited too long or "
+                                "were made before a start, "
+                                "'superseded' ones were replaced by a newer tap on the same message, 'dropped' "
+                                "ones arrived while their user had too many updates queued.", ('reason',))
+
+# Result of a waiting update's turn when a newer tap on the same message replaced it
+_SUPERSEDED = object()
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+def message_slot(update: object) -> Optional[Hashable]:
+    """The message a callback query's button is on, or ``None`` for other updates."""
+    if not isinstance(update, Update) or update.callback_query is None:
+        return None
+    query = update.callback_query
+    if query.message is not None:
+        return query.message.chat.id, query.message.message_id
+    return query.inline_message_id
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Serialize updates per user and process different users concurrently.
+
+    Args:
+        max_concurrent_updates: Global cap on handlers running at the same time.
+        max_queued_per_key: How many updates of one user may wait behind the one
+            being processed. Further updates of that user are dropped.
+        max_pending_updates: Cap on updates held by the processor overall, running
+            or waiting. Updates over this cap wait in the application's queue.
+        max_callback_age: Seconds a callback query may wait in the processor
+            before it is shed instead of handled. ``None`` never sheds for age;
+            superseded taps are shed either way.
+    """
+
+    __slots__ = ("_running", "_max_queued_per_key", "_max_callback_age", "_waiters", "_waiting_taps",
+                 "_held", "_active", "_started", "_backlog_until", "_stale_counter", "_superseded_counter",
+                 "_dropped_counter")
+
+    def __init__(self, max_concurrent_updates: int = 256, max_queued_per_key: int = 16,
+                 max_pending_updates: int = 4096, max_callback_age: Optional[float] = None):
+        # The base class semaphore bounds every update we hold, including those
+        # waiting for their user's turn, so they do not eat into the running cap
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        if max_queued_per_key < 0:
+            raise ValueError("`max_queued_per_key` must not be negative!")
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._max_queued_per_key = max_queued_per_key
+        self._max_callback_age = max_callback_age
+        # A key is present while one of its updates is running; the deque holds
+        # the turns of the updates waiting behind it
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+        # The turn of the newest waiting tap per (key, message)
+        self._waiting_taps: Dict[Tuple[Hashable, Hashable], asyncio.Future] = {}
+        self._held = 0
+        self._active = 0
+        # Wall clock time of the start, as Telegram dates messages, and until
+        # when updates may still be from the backlog of before it
+        self._started = 0.0
+        self._backlog_until = 0.0
+        self._stale_counter = CALLBACK_QUERIES_SHED.labels('stale')
+        self._superseded_counter = CALLBACK_QUERIES_SHED.labels('superseded')
+        self._dropped_counter = CALLBACK_QUERIES_SHED.labels('dropped')
+
+    @property
+    def active_keys(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def running_updates(self) -> int:
+        return self._active
+
+    @property
+    def waiting_updates(self) -> int:
+        """Updates held by the processor that are not running yet."""
+        return self._held - self._active
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        received = time.monotonic()
+        if received < self._backlog_until and self._from_backlog(update):
+            self._stale_counter.inc()
+            await self._shed(update, coroutine)
+            return
+        self._held += 1
+        try:
+            await self._process(update, coroutine, received)
+        finally:
+            self._held -= 1
+
+    def _from_backlog(self, update: object) -> bool:
+        """Whether a callback query was made before the start, longer than ``max_callback_age`` ago."""
+        slot = message_slot(update)
+        message = update.callback_query.message if slot is not None else None
+        if message is None:
+            return False
+        changed = getattr(message, 'edit_date', None) or message.date
+        return changed.timestamp() < min(self._started, time.time() - self._max_callback_age)
+
+    async def _run(self, update: object, coroutine: Awaitable[Any], received: float) -> None:
+        async with self._running:
+            if (self._max_callback_age is not None and message_slot(update) is not None
+                    and time.monotonic() - received > self._max_callback_age):
+                self._stale_counter.inc()
+                await self._shed(update, coroutine)
+                return
+            self._active += 1
+            try:
+                await coroutine
+            finally:
+                self._active -= 1
+
+    async def _process(self, update: object, coroutine: Awaitable[Any], received: float) -> None:
+        key = update_key(update)
+        if key is None:
+            await self._run(update, coroutine, received)
+            return
+
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            self._waiters[key] = deque()
+        else:
+            slot = message_slot(update)
+            tap = (key, slot) if slot is not None else None
+            if tap is not None:
+                older = self._waiting_taps.get(tap)
+                if older is not None and not older.done():
+                    waiters.remove(older)
+                    older.set_result(_SUPERSEDED)
+            if len(waiters) >= self._max_queued_per_key:
+                logger.warning("Dropping update %s: %d updates already queued for %s",
+                               getattr(update, 'update_id', None), len(waiters), key)
+                if slot is not None:
+                    # Stop the client's spinner instead of letting the tap time out
+                    self._dropped_counter.inc()
+                    await self._shed(update, coroutine)
+                elif asyncio.iscoroutine(coroutine):
+                    coroutine.close()
+                return
+            turn = asyncio.get_running_loop().create_future()
+            waiters.append(turn)
+            if tap is not None:
+                self._waiting_taps[tap] = turn
+            try:
+                outcome = await turn
+            except asyncio.CancelledError:
+                if turn.done() and not turn.cancelled() and turn.result() is not _SUPERSEDED:
+                    # We were handed the turn just before being cancelled
+                    self._release(key)
+                elif turn in waiters:
+                    waiters.remove(turn)
+                if asyncio.iscoroutine(coroutine):
+                    coroutine.close()
+                raise
+            finally:
+                if tap is not None and self._waiting_taps.get(tap) is turn:
+                    del self._waiting_taps[tap]
+            if outcome is _SUPERSEDED:
+                self._superseded_counter.inc()
+                await self._shed(update, coroutine)
+                return
+
+        try:
+            await self._run(update, coroutine, received)
+        finally:
+            self._release(key)
+
+    async def _shed(self, update: Update, coroutine: Awaitable[Any]) -> None:
+        if asyncio.iscoroutine(coroutine):
+            coroutine.close()
+        try:
+            await update.callback_query.answer()
+        except Exception as exc:
+            logger.debug("Answering shed callback query %s failed: %s", update.callback_query.id, exc)
+
+    def _release(self, key: Hashable) -> None:
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            return
+        while waiters:
+            turn = waiters.popleft()
+            if not turn.done():
+                turn.set_result(None)
+                return
+        del self._waiters[key]
+
+    async def initialize(self) -> None:
+        if self._max_callback_age is not None:
+            self._started = time.time()
+            self._backlog_until = time.monotonic() + self._max_callback_age
+
+    async def shutdown(self) -> None:
+        for waiters in self._waiters.values():
+            for turn in waiters:
+                turn.cancel()
+        self._waiters.clear()
+        self._waiting_taps.clear()